@@ -1,10 +1,18 @@
 # app.py
 import streamlit as st
-import cv2
-import numpy as np
-import time
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+from functools import partial
 from threading import Event
 
+import detectors
+import metrics
+from autotune import LatencyController
+import model_registry
+import pipeline
+from cloak import CLOAK_COLORS, MASK_QUALITY
+from plate_ocr import PlateRecognitionStage, default_recognizer
+from thread_budget import configure
+
 st.set_page_config(
     page_title="AI Vision Hub",
     page_icon="🤖",
@@ -52,137 +60,216 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-CLOAK_COLORS = {
-    'Red': {
-        'lower1': np.array([0, 120, 70]),
-        'upper1': np.array([10, 255, 255]),
-        'lower2': np.array([170, 120, 70]),
-        'upper2': np.array([180, 255, 255]),
-        'has_two_ranges': True,
-        'emoji': '🔴'
-    },
-    'Blue': {
-        'lower1': np.array([100, 150, 50]),
-        'upper1': np.array([140, 255, 255]),
-        'has_two_ranges': False,
-        'emoji': '🔵'
-    },
-    'Green': {
-        'lower1': np.array([40, 50, 50]),
-        'upper1': np.array([80, 255, 255]),
-        'has_two_ranges': False,
-        'emoji': '🟢'
-    },
-    'Yellow': {
-        'lower1': np.array([20, 100, 100]),
-        'upper1': np.array([30, 255, 255]),
-        'has_two_ranges': False,
-        'emoji': '🟡'
-    },
-    'Black': {
-        'lower1': np.array([0, 0, 0]),
-        'upper1': np.array([180, 255, 50]),
-        'has_two_ranges': False,
-        'emoji': '⚫'
-    }
+MODE_STAGES = {
+    "Face Detection": ['face'],
+    "Face, Eye & Smile Detection": ['face_eye_smile'],
+    "Number Plate Detection": ['plate'],
+    "Face & Number Plate Detection": ['face', 'plate'],
 }
 
-def run_face_detection(frame):
-    face_cascade = cv2.CascadeClassifier('models/haarcascade_frontalface_default.xml')
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-    for (x, y, w, h) in faces:
-        cv2.rectangle(frame, (x, y), (x+w, y+h), (255, 165, 0), 3)
-        cv2.putText(frame, 'Face', (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 165, 0), 2)
-    return frame
-
-def run_face_eye_smile_detection(frame):
-    face_cascade = cv2.CascadeClassifier('models/haarcascade_frontalface_default.xml')
-    eye_cascade = cv2.CascadeClassifier('models/haarcascade_eye.xml')
-    smile_cascade = cv2.CascadeClassifier('models/haarcascade_smile.xml')
-    
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-    for (x, y, w, h) in faces:
-        cv2.rectangle(frame, (x, y), (x+w, y+h), (255, 0, 0), 2)
-        cv2.putText(frame, "Face", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255,0,0), 2)
-        roi_gray = gray[y:y+h, x:x+w]
-        roi_color = frame[y:y+h, x:x+w]
-        
-        eyes = eye_cascade.detectMultiScale(roi_gray, 1.1, 22)
-        for (ex, ey, ew, eh) in eyes:
-            cv2.rectangle(roi_color, (ex, ey), (ex+ew, ey+eh), (0, 255, 0), 2)
-            
-        smiles = smile_cascade.detectMultiScale(roi_gray, 1.8, 20)
-        for (sx, sy, sw, sh) in smiles:
-            cv2.rectangle(roi_color, (sx, sy), (sx+sw, sh+sy), (0, 0, 255), 2)
-            
-    return frame
-
-def run_number_plate_detection(frame):
-    plate_cascade = cv2.CascadeClassifier('models/haarcascade_russian_plate_number.xml')
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    plates = plate_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=10)
-    for (x, y, w, h) in plates:
-        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 3)
-        cv2.putText(frame, "Number Plate", (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-    return frame
-
-def run_invisibility_cloak(stop_event, placeholder, selected_color_name='Red'):
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
+def make_stages(app_mode, detect_interval, scheduler=None, target_fps=None, motion=None, recognizer=None,
+                **settings):
+    modes = MODE_STAGES[app_mode]
+    if len(modes) > 1 and motion is None:
+        # Face and plate cascades share one image pyramid per frame
+        stages = [pipeline.multi_detector_stage(modes, detect_interval, **settings)]
+    else:
+        stages = [pipeline.detector_stage(mode, detect_interval, scheduler=scheduler, motion=motion, **settings)
+                  for mode in modes]
+    controller = LatencyController(stages, target_fps) if target_fps else None
+    if controller:
+        stages.append(controller)
+    if recognizer is not None and 'plate' in modes:
+        # After the controller: OCR time is not a detector setting it could tune away
+        stages.append(PlateRecognitionStage(recognizer))
+    return stages + [pipeline.Annotator()], controller
+
+@st.cache_resource
+def plate_recognizer():
+    return default_recognizer()
+
+def operating_point_sink(panel, controller, interval=1.0):
+    last_refresh = [0.0]
+
+    def refresh(ctx):
+        if ctx.timestamp - last_refresh[0] < interval:
+            return
+        last_refresh[0] = ctx.timestamp
+        point = controller.operating_point()
+        latency = f"{point['latency_ms']:.1f}" if point['latency_ms'] is not None else "-"
+        panel.caption(
+            f"Auto-tune level {point['level']}: width {point['detect_width']} px, "
+            f"scaleFactor {point['scale_factor']}, every {point['detect_interval']} frames "
+            f"({latency} / {point['budget_ms']:.1f} ms)"
+        )
+
+    return pipeline.CallbackSink(refresh, name="autotune_panel")
+
+def cloak_timings_sink(panel, cloak_stage, interval=1.0):
+    last_refresh = [0.0]
+
+    def refresh(ctx):
+        if ctx.timestamp - last_refresh[0] < interval:
+            return
+        last_refresh[0] = ctx.timestamp
+        stats = cloak_stage.stats()
+        panel.caption(
+            f"Cloak ({stats['quality']} mask), ms/frame: "
+            + ", ".join(f"{step} {ms:.1f}" for step, ms in stats['step_ms'].items())
+        )
+
+    return pipeline.CallbackSink(refresh, name="cloak_panel")
+
+def capture_sidebar():
+    st.sidebar.subheader("Capture")
+    source = st.sidebar.text_input(
+        "Source", "0",
+        help="Camera index, video file, or a raw recording (frame store directory) to replay at its recorded timing.",
+    )
+    record_to = st.sidebar.text_input(
+        "Record raw frames to", "",
+        help="Frame store directory; every captured frame is kept unencoded for exact replay.",
+    )
+    capacity_mb = st.sidebar.number_input(
+        "Recording capacity (MB)", 64, 65536, 2048, step=256, disabled=not record_to,
+        help="Disk space preallocated for the recording; frames beyond it are dropped and counted.",
+    )
+    max_frames = st.sidebar.number_input("Recording max frames", 100, 1_000_000, 100_000, step=1000,
+                                         disabled=not record_to)
+    overwrite = st.sidebar.checkbox("Overwrite an existing recording", value=False, disabled=not record_to)
+    return dict(source=source, record_to=record_to or None, capacity_mb=int(capacity_mb),
+                max_frames=int(max_frames), overwrite=overwrite, realtime=True)
+
+def open_capture(capture_settings):
+    # Only called once the camera is started: a recorder replaces the store it writes to
+    try:
+        return pipeline.CaptureSource(**capture_settings)
+    except FileExistsError as e:
+        st.error(f"{e}. Tick 'Overwrite an existing recording' or choose another directory.")
+        return None
+
+def recording_sink(panel, source, interval=1.0):
+    last_refresh = [0.0]
+
+    def refresh(ctx):
+        if ctx.timestamp - last_refresh[0] < interval:
+            return
+        last_refresh[0] = ctx.timestamp
+        stats = source.stats()
+        if stats['record_dropped']:
+            panel.warning(f"Recording full: {stats['recorded']} frames recorded, {stats['record_dropped']} "
+                          "not recorded. Raise the recording capacity or max frames.")
+        else:
+            panel.caption(f"Recording: {stats['recorded']} frames")
+
+    return pipeline.CallbackSink(refresh, name="recording_panel")
+
+def display_sidebar():
+    st.sidebar.subheader("Display Settings")
+    return dict(
+        width=st.sidebar.select_slider(
+            "Display width (px)", options=[320, 480, 640, 960, 1280], value=960,
+            help="Frames are downsized to this width before they are sent to the browser.",
+        ),
+        fps=st.sidebar.slider("Display fps", 1, 30, 15, help="Processing keeps running at full rate."),
+        quality=st.sidebar.slider("JPEG quality", 30, 95, 80, step=5),
+    )
+
+def make_display_sink(placeholder, display_settings, **image_options):
+    # JPEG bytes from the BGR frame are passed through by st.image as-is
+    publish = partial(placeholder.image, output_format="JPEG", **image_options)
+    return pipeline.DisplaySink(publish, thread_setup=add_script_run_ctx, **display_settings)
+
+def metrics_sidebar():
+    st.sidebar.subheader("Live Metrics")
+    show_panel = st.sidebar.checkbox("Show live metrics panel", value=False)
+    export = st.sidebar.checkbox(
+        "Export Prometheus metrics", value=False,
+        help="Serves per-stage counters and histograms at http://127.0.0.1:<port>/metrics.",
+    )
+    port = st.sidebar.number_input("Metrics port", 1024, 65535, 9108, disabled=not export)
+    if export:
+        try:
+            metrics.serve(port=int(port))
+        except OSError as e:
+            st.sidebar.error(f"Cannot serve metrics on port {port}: {e}")
+            export = False
+    panel = st.sidebar.empty() if show_panel else None
+    return panel, show_panel or export
+
+def metrics_panel_sink(panel, pipeline_metrics, interval=1.0):
+    last_refresh = [0.0]
+
+    def refresh(ctx):
+        if ctx.timestamp - last_refresh[0] < interval:
+            return
+        last_refresh[0] = ctx.timestamp
+        summary = pipeline_metrics.summary()
+        lines = [
+            f"**Capture:** {summary['capture_fps']:.1f} fps, {summary['delivered_fps']:.1f} fps delivered, "
+            f"{summary['dropped']} dropped, {summary['frames']} processed",
+            "",
+            "| Stage | mean ms | p50 ms | p95 ms |",
+            "|---|---|---|---|",
+        ]
+        lines += [
+            f"| {stage} | {h['mean'] * 1000:.1f} | {h['p50'] * 1000:.1f} | {h['p95'] * 1000:.1f} |"
+            for stage, h in summary['stages'].items()
+        ]
+        if summary['detections']:
+            lines += ["", f"**Detections per frame:** {summary['detections']['mean']:.2f}"]
+        panel.markdown("\n".join(lines))
+
+    return pipeline.CallbackSink(refresh, name="metrics_panel")
+
+def run_invisibility_cloak(stop_event, placeholder, selected_color_name='Red', adapt_rate=0.05,
+                           metrics_panel=None, collect_metrics=False, display_settings=None,
+                           capture_settings=None, quality='full', timings_panel=None, recording_panel=None):
+    source = open_capture(capture_settings or {})
+    if source is None:
+        return
+    if not source.isOpened():
         st.error("Cannot open camera.")
+        source.close()
         return
 
-    time.sleep(2)
-    color_settings = CLOAK_COLORS[selected_color_name]
-    
-    st.info("Capturing background for Invisibility Cloak... Please step out of frame for a moment.")
-    background_frame = None
-    for i in range(30):
-        ret, bg = cap.read()
-        if ret:
-            background_frame = np.flip(bg, axis=1)
-    st.success(f"Background captured! You can now use the {selected_color_name} cloak.")
-
-    while not stop_event.is_set():
-        ret, frame = cap.read()
-        if not ret:
+    pipeline_metrics = metrics.PipelineMetrics('cloak') if collect_metrics else None
+    sinks = [make_display_sink(placeholder, display_settings or {}, use_container_width=True)]
+    if recording_panel is not None and source.capture.recorder is not None:
+        sinks.append(recording_sink(recording_panel, source))
+    if metrics_panel is not None:
+        sinks.append(metrics_panel_sink(metrics_panel, pipeline_metrics))
+    cloak_stage = pipeline.CloakStage(selected_color_name, adapt_rate=adapt_rate, quality=quality)
+    if timings_panel is not None:
+        sinks.append(cloak_timings_sink(timings_panel, cloak_stage))
+    cloak_pipeline = pipeline.Pipeline(source, [cloak_stage], sinks, pipeline_metrics)
+    try:
+        st.info("The background is learned continuously from everything the cloak does not cover. "
+                "Step out of frame for a moment for the cleanest start.")
+        if not cloak_pipeline.run(should_stop=stop_event.is_set):
             st.error("Failed to capture video.")
-            break
-            
-        frame = np.flip(frame, axis=1)
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        
-        mask1 = cv2.inRange(hsv, color_settings['lower1'], color_settings['upper1'])
-        
-        if color_settings['has_two_ranges']:
-            mask2 = cv2.inRange(hsv, color_settings['lower2'], color_settings['upper2'])
-            mask = mask1 + mask2
-        else:
-            mask = mask1
-        
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8), iterations=2)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_DILATE, np.ones((3, 3), np.uint8), iterations=1)
-        
-        mask_inv = cv2.bitwise_not(mask)
-        
-        res1 = cv2.bitwise_and(background_frame, background_frame, mask=mask)
-        res2 = cv2.bitwise_and(frame, frame, mask=mask_inv)
-        
-        final_output_bgr = cv2.addWeighted(res1, 1, res2, 1, 0)
-        final_output_rgb = cv2.cvtColor(final_output_bgr, cv2.COLOR_BGR2RGB)
-        placeholder.image(final_output_rgb, use_container_width=True)
-
-    cap.release()
+    finally:
+        cloak_pipeline.close()
 
 st.markdown("<h1 class='title-text'>AI Vision Hub 📸</h1>", unsafe_allow_html=True)
 st.sidebar.title("Project Selection")
 app_mode = st.sidebar.radio(
     "Choose a Project",
-    ["Home", "Face Detection", "Face, Eye & Smile Detection", "Number Plate Detection", "Invisibility Cloak"]
+    ["Home", "Face Detection", "Face, Eye & Smile Detection", "Number Plate Detection",
+     "Face & Number Plate Detection", "Invisibility Cloak"]
 )
 
+if app_mode != "Home":
+    # OpenCV/BLAS threads from this host's tuned budget (python thread_budget.py tune)
+    configure('cloak' if app_mode == "Invisibility Cloak" else 'detect')
+
+MODE_MODELS = {
+    "Face Detection": ['face'],
+    "Face, Eye & Smile Detection": ['face', 'eye', 'smile'],
+    "Number Plate Detection": ['plate'],
+    "Face & Number Plate Detection": ['face', 'plate'],
+}
+
 if app_mode == "Home":
     st.header("Welcome to the AI Vision Hub!")
     st.write("""
@@ -207,6 +294,17 @@ elif app_mode == "Invisibility Cloak":
     selected_color = selected_color_display.split(' ', 1)[1]
     
     st.info(f"✨ You selected: **{selected_color}** cloak. Use a {selected_color.lower()} colored cloth for best results!")
+
+    adapt_rate = st.slider(
+        "Background adaptation rate", 0.01, 0.5, 0.05, step=0.01,
+        help="How quickly the background follows lighting and camera changes.",
+    )
+    mask_quality = st.selectbox(
+        "Mask quality", list(MASK_QUALITY), index=0,
+        help="'full' builds a hard-edged mask at camera resolution. The other presets build it at "
+             "reduced resolution and blend a soft matte (edge-aware with 'high'): cheaper and without seams.",
+    )
+    timings_panel = st.empty()
     
     col1, col2 = st.columns(2)
     with col1:
@@ -219,12 +317,18 @@ elif app_mode == "Invisibility Cloak":
     if 'stop_event' not in st.session_state:
         st.session_state.stop_event = Event()
 
+    capture_settings = capture_sidebar()
+    recording_panel = st.sidebar.empty()
+    display_settings = display_sidebar()
+    metrics_panel, collect_metrics = metrics_sidebar()
     image_placeholder = st.empty()
     
     if start_button:
         st.session_state.cloak_running = True
         st.session_state.stop_event.clear()
-        run_invisibility_cloak(st.session_state.stop_event, image_placeholder, selected_color)
+        run_invisibility_cloak(st.session_state.stop_event, image_placeholder, selected_color, adapt_rate,
+                               metrics_panel, collect_metrics, display_settings, capture_settings,
+                               mask_quality, timings_panel, recording_panel)
         
     if stop_button:
         st.session_state.cloak_running = False
@@ -247,28 +351,89 @@ else:
     if stop_cam:
         st.session_state.stop = True
 
-    FRAME_WINDOW = st.image([])
-    cap = cv2.VideoCapture(0)
+    try:
+        model_registry.preload(MODE_MODELS[app_mode])
+    except (FileNotFoundError, ValueError) as e:
+        st.error(str(e))
+        st.stop()
+    load_times = model_registry.load_times()
+    st.sidebar.caption("Model load times: " + ", ".join(
+        f"{name} {load_times[name] * 1000:.0f} ms" for name in MODE_MODELS[app_mode]
+    ))
 
-    while not st.session_state.stop:
-        ret, frame = cap.read()
-        if not ret:
-            st.error("Failed to capture image from camera.")
-            st.session_state.stop = True
-            break
-        
-        if app_mode == "Face Detection":
-            output_frame_bgr = run_face_detection(frame)
-        elif app_mode == "Face, Eye & Smile Detection":
-            output_frame_bgr = run_face_eye_smile_detection(frame)
-        elif app_mode == "Number Plate Detection":
-            output_frame_bgr = run_number_plate_detection(frame)
-        else:
-            output_frame_bgr = frame
-        
-        output_frame_rgb = cv2.cvtColor(output_frame_bgr, cv2.COLOR_BGR2RGB)
-        FRAME_WINDOW.image(output_frame_rgb)
-        
+    st.sidebar.subheader("Detection Settings")
+    detect_width = st.sidebar.select_slider(
+        "Detection width (px)", options=[320, 480, 640, 960, 1280, 1920], value=640,
+        help="Frames wider than this are downscaled for detection; boxes are mapped back to full resolution.",
+    )
+    min_object = st.sidebar.slider("Minimum object width (px, 0 = no limit)", 0, 400, 0, step=10)
+    max_object = st.sidebar.slider("Maximum object width (px, 0 = no limit)", 0, 1920, 0, step=20)
+    detect_interval = st.sidebar.slider(
+        "Detect every N frames", 1, 30, 5,
+        help="Boxes are tracked with optical flow between detections. 1 runs the cascade on every frame.",
+    )
+    scheduler = None
+    if app_mode == "Face, Eye & Smile Detection":
+        budget_ms = st.sidebar.slider(
+            "Eye/smile time budget per frame (ms, 0 = no limit)", 0, 50, 0,
+            help="Faces that do not fit in the budget are served on later frames.",
+        )
+        scheduler = detectors.SubDetectionScheduler(budget_ms=budget_ms or None)
+    motion = None
+    if st.sidebar.checkbox("Skip static frames", value=False,
+                           help="Reuse the last detections while the scene does not change."):
+        motion = dict(
+            threshold=st.sidebar.slider("Motion threshold (% of pixels changed)", 0.1, 5.0, 0.5, step=0.1) / 100,
+            refresh_frames=st.sidebar.slider("Full detection at least every N detections", 5, 300, 30),
+            regions=st.sidebar.checkbox("Search only changed regions", value=True),
+        )
+    target_fps = None
+    if st.sidebar.checkbox("Auto-tune to a target frame rate", value=False,
+                           help="Adjusts detection width, scaleFactor and interval from measured stage times. "
+                                "The settings above are the starting point."):
+        target_fps = st.sidebar.slider("Target fps", 5, 60, 15)
+    autotune_panel = st.sidebar.empty()
+    recognizer = None
+    if 'plate' in MODE_STAGES[app_mode]:
+        recognizer = plate_recognizer()
+        if recognizer is None:
+            st.sidebar.caption("Plate text recognition needs pytesseract and the tesseract binary.")
+        elif not st.sidebar.checkbox("Read plate text (OCR)", value=True,
+                                     help="Each distinct plate is recognized once; repeats come from a cache."):
+            recognizer = None
+    stages, controller = make_stages(
+        app_mode, detect_interval, scheduler, target_fps, motion=motion, recognizer=recognizer,
+        detect_width=detect_width, min_size=min_object or None, max_size=max_object or None,
+    )
+
+    capture_settings = capture_sidebar()
+    recording_panel = st.sidebar.empty()
+    display_settings = display_sidebar()
+    metrics_panel, collect_metrics = metrics_sidebar()
+    pipeline_metrics = metrics.PipelineMetrics("+".join(MODE_STAGES[app_mode])) if collect_metrics else None
+
+    FRAME_WINDOW = st.image([])
+    sinks = [make_display_sink(FRAME_WINDOW, display_settings)]
+    if metrics_panel is not None:
+        sinks.append(metrics_panel_sink(metrics_panel, pipeline_metrics))
+    if controller is not None:
+        sinks.append(operating_point_sink(autotune_panel, controller))
+    if st.session_state.stop:
+        st.info("Camera is off.")
     else:
-        cap.release()
-        st.info("Camera is off.")
\ No newline at end of file
+        source = open_capture(capture_settings)
+        if source is None:
+            st.session_state.stop = True
+            st.stop()
+        if source.capture.recorder is not None:
+            sinks.append(recording_sink(recording_panel, source))
+        detection_pipeline = pipeline.Pipeline(source, stages, sinks, pipeline_metrics)
+
+        try:
+            if not detection_pipeline.run(should_stop=lambda: st.session_state.stop):
+                st.error("Failed to capture image from camera.")
+                st.session_state.stop = True
+            else:
+                st.info("Camera is off.")
+        finally:
+            detection_pipeline.close()
@@ -0,0 +1,189 @@
+"""
+Autotune - Latency-budget controller for detector parameters
+
+Purpose: Hold a frame-rate (or per-frame latency) target on any host instead
+of hard-coding detector parameters. LatencyController is a pipeline stage,
+placed after the detector stages, that measures their processing time per
+frame and walks a ladder of operating points (detection width, scaleFactor,
+detect interval) ordered from most accurate to cheapest:
+
+    over budget for a full window       -> one step cheaper
+    (over twice the budget for a quarter window)
+    under upgrade_ratio * budget        -> one step more accurate
+
+The controller starts at the stages' configured settings, placed on the
+ladder by estimated cost, and changes nothing until it has measured a
+window.
+
+Hysteresis: every change is followed by a full measurement window, and a
+level that had to be abandoned is locked out for a back-off period that
+doubles each time it fails, so the controller settles instead of oscillating.
+Every change is logged and the current operating point is exposed.
+
+Example:
+    detector = detector_stage('face')
+    controller = LatencyController([detector], target_fps=25)
+    Pipeline(source, [detector, controller, Annotator()], sinks).run()
+    print(controller.operating_point())
+"""
+
+import inspect
+import logging
+import math
+from collections import deque, namedtuple
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+OperatingPoint = namedtuple("OperatingPoint", "detect_width scale_factor detect_interval")
+
+# Most accurate first; each step costs less than the one before
+LEVELS = (
+    OperatingPoint(1280, 1.05, 1),
+    OperatingPoint(960, 1.1, 1),
+    OperatingPoint(800, 1.1, 2),
+    OperatingPoint(640, 1.1, 3),
+    OperatingPoint(640, 1.2, 4),
+    OperatingPoint(480, 1.2, 5),
+    OperatingPoint(480, 1.3, 6),
+    OperatingPoint(320, 1.3, 8),
+    OperatingPoint(320, 1.5, 10),
+)
+
+# Default targets when only the modes are known
+MODE_TARGET_FPS = {
+    'face': 30,
+    'plate': 20,
+    'face_eye_smile': 15,
+}
+
+
+def _cost(point):
+    """Relative cascade cost: pixels scanned per pyramid level, levels per size range, per frame."""
+    if point.detect_width is None:
+        return math.inf
+    return point.detect_width ** 2 / (math.log(point.scale_factor) * point.detect_interval)
+
+
+def _configured_point(stage):
+    """Operating point a stage is configured with (its detect partial, possibly wrapped, e.g. by MotionGate)."""
+    detect = stage.detect if hasattr(stage, 'trackers') else stage.tracker.detect
+    while not isinstance(detect, partial):
+        detect = detect.detect
+    # A partial's signature carries its bound keywords as defaults
+    parameters = inspect.signature(detect).parameters
+    interval = next(iter(_trackers(stage).values())).detect_interval
+    return OperatingPoint(parameters['detect_width'].default, parameters['scale_factor'].default, interval)
+
+
+def _trackers(stage):
+    """Mode name -> TrackingDetector for a detector stage (one, or several for a shared-pyramid stage)."""
+    trackers = getattr(stage, 'trackers', None)
+    return trackers if trackers is not None else {stage.name: stage.tracker}
+
+
+def _retune(detect, **settings):
+    """Return detect with its keyword settings updated, keeping any wrapper around the partial."""
+    if isinstance(detect, partial):
+        return partial(detect.func, *detect.args, **dict(detect.keywords, **settings))
+    detect.detect = _retune(detect.detect, **settings)
+    if 'detect_width' in settings and hasattr(detect, 'detect_width'):
+        # MotionGate scales its region searches from the full pass's width
+        detect.detect_width = settings['detect_width']
+    return detect
+
+
+class LatencyController:
+    """Pipeline stage that tunes detector stages to a per-frame latency budget."""
+
+    name = "autotune"
+
+    def __init__(self, stages, target_fps=None, budget_ms=None, levels=LEVELS, window=30,
+                 upgrade_ratio=0.6, backoff_frames=150, exclude=('capture',)):
+        """
+        Args:
+            stages: Detector stages to control, as built by pipeline.detector_stage
+                or pipeline.multi_detector_stage
+            target_fps: Frame-rate target; converted to a budget of 1000 / fps ms
+            budget_ms: Per-frame processing budget; defaults to the strictest
+                MODE_TARGET_FPS of the stages' modes
+            levels: Operating points, most accurate first; the stages' configured
+                point is inserted by cost unless it is one of them
+            window: Frames averaged per decision (and waited after each change)
+            upgrade_ratio: Step up only when latency is below this share of the budget
+            backoff_frames: Frames a failed level is locked out; doubles per failure
+            exclude: Timings not counted as processing (source reads wait for the camera)
+        """
+        if budget_ms is None:
+            if target_fps is None:
+                target_fps = max(MODE_TARGET_FPS.get(mode, 15) for stage in stages for mode in _trackers(stage))
+            budget_ms = 1000.0 / target_fps
+        self.stages = list(stages)
+        self.budget_ms = budget_ms
+        self.levels = list(levels)
+        self.upgrade_ratio = upgrade_ratio
+        self.backoff_frames = backoff_frames
+        self.exclude = set(exclude)
+        self.changes = 0
+        self.frame = 0
+        self._latencies = deque(maxlen=window)
+        self._failures = {}
+        self._locked_until = {}
+
+        # Start where the stages already are; settings change only on measured latency
+        start = _configured_point(self.stages[0])
+        if start not in self.levels:
+            self.levels.append(start)
+            self.levels.sort(key=_cost, reverse=True)
+        self.level = self.levels.index(start)
+        logger.info("Autotune starts at level %d %s, budget %.1f ms", self.level, self.point, self.budget_ms)
+
+    @property
+    def point(self):
+        return self.levels[self.level]
+
+    def _apply(self):
+        point = self.point
+        settings = dict(detect_width=point.detect_width, scale_factor=point.scale_factor)
+        for stage in self.stages:
+            if hasattr(stage, 'trackers'):
+                # Shared-pyramid stage: one detect callable feeds all its trackers
+                stage.detect = _retune(stage.detect, **settings)
+            else:
+                stage.tracker.detect = _retune(stage.tracker.detect, **settings)
+            for tracker in _trackers(stage).values():
+                tracker.detect_interval = point.detect_interval
+
+    def process(self, ctx):
+        self.frame += 1
+        self._latencies.append(1000 * sum(t for name, t in ctx.timings.items() if name not in self.exclude))
+        count = len(self._latencies)
+        latency = sum(self._latencies) / count
+        # Far over budget, a quarter window is enough evidence to step down
+        if count < self._latencies.maxlen and not (
+                count >= max(1, self._latencies.maxlen // 4) and latency > 2 * self.budget_ms):
+            return
+        if latency > self.budget_ms and self.level < len(self.levels) - 1:
+            failures = self._failures[self.level] = self._failures.get(self.level, 0) + 1
+            self._locked_until[self.level] = self.frame + self.backoff_frames * 2 ** (failures - 1)
+            self._change(self.level + 1, latency)
+        elif (latency < self.upgrade_ratio * self.budget_ms and self.level > 0
+              and self.frame >= self._locked_until.get(self.level - 1, 0)):
+            self._change(self.level - 1, latency)
+
+    def _change(self, level, latency):
+        old_level, old = self.level, self.point
+        self.level = level
+        self._apply()
+        self._latencies.clear()
+        self.changes += 1
+        logger.info("Autotune level %d -> %d at %.1f ms/frame (budget %.1f ms): "
+                    "width %s -> %s, scaleFactor %.2f -> %.2f, interval %d -> %d",
+                    old_level, level, latency, self.budget_ms, old.detect_width, self.point.detect_width,
+                    old.scale_factor, self.point.scale_factor, old.detect_interval, self.point.detect_interval)
+
+    def operating_point(self):
+        """Return the current level, its settings, the budget and the latest measured latency."""
+        latency = sum(self._latencies) / len(self._latencies) if self._latencies else None
+        return dict(self.point._asdict(), level=self.level, budget_ms=self.budget_ms,
+                    latency_ms=latency, changes=self.changes)
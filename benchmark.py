@@ -0,0 +1,294 @@
+"""
+Benchmark - Reproducible headless performance suite for every mode
+
+Purpose: Measure face, face/eye/smile, plate, cloak (per color) and Canny
+pipelines on deterministic synthetic frames at several resolutions, without a
+camera. Reports per-stage time, end-to-end fps, p50/p95/p99 latency and peak
+memory, writes JSON, and compares against a stored baseline so regressions
+fail the run.
+
+Usage:
+    python benchmark.py --output results.json
+    python benchmark.py --save-baseline                      # record this machine's baseline
+    python benchmark.py --baseline benchmark_baseline.json --threshold 0.15
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import model_registry
+import pipeline
+from cloak import CLOAK_COLORS
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_RESOLUTIONS = ((640, 480), (1280, 720), (1920, 1080))
+DEFAULT_BASELINE = "benchmark_baseline.json"
+DETECTION_MODES = ('face', 'face_eye_smile', 'plate')
+# Face and plate together: separate cascade calls vs one shared image pyramid
+COMBINED_MODES = ('face_plate', 'face_plate_shared')
+MODES = DETECTION_MODES + COMBINED_MODES + tuple(f"cloak_{name.lower()}" for name in CLOAK_COLORS) + ('canny',)
+
+# Metric -> True when larger values are better
+COMPARED_METRICS = {'fps': True, 'p50_ms': False, 'p95_ms': False}
+
+
+def _color_bgr(color_settings):
+    """BGR color in the middle of a cloak color's (first) HSV range."""
+    hsv = (color_settings['lower1'] + color_settings['upper1']) // 2
+    return tuple(int(v) for v in cv2.cvtColor(np.uint8([[hsv]]), cv2.COLOR_HSV2BGR)[0, 0])
+
+
+def synthetic_scene(width, height, frames, seed=0, color='Red'):
+    """
+    Build a deterministic panning scene wide enough for frames frames.
+
+    Smooth random texture (camera-like locality) with a cloak-colored ellipse
+    and a few high-contrast rectangles so every mode has work to do.
+    """
+    rng = np.random.default_rng(seed)
+    scene_width = width + 2 * frames
+    coarse = rng.integers(0, 256, (max(2, height // 16), max(2, scene_width // 16), 3), dtype=np.uint8)
+    scene = cv2.resize(coarse, (scene_width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(6):
+        x, y = int(rng.integers(0, scene_width - width // 8)), int(rng.integers(0, height - height // 8))
+        cv2.rectangle(scene, (x, y), (x + width // 8, y + height // 16), (255, 255, 255), -1)
+    cv2.ellipse(scene, (scene_width // 2, height // 2), (width // 6, height // 4), 0, 0, 360,
+                _color_bgr(CLOAK_COLORS[color]), -1)
+    return scene
+
+
+class SyntheticSource:
+    """Pipeline source panning across a synthetic scene; each frame is a fresh copy."""
+
+    name = "capture"
+
+    def __init__(self, width, height, frames, seed=0, color='Red'):
+        self.width = width
+        self.frames = frames
+        self.scene = synthetic_scene(width, height, frames, seed, color)
+        self.index = 0
+
+    def read(self):
+        if self.index >= self.frames:
+            return None
+        x = 2 * self.index
+        ctx = pipeline.FrameContext(self.scene[:, x:x + self.width].copy(), self.index, time.time())
+        self.index += 1
+        return ctx
+
+    def close(self):
+        pass
+
+
+def build_stages(mode, detect_width=640, detect_interval=1):
+    """Return the pipeline stages for a benchmark mode."""
+    if mode in DETECTION_MODES:
+        return [pipeline.detector_stage(mode, detect_interval, detect_width=detect_width), pipeline.Annotator()]
+    if mode == 'face_plate':
+        return [pipeline.detector_stage('face', detect_interval, detect_width=detect_width),
+                pipeline.detector_stage('plate', detect_interval, detect_width=detect_width), pipeline.Annotator()]
+    if mode == 'face_plate_shared':
+        return [pipeline.multi_detector_stage(('face', 'plate'), detect_interval, detect_width=detect_width),
+                pipeline.Annotator()]
+    if mode.startswith('cloak_'):
+        return [pipeline.CloakStage(mode[len('cloak_'):].capitalize())]
+    if mode == 'canny':
+        return [pipeline.EdgeStage()]
+    raise ValueError(f"Unknown benchmark mode: {mode}")
+
+
+def _run(mode, width, height, frames, seed, detect_width, detect_interval, color):
+    stages = build_stages(mode, detect_width, detect_interval)
+    runner = pipeline.Pipeline(SyntheticSource(width, height, frames, seed, color), stages)
+    latencies = []
+    stage_totals = {}
+    start = time.perf_counter()
+    while True:
+        ctx = runner.step()
+        if ctx is None:
+            break
+        # Latency covers processing only; the synthetic source is not a real capture
+        latencies.append(sum(t for name, t in ctx.timings.items() if name != 'capture'))
+        for name, elapsed in ctx.timings.items():
+            if name != 'capture':
+                stage_totals[name] = stage_totals.get(name, 0.0) + elapsed
+    wall = time.perf_counter() - start
+    runner.close()
+    return latencies, stage_totals, wall
+
+
+def run_case(mode, width, height, frames=30, warmup=3, seed=0, detect_width=640, detect_interval=1):
+    """
+    Benchmark one mode at one resolution.
+
+    Returns:
+        Dict with fps, mean/p50/p95/p99 latency (ms), per-stage mean ms and
+        peak traced memory (MB)
+    """
+    color = mode[len('cloak_'):].capitalize() if mode.startswith('cloak_') else 'Red'
+    if warmup:
+        _run(mode, width, height, warmup, seed, detect_width, detect_interval, color)
+
+    latencies, stage_totals, wall = _run(mode, width, height, frames, seed, detect_width, detect_interval, color)
+
+    # Separate short pass for memory so tracing does not distort the timings
+    tracemalloc.start()
+    try:
+        _run(mode, width, height, min(frames, 5), seed, detect_width, detect_interval, color)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, (50, 95, 99))
+    return {
+        'mode': mode,
+        'resolution': f"{width}x{height}",
+        'frames': len(latencies),
+        'fps': len(latencies) / wall if wall > 0 else 0.0,
+        'mean_ms': float(latencies_ms.mean()),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'stage_ms': {name: 1000 * total / len(latencies) for name, total in stage_totals.items()},
+        'peak_traced_mb': peak / 2 ** 20,
+    }
+
+
+def run_suite(modes=MODES, resolutions=DEFAULT_RESOLUTIONS, frames=30, warmup=3, seed=0,
+              detect_width=640, detect_interval=1, progress=None):
+    """
+    Run every mode at every resolution.
+
+    Args:
+        progress: Optional callback(result) after each case
+
+    Returns:
+        Dict with 'meta' (environment and settings) and 'results' keyed by
+        "<mode>@<width>x<height>"
+    """
+    model_registry.preload(['face', 'eye', 'smile', 'plate'])
+    results = {}
+    for mode in modes:
+        for width, height in resolutions:
+            result = run_case(mode, width, height, frames, warmup, seed, detect_width, detect_interval)
+            results[f"{mode}@{width}x{height}"] = result
+            if progress is not None:
+                progress(result)
+
+    meta = {
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'opencv_threads': cv2.getNumThreads(),
+        'frames': frames,
+        'warmup': warmup,
+        'seed': seed,
+        'detect_width': detect_width,
+        'detect_interval': detect_interval,
+    }
+    if resource is not None:
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        meta['max_rss_mb'] = max_rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+    return {'meta': meta, 'results': results}
+
+
+def compare(current, baseline, threshold=0.10):
+    """
+    Compare results against a baseline.
+
+    Args:
+        current, baseline: Outputs of run_suite (or loaded JSON)
+        threshold: Allowed relative slowdown, e.g. 0.10 for 10%
+
+    Returns:
+        List of human-readable regression descriptions (empty if none)
+    """
+    regressions = []
+    for key, result in current['results'].items():
+        reference = baseline['results'].get(key)
+        if reference is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = reference.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (old - new) / old if higher_is_better else (new - old) / old
+            if change > threshold:
+                regressions.append(f"{key} {metric}: {old:.2f} -> {new:.2f} ({change:+.0%} worse)")
+    return regressions
+
+
+def _parse_resolution(value):
+    try:
+        width, height = (int(v) for v in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected WIDTHxHEIGHT, got {value!r}")
+    return width, height
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmark of every vision mode.")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--resolutions', nargs='+', type=_parse_resolution, default=list(DEFAULT_RESOLUTIONS),
+                        metavar='WxH')
+    parser.add_argument('--frames', type=int, default=30, help="Timed frames per case")
+    parser.add_argument('--warmup', type=int, default=3, help="Untimed frames per case")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--detect-width', type=int, default=640, help="Detection width for cascade modes")
+    parser.add_argument('--detect-interval', type=int, default=1, help="Run cascades every N frames")
+    parser.add_argument('--output', default=None, help="Write results to this JSON file")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Allowed relative regression")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the baseline")
+    args = parser.parse_args()
+
+    def report(result):
+        stages = ", ".join(f"{name} {ms:.1f}" for name, ms in result['stage_ms'].items())
+        print(f"{result['mode']:>16} {result['resolution']:>9}: {result['fps']:7.1f} fps  "
+              f"p50 {result['p50_ms']:.1f} / p95 {result['p95_ms']:.1f} / p99 {result['p99_ms']:.1f} ms  "
+              f"peak {result['peak_traced_mb']:.1f} MB  [{stages}]")
+
+    results = run_suite(args.modes, args.resolutions, args.frames, args.warmup, args.seed,
+                        args.detect_width, args.detect_interval, progress=report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,490 @@
+"""
+Cloak - Color definitions and per-frame compositing for the invisibility cloak
+
+Purpose: Single home for the cloak color ranges (HSV) and the mask/blend steps
+shared by app.py, invisibility_clock.py and the multi-stream engine.
+
+Mask quality presets (MASK_QUALITY): 'full' builds a binary mask at frame
+resolution and copies the background through it. The other presets build the
+color mask and its morphology on a downscaled frame, refine it into a soft
+alpha matte there (a guided filter that snaps the matte to image edges, or a
+plain feather), upsample the matte and blend the background in smoothly, so
+there are no hard seams and the morphology runs on a fraction of the pixels.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+CLOAK_COLORS = {
+    'Red': {
+        'lower1': np.array([0, 120, 70]),
+        'upper1': np.array([10, 255, 255]),
+        'lower2': np.array([170, 120, 70]),
+        'upper2': np.array([180, 255, 255]),
+        'has_two_ranges': True,
+        'emoji': '🔴'
+    },
+    'Blue': {
+        'lower1': np.array([100, 150, 50]),
+        'upper1': np.array([140, 255, 255]),
+        'has_two_ranges': False,
+        'emoji': '🔵'
+    },
+    'Green': {
+        'lower1': np.array([40, 50, 50]),
+        'upper1': np.array([80, 255, 255]),
+        'has_two_ranges': False,
+        'emoji': '🟢'
+    },
+    'Yellow': {
+        'lower1': np.array([20, 100, 100]),
+        'upper1': np.array([30, 255, 255]),
+        'has_two_ranges': False,
+        'emoji': '🟡'
+    },
+    'Black': {
+        'lower1': np.array([0, 0, 0]),
+        'upper1': np.array([180, 255, 50]),
+        'has_two_ranges': False,
+        'emoji': '⚫'
+    }
+}
+
+KERNEL = np.ones((3, 3), np.uint8)
+
+# downscale: integer factor between frame and mask resolution; refine: 'guided'
+# or 'feather'; radius: refinement window in mask pixels; eps: guided filter
+# regularization
+MASK_QUALITY = {
+    'full': None,
+    'high': dict(downscale=2, refine='guided', radius=4, eps=1e-3),
+    'balanced': dict(downscale=2, refine='feather', radius=2),
+    'fast': dict(downscale=4, refine='feather', radius=1),
+}
+
+
+def cloak_mask(frame, color_settings):
+    """
+    Build the cleaned-up cloak mask for a (flipped) BGR frame.
+
+    Returns:
+        uint8 mask, 255 where the cloak color is present
+    """
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, color_settings['lower1'], color_settings['upper1'])
+    if color_settings['has_two_ranges']:
+        mask2 = cv2.inRange(hsv, color_settings['lower2'], color_settings['upper2'])
+        mask = cv2.bitwise_or(mask, mask2)
+
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, KERNEL, iterations=2)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_DILATE, KERNEL, iterations=1)
+    return mask
+
+
+def apply_cloak(frame, background, color_settings):
+    """
+    Replace the cloak-colored region of frame with the background.
+
+    Args:
+        frame: Flipped BGR frame
+        background: Flipped BGR background of the same size
+        color_settings: Entry from CLOAK_COLORS
+
+    Returns:
+        The composited BGR frame
+    """
+    mask = cloak_mask(frame, color_settings)
+    mask_inv = cv2.bitwise_not(mask)
+
+    res1 = cv2.bitwise_and(background, background, mask=mask)
+    res2 = cv2.bitwise_and(frame, frame, mask=mask_inv)
+    return cv2.addWeighted(res1, 1, res2, 1, 0)
+
+
+class BackgroundModel:
+    """
+    Incrementally updated cloak background.
+
+    Instead of blocking on a burst of frames at startup and keeping the last
+    one, the background starts from the first frame and keeps learning from
+    every pixel outside the cloak mask, so it follows lighting and camera
+    changes. Updates are O(pixels) into preallocated buffers.
+
+    Methods:
+        average: exponential running average with weight rate per frame
+        median: approximate running median; each pixel steps towards the new
+            value by at most round(rate * 255) levels per frame
+    """
+
+    def __init__(self, shape, rate=0.05, method='average'):
+        """
+        Args:
+            shape: Frame shape (height, width[, channels])
+            rate: Adaptation rate in (0, 1]; higher follows changes faster
+            method: 'average' or 'median'
+        """
+        if method not in ('average', 'median'):
+            raise ValueError(f"Unknown background method: {method}")
+        if not 0 < rate <= 1:
+            raise ValueError("rate must be in (0, 1]")
+        height, width = shape[:2]
+        self.rate = rate
+        self.method = method
+        self.initialized = False
+        self.background = np.zeros((height, width, 3), np.uint8)
+        self.outside = np.empty((height, width), np.uint8)
+        if method == 'average':
+            self.accumulator = np.zeros((height, width, 3), np.float32)
+        else:
+            step = max(1, round(rate * 255))
+            # A bare number would be Scalar(step, 0, 0, 0) for 3-channel ops
+            self.step = (step, step, step, 0)
+            self.up = np.empty((height, width, 3), np.uint8)
+            self.down = np.empty((height, width, 3), np.uint8)
+
+    def reset(self, frame):
+        """Restart the model from a single frame."""
+        np.copyto(self.background, frame)
+        if self.method == 'average':
+            self.accumulator[...] = frame
+        self.initialized = True
+
+    def update(self, frame, cloak_mask=None):
+        """
+        Learn from the pixels of frame outside the cloak mask.
+
+        Args:
+            frame: BGR frame in display orientation
+            cloak_mask: uint8 mask, nonzero where the cloak is (not learned)
+        """
+        if not self.initialized:
+            self.reset(frame)
+            return self.background
+
+        if cloak_mask is None:
+            self.outside.fill(255)
+        else:
+            cv2.bitwise_not(cloak_mask, dst=self.outside)
+
+        if self.method == 'average':
+            cv2.accumulateWeighted(frame, self.accumulator, self.rate, mask=self.outside)
+            cv2.convertScaleAbs(self.accumulator, dst=self.background)
+        else:
+            # Masked ops leave dst untouched outside the mask, so clear first
+            self.up.fill(0)
+            self.down.fill(0)
+            cv2.subtract(frame, self.background, dst=self.up, mask=self.outside)
+            cv2.subtract(self.background, frame, dst=self.down, mask=self.outside)
+            cv2.min(self.up, self.step, dst=self.up)
+            cv2.min(self.down, self.step, dst=self.down)
+            cv2.add(self.background, self.up, dst=self.background)
+            cv2.subtract(self.background, self.down, dst=self.background)
+        return self.background
+
+
+class CloakCompositor:
+    """
+    Cloak compositing into buffers preallocated for one stream size.
+
+    apply_cloak allocates a flipped copy, HSV image, several masks and three
+    full-frame blends per call. The compositor owns every buffer instead,
+    builds the combined mask in place and blends with a single masked copy of
+    the background over the frame, so steady-state frames allocate nothing.
+    With a reduced-resolution quality preset the mask is built small, refined
+    into a soft matte and blended only inside the matte's bounding box.
+
+    The returned frame is an internal buffer that is overwritten by the next
+    call; copy it if it must outlive the frame. Per-step times of the last
+    frame are in timings (ms); stats() averages them.
+    """
+
+    def __init__(self, shape, color_settings, flip=True, lut=None, background_model=None, quality='full'):
+        """
+        Args:
+            shape: Frame shape (height, width[, channels])
+            color_settings: Entry from CLOAK_COLORS
+            flip: Mirror frames and background horizontally (webcam view)
+            lut: Optional color_lut.ColorLUT of the same shape; masks then come
+                from a table lookup instead of HSV conversion + inRange (with a
+                reduced-resolution quality, a lookup at the mask size is used)
+            background_model: Optional BackgroundModel of the same shape; it
+                is updated from every frame and replaces the stored background
+            quality: Key of MASK_QUALITY
+        """
+        if quality not in MASK_QUALITY:
+            raise ValueError(f"Unknown mask quality: {quality}")
+        height, width = shape[:2]
+        self.shape = (height, width, 3)
+        self.color_settings = color_settings
+        self.flip = flip
+        self.quality = quality
+        self.preset = MASK_QUALITY[quality]
+        self.background_model = background_model
+        self.output = np.empty(self.shape, np.uint8)
+        self.background = np.zeros(self.shape, np.uint8)
+        self.timings = {}
+        self.frames = 0
+        self._totals = {}
+
+        if self.preset is None:
+            mask_shape = (height, width)
+        else:
+            k = self.preset['downscale']
+            mask_shape = (-(-height // k), -(-width // k))
+            self.small = np.empty(mask_shape + (3,), np.uint8)
+            self.matte = np.zeros(mask_shape, np.uint8)
+            # Alpha is upsampled into whole mask pixels, so its buffer may overhang the frame
+            self._alpha = np.zeros((mask_shape[0] * k, mask_shape[1] * k), np.uint8)
+            self.alpha = self._alpha[:height, :width]
+            self.covered = np.zeros((height, width), np.uint8)
+            self.alpha3 = np.empty(self.shape, np.uint8)
+            self.layer = np.empty(self.shape, np.uint8)
+            self.roi = None
+            if self.preset['refine'] == 'guided':
+                self._guide = np.empty(mask_shape, np.uint8)
+                self._float = {name: np.empty(mask_shape, np.float32)
+                               for name in ('I', 'p', 'mean_I', 'mean_p', 'Ip', 'II', 'a', 'b', 'tmp')}
+            if lut is not None:
+                from color_lut import ColorLUT
+
+                lut = ColorLUT(mask_shape)
+        self.lut = lut
+        self.hsv = np.empty(mask_shape + (3,), np.uint8)
+        self.mask = np.empty(mask_shape, np.uint8)
+        self.mask2 = np.empty(mask_shape, np.uint8)
+        self.morph = np.empty(mask_shape, np.uint8)
+
+    def set_background(self, frame):
+        """Store a raw camera frame as the background (mirrored if flip is on)."""
+        if self.flip:
+            cv2.flip(frame, 1, dst=self.background)
+        else:
+            np.copyto(self.background, frame)
+        if self.background_model is not None:
+            self.background_model.reset(self.background)
+
+    def _lap(self, step, start):
+        now = time.perf_counter()
+        self.timings[step] = (now - start) * 1000
+        return now
+
+    def _color_mask(self, image):
+        color_settings = self.color_settings
+        if self.lut is not None:
+            self.lut.mask(image, color_settings, dst=self.mask)
+        else:
+            cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=self.hsv)
+            cv2.inRange(self.hsv, color_settings['lower1'], color_settings['upper1'], dst=self.mask)
+            if color_settings['has_two_ranges']:
+                cv2.inRange(self.hsv, color_settings['lower2'], color_settings['upper2'], dst=self.mask2)
+                cv2.bitwise_or(self.mask, self.mask2, dst=self.mask)
+
+    def compute_mask(self, frame):
+        """
+        Build the cleaned-up cloak mask for a frame already in display orientation.
+
+        Returns:
+            uint8 mask of the frame's size: binary with the 'full' quality,
+            otherwise a soft alpha matte (255 = background only)
+        """
+        start = time.perf_counter()
+        if self.preset is None:
+            self._color_mask(frame)
+            start = self._lap('mask', start)
+            cv2.morphologyEx(self.mask, cv2.MORPH_OPEN, KERNEL, dst=self.morph, iterations=2)
+            cv2.dilate(self.morph, KERNEL, dst=self.mask)
+            self._lap('morphology', start)
+            return self.mask
+
+        cv2.resize(frame, self.small.shape[1::-1], dst=self.small, interpolation=cv2.INTER_LINEAR)
+        start = self._lap('downscale', start)
+        self._color_mask(self.small)
+        start = self._lap('mask', start)
+        cv2.morphologyEx(self.mask, cv2.MORPH_OPEN, KERNEL, dst=self.morph, iterations=2)
+        cv2.dilate(self.morph, KERNEL, dst=self.mask)
+        start = self._lap('morphology', start)
+
+        self._clear()
+        x, y, w, h = cv2.boundingRect(self.mask)
+        if w:
+            # Refinement spreads the matte by up to two windows; upsampling reads one more pixel
+            pad = 2 * self.preset['radius'] + 2
+            small_h, small_w = self.mask.shape
+            self.roi = (max(0, y - pad), min(small_h, y + h + pad), max(0, x - pad), min(small_w, x + w + pad))
+            if self.preset['refine'] == 'guided':
+                self._guided_filter()
+            else:
+                y0, y1, x0, x1 = self.roi
+                size = 2 * self.preset['radius'] + 1
+                cv2.GaussianBlur(self.mask[y0:y1, x0:x1], (size, size), 0, dst=self.matte[y0:y1, x0:x1])
+            start = self._lap('refine', start)
+            self._upsample()
+        self._lap('upsample', start)
+        return self.alpha
+
+    def _clear(self):
+        """Zero what the previous frame wrote; everything outside its box is already 0."""
+        if self.roi is None:
+            return
+        k = self.preset['downscale']
+        y0, y1, x0, x1 = self.roi
+        self.matte[y0:y1, x0:x1] = 0
+        self._alpha[y0 * k:y1 * k, x0 * k:x1 * k] = 0
+        self.covered[y0 * k:y1 * k, x0 * k:x1 * k] = 0
+        self.roi = None
+
+    def _guided_filter(self):
+        """Guided filter (He et al.) of the mask inside roi, guided by the small frame's luma, into matte."""
+        y0, y1, x0, x1 = self.roi
+        region = (slice(y0, y1), slice(x0, x1))
+        f = {name: buffer[:y1 - y0, :x1 - x0] for name, buffer in self._float.items()}
+        size = (2 * self.preset['radius'] + 1,) * 2
+        cv2.cvtColor(self.small[region], cv2.COLOR_BGR2GRAY, dst=self._guide[region])
+        np.multiply(self._guide[region], 1 / 255, out=f['I'])
+        np.multiply(self.mask[region], 1 / 255, out=f['p'])
+        cv2.boxFilter(f['I'], -1, size, dst=f['mean_I'])
+        cv2.boxFilter(f['p'], -1, size, dst=f['mean_p'])
+        cv2.multiply(f['I'], f['p'], dst=f['tmp'])
+        cv2.boxFilter(f['tmp'], -1, size, dst=f['Ip'])
+        cv2.multiply(f['I'], f['I'], dst=f['tmp'])
+        cv2.boxFilter(f['tmp'], -1, size, dst=f['II'])
+        # a = cov(I, p) / (var(I) + eps), b = mean_p - a * mean_I
+        cv2.multiply(f['mean_I'], f['mean_p'], dst=f['tmp'])
+        cv2.subtract(f['Ip'], f['tmp'], dst=f['a'])
+        cv2.multiply(f['mean_I'], f['mean_I'], dst=f['tmp'])
+        cv2.subtract(f['II'], f['tmp'], dst=f['tmp'])
+        f['tmp'] += self.preset['eps']
+        cv2.divide(f['a'], f['tmp'], dst=f['a'])
+        cv2.multiply(f['a'], f['mean_I'], dst=f['tmp'])
+        cv2.subtract(f['mean_p'], f['tmp'], dst=f['b'])
+        cv2.boxFilter(f['a'], -1, size, dst=f['a'])
+        cv2.boxFilter(f['b'], -1, size, dst=f['b'])
+        cv2.multiply(f['a'], f['I'], dst=f['tmp'])
+        cv2.add(f['tmp'], f['b'], dst=f['tmp'])
+        # Clamp below at 0; the conversion saturates above at 255
+        cv2.threshold(f['tmp'], 0, 0, cv2.THRESH_TOZERO, dst=f['tmp'])
+        cv2.convertScaleAbs(f['tmp'], dst=self.matte[region], alpha=255)
+
+    def _upsample(self):
+        """
+        Bilinearly upsample the matte inside roi into alpha.
+
+        With an integer factor the samples inside the box are exactly those of
+        resizing the whole matte, and the box margin covers the border pixels.
+        """
+        k = self.preset['downscale']
+        y0, y1, x0, x1 = self.roi
+        cv2.resize(self.matte[y0:y1, x0:x1], None, dst=self._alpha[y0 * k:y1 * k, x0 * k:x1 * k],
+                   fx=k, fy=k, interpolation=cv2.INTER_LINEAR)
+        region = (slice(y0 * k, y1 * k), slice(x0 * k, x1 * k))
+        cv2.threshold(self.alpha[region], 0, 255, cv2.THRESH_BINARY, dst=self.covered[region])
+
+    def _blend(self, background, out):
+        """out = alpha * background + (1 - alpha) * out inside the matte's box."""
+        if self.roi is None:
+            return
+        k = self.preset['downscale']
+        y0, y1, x0, x1 = self.roi
+        region = (slice(y0 * k, y1 * k), slice(x0 * k, x1 * k))
+        frame, layer, alpha3 = out[region], self.layer[region], self.alpha3[region]
+        cv2.cvtColor(self.alpha[region], cv2.COLOR_GRAY2BGR, dst=alpha3)
+        cv2.multiply(background[region], alpha3, dst=layer, scale=1 / 255)
+        cv2.bitwise_not(alpha3, dst=alpha3)
+        cv2.multiply(frame, alpha3, dst=frame, scale=1 / 255)
+        cv2.add(frame, layer, dst=frame)
+
+    def process(self, frame, background=None, out=None):
+        """
+        Composite one raw camera frame.
+
+        Args:
+            frame: BGR frame of the compositor's size
+            background: Optional background to use instead of the stored one
+                (must already be in display orientation)
+            out: Optional destination buffer; may be frame itself when flip
+                is off, which composites fully in place
+
+        Returns:
+            The composited frame (out, or the internal output buffer)
+        """
+        self.timings.clear()
+        start = time.perf_counter()
+        out = self.output if out is None else out
+        if self.flip:
+            cv2.flip(frame, 1, dst=out)
+        elif out is not frame:
+            np.copyto(out, frame)
+        self._lap('flip', start)
+
+        mask = self.compute_mask(out)
+        start = time.perf_counter()
+        if background is None:
+            if self.background_model is not None:
+                background = self.background_model.update(out, mask if self.preset is None else self.covered)
+            else:
+                background = self.background
+        start = self._lap('background', start)
+        if self.preset is None:
+            cv2.copyTo(background, mask, out)
+        else:
+            self._blend(background, out)
+        self._lap('blend', start)
+
+        self.frames += 1
+        for step, ms in self.timings.items():
+            self._totals[step] = self._totals.get(step, 0.0) + ms
+        return out
+
+    def stats(self):
+        """Return the quality, frames composited and mean milliseconds per frame for each step."""
+        return {
+            'quality': self.quality,
+            'frames': self.frames,
+            'step_ms': {step: total / self.frames for step, total in self._totals.items()} if self.frames else {},
+        }
+
+
+def benchmark(resolutions=((1280, 720), (1920, 1080)), frames=100, color_name='Red'):
+    """
+    Compare apply_cloak with CloakCompositor (HSV and LUT masks, each mask quality) on synthetic frames.
+
+    Returns:
+        List of (label, {method: ms/frame})
+    """
+    from color_lut import ColorLUT
+
+    rng = np.random.default_rng(0)
+    color_settings = CLOAK_COLORS[color_name]
+    results = []
+    for width, height in resolutions:
+        # Smooth content so table lookups see camera-like locality
+        frame = cv2.resize(rng.integers(0, 256, (height // 20, width // 20, 3), dtype=np.uint8),
+                           (width, height), interpolation=cv2.INTER_CUBIC)
+        background = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+        timings = {}
+        start = time.perf_counter()
+        for _ in range(frames):
+            apply_cloak(np.flip(frame, axis=1), background, color_settings)
+        timings['apply_cloak'] = (time.perf_counter() - start) * 1000 / frames
+
+        variants = [('compositor_hsv', None, 'full'), ('compositor_lut', ColorLUT(frame.shape), 'full')]
+        variants += [(f"compositor_{quality}", None, quality) for quality in MASK_QUALITY if quality != 'full']
+        for method, lut, quality in variants:
+            compositor = CloakCompositor(frame.shape, color_settings, lut=lut, quality=quality)
+            compositor.set_background(background)
+            compositor.process(frame)  # Builds/loads the LUT outside the timing
+            start = time.perf_counter()
+            for _ in range(frames):
+                compositor.process(frame)
+            timings[method] = (time.perf_counter() - start) * 1000 / frames
+
+        results.append((f"{height}p", timings))
+    return results
+
+
+if __name__ == "__main__":
+    for label, timings in benchmark():
+        print(f"{label}: " + ", ".join(f"{method} {ms:.2f} ms/frame" for method, ms in timings.items()))
@@ -0,0 +1,153 @@
+"""
+Color LUT - Precomputed BGR -> cloak color class tables
+
+Purpose: Answer "is this pixel cloak-colored?" with a single table lookup per
+pixel instead of an HSV conversion plus one or two inRange calls. Tables cover
+all 2^24 BGR values and are built by running the exact cvtColor/inRange steps
+of the HSV path over every color once, so masks match it bit for bit
+(including red's two hue ranges). Built tables are cached in memory and on disk
+(memory-mapped, so all processes and sessions share one copy).
+"""
+
+import hashlib
+import os
+import sys
+import threading
+
+import cv2
+import numpy as np
+
+from cloak import CLOAK_COLORS
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ai_vision_hub")
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def _all_colors():
+    """Every BGR value as a 4096x4096 image; pixel i is (i & 255, i >> 8 & 255, i >> 16)."""
+    indices = np.arange(1 << 24, dtype=np.uint32)
+    pixels = indices.view(np.uint8).reshape(-1, 4)[:, :3]
+    return np.ascontiguousarray(pixels).reshape(4096, 4096, 3)
+
+
+def _color_key(color_settings):
+    ranges = [color_settings['lower1'], color_settings['upper1']]
+    if color_settings['has_two_ranges']:
+        ranges += [color_settings['lower2'], color_settings['upper2']]
+    return ";".join(",".join(str(int(v)) for v in r) for r in ranges)
+
+
+def _hsv_mask(hsv, color_settings):
+    mask = cv2.inRange(hsv, color_settings['lower1'], color_settings['upper1'])
+    if color_settings['has_two_ranges']:
+        cv2.bitwise_or(mask, cv2.inRange(hsv, color_settings['lower2'], color_settings['upper2']), dst=mask)
+    return mask
+
+
+def _cached_table(kind, key, build):
+    """Return a table from memory, then disk, building and saving it if needed."""
+    digest = hashlib.sha1(f"{kind}|{cv2.__version__}|{key}".encode()).hexdigest()[:16]
+    table = _tables.get(digest)
+    if table is not None:
+        return table
+
+    with _tables_lock:
+        table = _tables.get(digest)
+        if table is not None:
+            return table
+
+        path = os.path.join(CACHE_DIR, f"{kind}_{digest}.npy")
+        try:
+            table = np.load(path, mmap_mode='r')
+            if table.shape != (1 << 24,) or table.dtype != np.uint8:
+                table = None
+        except (OSError, ValueError):
+            table = None
+
+        if table is None:
+            table = build()
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    np.save(f, table)
+                os.replace(tmp_path, path)
+            except OSError:
+                pass  # Read-only home: keep the in-memory table only
+        _tables[digest] = table
+    return table
+
+
+def mask_table(color_settings):
+    """
+    Return the 2^24-entry mask table for one color (255 = cloak color).
+
+    Args:
+        color_settings: Entry from CLOAK_COLORS
+    """
+    def build():
+        hsv = cv2.cvtColor(_all_colors(), cv2.COLOR_BGR2HSV)
+        return _hsv_mask(hsv, color_settings).reshape(-1)
+
+    return _cached_table("mask", _color_key(color_settings), build)
+
+
+def class_table(colors=CLOAK_COLORS):
+    """
+    Return the 2^24-entry class table for a color set.
+
+    Bit k of an entry is set when the color belongs to the k-th color of
+    colors (in dict order); ranges may overlap, so several bits can be set.
+    """
+    if len(colors) > 8:
+        raise ValueError("At most 8 color classes fit in a uint8 class table")
+
+    def build():
+        hsv = cv2.cvtColor(_all_colors(), cv2.COLOR_BGR2HSV)
+        table = np.zeros(1 << 24, np.uint8)
+        for bit, color_settings in enumerate(colors.values()):
+            mask = _hsv_mask(hsv, color_settings).reshape(-1)
+            table |= mask & np.uint8(1 << bit)
+        return table
+
+    key = "|".join(f"{name}={_color_key(settings)}" for name, settings in colors.items())
+    return _cached_table("classes", key, build)
+
+
+class ColorLUT:
+    """
+    Per-stream lookup of color masks and label maps with preallocated buffers.
+
+    Example:
+        lut = ColorLUT(frame.shape)
+        mask = lut.mask(frame, CLOAK_COLORS['Red'])
+        labels = lut.labels(frame)          # bit k = k-th color of CLOAK_COLORS
+    """
+
+    def __init__(self, shape):
+        if sys.byteorder != 'little':
+            raise RuntimeError("ColorLUT packs pixels as little-endian 32-bit indices")
+        height, width = shape[:2]
+        self.bgra = np.empty((height, width, 4), np.uint8)
+        self.index = np.empty((height, width), np.uint32)
+        self.output = np.empty((height, width), np.uint8)
+
+    def _fill_index(self, frame):
+        # BGRA viewed as uint32 is B | G << 8 | R << 16 | A << 24; drop alpha
+        cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA, dst=self.bgra)
+        np.bitwise_and(self.bgra.view(np.uint32)[..., 0], 0xFFFFFF, out=self.index)
+        return self.index
+
+    def mask(self, frame, color_settings, dst=None):
+        """Return the uint8 mask (0/255) of one color, identical to the HSV inRange path."""
+        dst = self.output if dst is None else dst
+        np.take(mask_table(color_settings), self._fill_index(frame), out=dst)
+        return dst
+
+    def labels(self, frame, colors=CLOAK_COLORS, dst=None):
+        """Return a per-pixel bitmask of every color class in one pass."""
+        dst = self.output if dst is None else dst
+        np.take(class_table(colors), self._fill_index(frame), out=dst)
+        return dst
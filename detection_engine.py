@@ -0,0 +1,319 @@
+"""
+Detection Engine - Multi-stream detection on a pool of worker processes
+
+Purpose: Run face, face/eye/smile, number plate or cloak processing on many
+camera and video streams at once. Each worker process loads its cascades once,
+frames travel to the workers through shared memory slots (only a small task
+tuple is pickled), and the engine reports throughput per stream and for the
+whole pool.
+
+Worker count and OpenCV/BLAS threads per worker come from a ThreadBudget
+(thread_budget.py): the split measured for this host if it has been tuned,
+otherwise one single-threaded worker per CPU.
+
+Usage:
+    python detection_engine.py --mode face --workers 4 cam1.mp4 cam2.mp4 0
+    python detection_engine.py --mode face --workers 2 --threads 2 --pin cam1.mp4 cam2.mp4
+"""
+
+import argparse
+import math
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+import model_registry
+from cloak import CLOAK_COLORS, MASK_QUALITY, CloakCompositor
+from detectors import DETECTION_MODES
+from frame_capture import BLOCK, DROP_OLDEST, FrameCapture, parse_source
+from thread_budget import ThreadBudget
+
+ENGINE_MODES = tuple(DETECTION_MODES) + ('cloak',)
+
+# Per-worker state, filled in once by _init_worker
+_worker_mode = None
+_worker_color = None
+_worker_mask_quality = 'full'
+_worker_annotate = True
+_worker_detect_params = {}
+_worker_segments = {}
+_worker_compositors = {}
+
+
+def _init_worker(mode, color_name, annotate, detect_params, mask_quality, budget, counter):
+    global _worker_mode, _worker_color, _worker_annotate, _worker_detect_params, _worker_mask_quality
+    # The pool and each worker's library threads share one CPU budget
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    budget.apply(index)
+    _worker_mode = mode
+    _worker_color = CLOAK_COLORS[color_name]
+    _worker_mask_quality = mask_quality
+    _worker_annotate = annotate
+    _worker_detect_params = detect_params
+    if mode in DETECTION_MODES:
+        model_registry.preload(DETECTION_MODES[mode][0])
+
+
+def _attach(name):
+    segment = _worker_segments.get(name)
+    if segment is None:
+        try:
+            segment = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13 has no track argument
+            segment = shared_memory.SharedMemory(name=name)
+        _worker_segments[name] = segment
+    return segment
+
+
+def _process_frame(task):
+    """Worker entry point: process one frame in place inside shared memory."""
+    segment_name, n_slots, shape, slot, stream_id, frame_index = task
+    segment = _attach(segment_name)
+    slots = np.ndarray((n_slots,) + shape, dtype=np.uint8, buffer=segment.buf)
+    frame = slots[slot]
+
+    start = time.perf_counter()
+    if _worker_mode == 'cloak':
+        # Slot 0 holds the stream's background frame; composite in place
+        compositor = _worker_compositors.get(shape)
+        if compositor is None:
+            compositor = _worker_compositors[shape] = CloakCompositor(
+                shape, _worker_color, flip=False, quality=_worker_mask_quality)
+        compositor.process(frame, background=slots[0], out=frame)
+        detections = []
+    else:
+        _, detect, draw = DETECTION_MODES[_worker_mode]
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        detections = detect(gray, **_worker_detect_params)
+        if _worker_annotate:
+            draw(frame, detections)
+    return stream_id, slot, frame_index, detections, time.perf_counter() - start
+
+
+class _Stream:
+    """Capture plus shared-memory frame slots for one input stream."""
+
+    def __init__(self, stream_id, source, n_slots, reserve_background):
+        self.stream_id = stream_id
+        self.source = source
+        is_device = isinstance(parse_source(source), int)
+        self.capture = FrameCapture(source, buffer_size=2, policy=DROP_OLDEST if is_device else BLOCK)
+        self.n_slots = n_slots + (1 if reserve_background else 0)
+        self.first_slot = 1 if reserve_background else 0
+        self.segment = None
+        self.slots = None
+        self.shape = None
+        self.free = []
+        self.exhausted = False
+        self.frames_read = 0
+        self.frames_done = 0
+        self.work_time = 0.0
+        self.started = None
+        self.finished = None
+
+    def allocate(self, frame):
+        self.shape = frame.shape
+        self.segment = shared_memory.SharedMemory(create=True, size=self.n_slots * frame.nbytes)
+        self.slots = np.ndarray((self.n_slots,) + self.shape, dtype=np.uint8, buffer=self.segment.buf)
+        self.free = list(range(self.first_slot, self.n_slots))
+        if self.first_slot:
+            self.slots[0] = frame
+
+    def store(self, slot, frame):
+        if frame.shape == self.shape:
+            self.slots[slot] = frame
+        else:
+            cv2.resize(frame, (self.shape[1], self.shape[0]), dst=self.slots[slot])
+
+    def close(self):
+        self.capture.release()
+        if self.segment is not None:
+            self.slots = None
+            self.segment.close()
+            self.segment.unlink()
+            self.segment = None
+
+
+class DetectionEngine:
+    """
+    Process N input streams with a pool of worker processes.
+
+    Example:
+        engine = DetectionEngine(['a.mp4', 'b.mp4'], mode='plate', workers=4)
+        engine.run()
+        print(engine.stats())
+    """
+
+    def __init__(self, sources, mode='face', workers=None, color='Red',
+                 slots_per_stream=None, annotate=True, detect_width=None, mask_quality='full',
+                 threads=None, pin=False):
+        """
+        Args:
+            sources: Device indices, video paths, image directories or globs
+            mode: One of ENGINE_MODES
+            workers: Number of worker processes (default: tuned for this host,
+                else CPU count)
+            color: Cloak color name from CLOAK_COLORS (cloak mode only)
+            slots_per_stream: Frames in flight per stream (default: enough
+                to keep every worker busy)
+            annotate: Draw detections onto the frames
+            detect_width: Downscale frames wider than this for detection
+            mask_quality: Cloak mask preset from MASK_QUALITY (cloak mode only)
+            threads: OpenCV/BLAS threads per worker (default: tuned, else
+                what the workers leave of the CPUs)
+            pin: Pin each worker to its own CPU slice
+        """
+        if mode not in ENGINE_MODES:
+            raise ValueError(f"Unknown mode: {mode}. Choose from {', '.join(ENGINE_MODES)}")
+        if color not in CLOAK_COLORS:
+            raise ValueError(f"Unknown cloak color: {color}")
+        if mask_quality not in MASK_QUALITY:
+            raise ValueError(f"Unknown mask quality: {mask_quality}")
+        if not sources:
+            raise ValueError("At least one source is required")
+
+        self.sources = list(sources)
+        self.mode = mode
+        self.budget = ThreadBudget.tuned('cloak' if mode == 'cloak' else 'detect', workers, threads, pin)
+        self.workers = self.budget.workers
+        self.color = color
+        self.mask_quality = mask_quality
+        self.annotate = annotate
+        self.detect_params = {'detect_width': detect_width} if mode in DETECTION_MODES else {}
+        self.slots_per_stream = slots_per_stream or max(2, math.ceil(2 * self.workers / len(self.sources)))
+        self._streams = []
+        self._wall_time = 0.0
+
+    def _fill(self, stream, pool, pending):
+        """Submit as many frames from a stream as it has free slots."""
+        submitted = False
+        while not stream.exhausted and (stream.slots is None or stream.free):
+            ret, frame = stream.capture.read(timeout=0)
+            if not ret:
+                if not stream.capture.isOpened():
+                    stream.exhausted = True
+                    stream.finished = time.perf_counter()
+                break
+            if stream.slots is None:
+                stream.allocate(frame)
+                stream.started = time.perf_counter()
+                if stream.first_slot:
+                    # The first cloak frame only becomes the background
+                    continue
+
+            slot = stream.free.pop()
+            stream.store(slot, frame)
+            task = (stream.segment.name, stream.n_slots, stream.shape, slot, stream.stream_id, stream.frames_read)
+            pending.add(pool.submit(_process_frame, task))
+            stream.frames_read += 1
+            submitted = True
+        return submitted
+
+    def run(self, on_result=None):
+        """
+        Process every stream until all sources are exhausted.
+
+        Args:
+            on_result: Optional callback(stream_id, frame_index, frame, detections).
+                frame is a view into shared memory and is only valid during the
+                call; copy it to keep it. Frames of a stream may arrive out of
+                order when several workers process that stream.
+        """
+        reserve_background = self.mode == 'cloak'
+        self._streams = [_Stream(i, src, self.slots_per_stream, reserve_background)
+                         for i, src in enumerate(self.sources)]
+        start = time.perf_counter()
+        try:
+            with ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                     initargs=(self.mode, self.color, self.annotate, self.detect_params,
+                                               self.mask_quality, self.budget, multiprocessing.Value('i', 0))) as pool:
+                pending = set()
+                while pending or not all(s.exhausted for s in self._streams):
+                    submitted = False
+                    for stream in self._streams:
+                        submitted |= self._fill(stream, pool, pending)
+
+                    if pending:
+                        done, pending = wait(pending, timeout=0.01, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            stream_id, slot, frame_index, detections, elapsed = future.result()
+                            stream = self._streams[stream_id]
+                            if on_result is not None:
+                                on_result(stream_id, frame_index, stream.slots[slot], detections)
+                            stream.free.append(slot)
+                            stream.frames_done += 1
+                            stream.work_time += elapsed
+                    elif not submitted:
+                        time.sleep(0.001)
+        finally:
+            self._wall_time = time.perf_counter() - start
+            for stream in self._streams:
+                if stream.finished is None:
+                    stream.finished = time.perf_counter()
+                stream.close()
+
+    def stats(self):
+        """
+        Return throughput figures for each stream and for the whole pool.
+
+        Returns:
+            Dict with 'streams' (list of per-stream dicts) and 'pool' totals
+        """
+        streams = []
+        for stream in self._streams:
+            elapsed = (stream.finished - stream.started) if stream.started else 0.0
+            streams.append({
+                'source': str(stream.source),
+                'frames': stream.frames_done,
+                'fps': stream.frames_done / elapsed if elapsed > 0 else 0.0,
+                'mean_process_ms': 1000 * stream.work_time / stream.frames_done if stream.frames_done else 0.0,
+            })
+        total_frames = sum(s['frames'] for s in streams)
+        return {
+            'streams': streams,
+            'pool': {
+                'workers': self.workers,
+                'threads_per_worker': self.budget.threads,
+                'frames': total_frames,
+                'seconds': self._wall_time,
+                'fps': total_frames / self._wall_time if self._wall_time > 0 else 0.0,
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run detection on several streams with a process pool.")
+    parser.add_argument('sources', nargs='+', help="Device indices, video files, image directories or globs")
+    parser.add_argument('--mode', choices=ENGINE_MODES, default='face')
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: tuned, else CPU count)")
+    parser.add_argument('--threads', type=int, default=None, help="OpenCV/BLAS threads per worker")
+    parser.add_argument('--pin', action='store_true', help="Pin each worker to its own CPUs")
+    parser.add_argument('--color', choices=list(CLOAK_COLORS), default='Red', help="Cloak color for --mode cloak")
+    parser.add_argument('--mask-quality', choices=list(MASK_QUALITY), default='full',
+                        help="Cloak mask resolution and edge refinement for --mode cloak")
+    parser.add_argument('--detect-width', type=int, default=None, help="Downscale wider frames for detection")
+    args = parser.parse_args()
+
+    engine = DetectionEngine(args.sources, mode=args.mode, workers=args.workers, color=args.color,
+                             detect_width=args.detect_width, mask_quality=args.mask_quality,
+                             threads=args.threads, pin=args.pin)
+    engine.run()
+
+    stats = engine.stats()
+    for stream in stats['streams']:
+        print(f"{stream['source']}: {stream['frames']} frames, {stream['fps']:.1f} fps, "
+              f"{stream['mean_process_ms']:.1f} ms/frame")
+    pool = stats['pool']
+    print(f"Pool ({pool['workers']} workers x {pool['threads_per_worker']} threads): {pool['frames']} frames in {pool['seconds']:.2f} s, "
+          f"{pool['fps']:.1f} fps")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""
+Detection Store - Headless per-frame detection output (JSON Lines + columnar .npz)
+
+Purpose: Index footage without screen-scraping annotated video. A headless
+pipeline runs only the detector stages (no drawing, no encoding, no display)
+and writes every detection (frame index, timestamp, class, track id, box) to:
+
+    JSON Lines  one object per frame, mode parameters in a header line
+    .npz chunks NumPy structured arrays, stored uncompressed in fixed-size
+                chunks plus a meta.json (mode, parameters, class names),
+                rewritten after every chunk so an interrupted run stays readable
+
+Timestamps are the media position in seconds for video files and image
+sequences, the recorded capture time for frame stores and the wall clock
+(time.time()) for live devices; the 'timestamps' parameter says which.
+
+Writes are buffered and flushed in batches. DetectionReader memory-maps the
+arrays inside the .npz chunks, so queries over long recordings touch only the
+pages they need.
+
+Usage:
+    python detection_store.py record --mode face --jsonl faces.jsonl --npz faces/ clip.mp4
+    python detection_store.py query faces/ --class face --frames 100 500
+"""
+
+import argparse
+import json
+import os
+import time
+import zipfile
+
+import numpy as np
+
+import pipeline
+from frame_capture import BLOCK, DROP_OLDEST, parse_source
+from frame_store import ReplaySource, is_frame_store
+from thread_budget import configure
+
+RECORD_DTYPE = np.dtype([
+    ('frame', np.int64),
+    ('timestamp', np.float64),
+    ('class_id', np.uint8),
+    ('track_id', np.int32),   # -1 when untracked
+    ('parent_id', np.int32),  # Face track id for eyes/smiles, else -1
+    ('x', np.int32), ('y', np.int32), ('w', np.int32), ('h', np.int32),
+])
+CHUNK_PATTERN = "chunk-{:06d}.npz"
+META_FILE = "meta.json"
+RECORD_MODES = ('face', 'face_eye_smile', 'plate')
+
+
+class JsonlWriter:
+    """Buffered JSON Lines writer: a header line, then one line per frame."""
+
+    def __init__(self, path, mode, params=None, flush_frames=100):
+        """
+        Args:
+            path: Output .jsonl file (overwritten)
+            mode, params: Written to the header line
+            flush_frames: Frames buffered in memory between writes
+        """
+        self.flush_frames = flush_frames
+        self._buffer = []
+        self._file = open(path, 'w', encoding='utf-8')
+        self._file.write(json.dumps({'type': 'header', 'mode': mode, 'params': params or {}}) + "\n")
+
+    def write(self, frame_index, timestamp, records):
+        self._buffer.append(json.dumps({'frame': frame_index, 'timestamp': timestamp, 'detections': records}))
+        if len(self._buffer) >= self.flush_frames:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write("\n".join(self._buffer) + "\n")
+            self._buffer.clear()
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class NpzWriter:
+    """Columnar writer: rows of RECORD_DTYPE in fixed-size uncompressed .npz chunks."""
+
+    def __init__(self, directory, mode, params=None, chunk_rows=65536):
+        """
+        Args:
+            directory: Output directory (created; existing chunks are replaced)
+            mode, params: Stored in meta.json
+            chunk_rows: Rows per .npz chunk
+        """
+        self.directory = directory
+        self.meta = {'mode': mode, 'params': params or {}, 'classes': [], 'chunks': [], 'frames': 0, 'rows': 0}
+        self._class_ids = {}
+        self._rows = np.empty(chunk_rows, RECORD_DTYPE)
+        self._count = 0
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.startswith("chunk-") and name.endswith(".npz"):
+                os.remove(os.path.join(directory, name))
+        self._write_meta()
+
+    def _class_id(self, name):
+        class_id = self._class_ids.get(name)
+        if class_id is None:
+            if len(self._class_ids) > np.iinfo(np.uint8).max:
+                raise ValueError("Too many detection classes for a uint8 class_id")
+            class_id = self._class_ids[name] = len(self.meta['classes'])
+            self.meta['classes'].append(name)
+        return class_id
+
+    def write(self, frame_index, timestamp, records):
+        self.meta['frames'] += 1
+        for record in records:
+            if self._count == len(self._rows):
+                self.flush()
+            track_id, parent_id = record.get('id'), record.get('parent')
+            self._rows[self._count] = (
+                frame_index, timestamp, self._class_id(record['class']),
+                -1 if track_id is None else track_id, -1 if parent_id is None else parent_id,
+                *record['box'],
+            )
+            self._count += 1
+
+    def flush(self):
+        """Write buffered rows as the next chunk and refresh meta.json."""
+        if self._count:
+            name = CHUNK_PATTERN.format(len(self.meta['chunks']))
+            # savez stores members uncompressed, which keeps them memory-mappable
+            np.savez(os.path.join(self.directory, name), detections=self._rows[:self._count])
+            self.meta['chunks'].append(name)
+            self.meta['rows'] += self._count
+            self._count = 0
+        self._write_meta()
+
+    def _write_meta(self):
+        tmp_path = os.path.join(self.directory, META_FILE + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.directory, META_FILE))
+
+    def close(self):
+        self.flush()
+
+
+class DetectionSink:
+    """Pipeline sink feeding every frame's detections to one or more writers."""
+
+    name = "store"
+
+    def __init__(self, writers, media_fps=None):
+        """
+        Args:
+            writers: JsonlWriter/NpzWriter instances
+            media_fps: Frame rate of a file source; timestamps are then the media
+                position (frame index / fps) instead of ctx.timestamp
+        """
+        self.writers = list(writers)
+        self.media_fps = media_fps
+
+    def write(self, ctx):
+        records = pipeline.detection_records(ctx)
+        timestamp = ctx.index / self.media_fps if self.media_fps else ctx.timestamp
+        for writer in self.writers:
+            writer.write(ctx.index, timestamp, records)
+        return True
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+
+def _memmap_npz_member(path, member="detections.npy"):
+    """Memory-map an uncompressed array stored inside an .npz file."""
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(member)
+        if info.compress_type != zipfile.ZIP_STORED:
+            return np.load(path)[member[:-len(".npy")]]
+    with open(path, 'rb') as f:
+        # Local file header: 30 fixed bytes, then file name and extra field
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = np.frombuffer(f.read(4), '<u2')
+        f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if not shape or not shape[0]:
+        return np.empty(0, dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+class DetectionReader:
+    """
+    Query a directory written by NpzWriter through memory-mapped chunks.
+
+    Example:
+        reader = DetectionReader('faces/')
+        rows = reader.query('face', frames=(100, 500))
+        print(rows['frame'], rows['x'])
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, META_FILE), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.mode = self.meta['mode']
+        self.params = self.meta['params']
+        self.classes = self.meta['classes']
+        self.chunks = [_memmap_npz_member(os.path.join(directory, name)) for name in self.meta['chunks']]
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def query(self, cls=None, frames=None, track_id=None):
+        """
+        Return matching rows as one structured array.
+
+        Args:
+            cls: Class name (e.g. 'face') or None for all
+            frames: Optional (first, last) inclusive frame range
+            track_id: Optional track id
+        """
+        class_id = None
+        if cls is not None:
+            if cls not in self.classes:
+                return np.empty(0, RECORD_DTYPE)
+            class_id = self.classes.index(cls)
+
+        parts = []
+        for chunk in self.chunks:
+            if not len(chunk):
+                continue
+            if frames is not None:
+                # Rows are written in frame order, so chunks are sorted by frame
+                if chunk['frame'][-1] < frames[0] or chunk['frame'][0] > frames[1]:
+                    continue
+                lo = np.searchsorted(chunk['frame'], frames[0], side='left')
+                hi = np.searchsorted(chunk['frame'], frames[1], side='right')
+                chunk = chunk[lo:hi]
+            keep = np.ones(len(chunk), bool)
+            if class_id is not None:
+                keep &= chunk['class_id'] == class_id
+            if track_id is not None:
+                keep &= chunk['track_id'] == track_id
+            parts.append(np.asarray(chunk[keep]))
+        return np.concatenate(parts) if parts else np.empty(0, RECORD_DTYPE)
+
+
+def record(sources, mode='face', jsonl=None, npz=None, detect_width=640, detect_interval=1,
+           flush_frames=100, chunk_rows=65536):
+    """
+    Run a headless detection pipeline over sources and store the detections.
+
+    Only detector stages run: no annotation, encoding or display. Files are
+    read completely, so frame indices and media positions match the source.
+
+    Returns:
+        Pipeline stats for each source
+    """
+    params = {'detect_width': detect_width, 'detect_interval': detect_interval}
+    results = []
+    for index, source in enumerate(sources):
+        media_fps = None
+        if is_frame_store(source):
+            # Replays keep the indices and capture timestamps of the recording
+            capture, clock = ReplaySource(source), 'recorded'
+        elif isinstance(parse_source(source), int):
+            capture, clock = pipeline.CaptureSource(source, policy=DROP_OLDEST), 'wall'
+        else:
+            capture, clock = pipeline.CaptureSource(source, policy=BLOCK), 'media'
+            media_fps = capture.fps() or 30.0
+
+        writers = []
+        suffix = f"-{index}" if len(sources) > 1 else ""
+        source_params = dict(params, source=str(source), timestamps=clock)
+        if jsonl:
+            base, ext = os.path.splitext(jsonl)
+            writers.append(JsonlWriter(base + suffix + (ext or ".jsonl"), mode, source_params, flush_frames))
+        if npz:
+            writers.append(NpzWriter(npz.rstrip("/\\") + suffix, mode, source_params, chunk_rows))
+        runner = pipeline.Pipeline(
+            capture,
+            [pipeline.detector_stage(mode, detect_interval, detect_width=detect_width)],
+            [DetectionSink(writers, media_fps)],
+        )
+        try:
+            runner.run()
+        finally:
+            runner.close()
+        results.append(runner.stats())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write or query structured detection output.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rec = commands.add_parser('record', help="Run headless detection and store the results")
+    rec.add_argument('sources', nargs='+', help="Video files, image directories, globs or device indices")
+    rec.add_argument('--mode', choices=RECORD_MODES, default='face')
+    rec.add_argument('--jsonl', help="JSON Lines output path")
+    rec.add_argument('--npz', help="Directory for columnar .npz chunks")
+    rec.add_argument('--detect-width', type=int, default=640)
+    rec.add_argument('--detect-interval', type=int, default=1)
+
+    query = commands.add_parser('query', help="Query a columnar output directory")
+    query.add_argument('directory')
+    query.add_argument('--class', dest='cls', default=None)
+    query.add_argument('--frames', nargs=2, type=int, metavar=('FIRST', 'LAST'))
+    query.add_argument('--track', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        if not args.jsonl and not args.npz:
+            parser.error("record needs --jsonl and/or --npz")
+        configure('detect')
+        start = time.perf_counter()
+        for source, stats in zip(args.sources, record(args.sources, args.mode, args.jsonl, args.npz,
+                                                      args.detect_width, args.detect_interval)):
+            print(f"{source}: {stats['frames']} frames")
+        print(f"Done in {time.perf_counter() - start:.1f} s")
+    else:
+        reader = DetectionReader(args.directory)
+        rows = reader.query(args.cls, args.frames, args.track)
+        print(f"{len(rows)} of {len(reader)} rows ({reader.mode}, classes: {', '.join(reader.classes)})")
+        for row in rows[:20]:
+            print(f"frame {row['frame']} {reader.classes[row['class_id']]} id {row['track_id']} "
+                  f"box ({row['x']}, {row['y']}, {row['w']}, {row['h']})")
+        if len(rows) > 20:
+            print("...")
+
+
+if __name__ == "__main__":
+    main()
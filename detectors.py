@@ -0,0 +1,339 @@
+"""
+Detectors - Face, face/eye/smile and number plate detection
+
+Purpose: Shared detection and drawing code for the Streamlit app, the
+standalone scripts and the multi-stream engine. Detection functions take a
+grayscale frame and return boxes in frame coordinates; drawing functions
+annotate a BGR frame in place.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+import model_registry
+
+FACE_BOX_COLOR = (255, 165, 0)
+FES_FACE_COLOR = (255, 0, 0)
+EYE_COLOR = (0, 255, 0)
+SMILE_COLOR = (0, 0, 255)
+PLATE_COLOR = (0, 255, 0)
+
+# Eyes sit in the upper part of a face and smiles in the lower part; the
+# bands are fractions of the face height searched by each sub-cascade
+EYE_BAND = (0.0, 0.6)
+SMILE_BAND = (0.5, 1.0)
+# Faces narrower than this (pixels) are too small for useful eye/smile detection
+MIN_SUBDETECT_FACE = 60
+
+
+def _size_bound(model, size, ratio):
+    """Convert a full-resolution size bound to detection-scale (w, h)."""
+    if isinstance(size, (int, float)):
+        # A bare width: take the height from the cascade's window aspect ratio
+        window_w, window_h = model_registry.get_cascade(model).getOriginalWindowSize()
+        size = (size, size * window_h / window_w)
+    return (max(1, round(size[0] * ratio)), max(1, round(size[1] * ratio)))
+
+
+def detect_scaled(model, gray, scale_factor, min_neighbors, detect_width=None,
+                  min_size=None, max_size=None):
+    """
+    Run a cascade on a downscaled copy of a frame and map boxes back.
+
+    Most of detectMultiScale's time goes to the fine pyramid levels of a large
+    frame, so detecting on a reduced copy is much cheaper. Object size bounds
+    are given in full-resolution pixels and converted to the detection scale.
+
+    Args:
+        model: Model key from model_registry.CASCADE_FILES
+        gray: Full-resolution grayscale frame
+        scale_factor, min_neighbors: detectMultiScale parameters
+        detect_width: Width to detect at; None or a width >= the frame's width
+            detects at full resolution
+        min_size, max_size: Object size bounds in full-resolution pixels,
+            as (w, h) or a bare width (height follows the cascade's aspect
+            ratio), or None for no bound
+
+    Returns:
+        List of (x, y, w, h) tuples in full-resolution coordinates
+    """
+    height, width = gray.shape[:2]
+    ratio = 1.0
+    image = gray
+    if detect_width and detect_width < width:
+        ratio = detect_width / width
+        image = cv2.resize(gray, (detect_width, max(1, round(height * ratio))), interpolation=cv2.INTER_AREA)
+
+    params = {'scaleFactor': scale_factor, 'minNeighbors': min_neighbors}
+    if min_size:
+        params['minSize'] = _size_bound(model, min_size, ratio)
+    if max_size:
+        params['maxSize'] = _size_bound(model, max_size, ratio)
+
+    boxes = model_registry.detect(model, image, **params)
+    if ratio == 1.0:
+        return [tuple(int(v) for v in box) for box in boxes]
+    return [tuple(int(round(v / ratio)) for v in box) for box in boxes]
+
+
+def detect_faces(gray, scale_factor=1.1, min_neighbors=4, detect_width=None,
+                 min_size=None, max_size=None):
+    """
+    Detect faces in a grayscale frame.
+
+    Returns:
+        List of (x, y, w, h) tuples
+    """
+    return detect_scaled('face', gray, scale_factor, min_neighbors, detect_width, min_size, max_size)
+
+
+def detect_plates(gray, scale_factor=1.1, min_neighbors=10, detect_width=None,
+                  min_size=None, max_size=None):
+    """
+    Detect number plates in a grayscale frame.
+
+    Returns:
+        List of (x, y, w, h) tuples
+    """
+    return detect_scaled('plate', gray, scale_factor, min_neighbors, detect_width, min_size, max_size)
+
+
+# Pyramid levels up to this scale are shared between cascades; coarser levels
+# are left to detectMultiScale, which scans them with a 1-pixel step
+SHARED_PYRAMID_MAX_SCALE = 2.0
+GROUP_EPS = 0.2  # detectMultiScale's grouping tolerance
+
+
+def detect_multi(gray, models, scale_factor=1.1, min_neighbors=4, detect_width=None,
+                 min_size=None, max_size=None):
+    """
+    Run several cascades over one shared image pyramid.
+
+    detectMultiScale builds its own pyramid on every call, so separate calls
+    resize the frame (and every pyramid level) once per cascade. Here the frame
+    is downscaled to detect_width once and each fine level is resized once,
+    then every cascade scans it at its native window size. Raw candidates from
+    all levels are grouped per class exactly as detectMultiScale groups them;
+    they can differ from it only in the last window row or column of a level.
+
+    Args:
+        gray: Full-resolution grayscale frame
+        models: Model keys from model_registry.CASCADE_FILES
+        scale_factor: Pyramid step shared by all cascades
+        min_neighbors: One value, or a dict of model -> value
+        detect_width, min_size, max_size: As for detect_scaled; size bounds
+            apply to every model
+
+    Returns:
+        Dict of model -> list of (x, y, w, h) tuples in full-resolution coordinates
+    """
+    height, width = gray.shape[:2]
+    ratio = 1.0
+    image = gray
+    if detect_width and detect_width < width:
+        ratio = detect_width / width
+        image = cv2.resize(gray, (detect_width, max(1, round(height * ratio))), interpolation=cv2.INTER_AREA)
+
+    windows, bounds, candidates = {}, {}, {}
+    for model in models:
+        windows[model] = model_registry.get_cascade(model).getOriginalWindowSize()
+        bounds[model] = (_size_bound(model, min_size, ratio) if min_size else windows[model],
+                         _size_bound(model, max_size, ratio) if max_size else (image.shape[1], image.shape[0]))
+        candidates[model] = []
+
+    active, scale = list(models), 1.0
+    while active and scale <= SHARED_PYRAMID_MAX_SCALE:
+        size = (round(image.shape[1] / scale), round(image.shape[0] / scale))
+        level = image if scale == 1.0 else cv2.resize(image, size, interpolation=cv2.INTER_LINEAR_EXACT)
+        for model in list(active):
+            window = windows[model]
+            scaled = (round(window[0] * scale), round(window[1] * scale))
+            (min_w, min_h), (max_w, max_h) = bounds[model]
+            if size[0] < window[0] or size[1] < window[1] or scaled[0] > max_w or scaled[1] > max_h:
+                active.remove(model)
+                continue
+            if scaled[0] < min_w or scaled[1] < min_h:
+                continue
+            # minSize == maxSize == the window: detectMultiScale scans this level only
+            boxes = model_registry.detect(model, level, scaleFactor=scale_factor, minNeighbors=0,
+                                          minSize=window, maxSize=window)
+            if len(boxes):
+                xy = np.rint(np.asarray(boxes)[:, :2].astype(np.float32) * np.float32(scale)).astype(int)
+                candidates[model] += [[int(x), int(y), scaled[0], scaled[1]] for x, y in xy]
+        scale *= scale_factor
+
+    for model in active:
+        # Coarse levels are small; one call per model covers all of them
+        window = windows[model]
+        (min_w, min_h), max_bound = bounds[model]
+        first = (max(min_w, round(window[0] * scale)), max(min_h, round(window[1] * scale)))
+        boxes = model_registry.detect(model, image, scaleFactor=scale_factor, minNeighbors=0,
+                                      minSize=first, maxSize=max_bound)
+        candidates[model] += [[int(v) for v in box] for box in boxes]
+
+    results = {}
+    for model in models:
+        neighbors = min_neighbors.get(model, 4) if isinstance(min_neighbors, dict) else min_neighbors
+        boxes = candidates[model]
+        if neighbors and boxes:
+            boxes, _ = cv2.groupRectangles(boxes, neighbors, GROUP_EPS)
+        if ratio == 1.0:
+            results[model] = [tuple(int(v) for v in box) for box in boxes]
+        else:
+            results[model] = [tuple(int(round(v / ratio)) for v in box) for box in boxes]
+    return results
+
+
+def detect_face_features(gray, scale_factor=1.3, min_neighbors=5,
+                         eye_params=(1.1, 22), smile_params=(1.8, 20),
+                         detect_width=None, min_size=None, max_size=None,
+                         min_face_size=MIN_SUBDETECT_FACE, budget_ms=None):
+    """
+    Detect faces and the eyes and smiles inside each face.
+
+    Faces are found at the detection resolution; eyes and smiles are searched
+    in the matching region of the full-resolution face, which is already small.
+
+    Args:
+        gray: Grayscale frame
+        scale_factor, min_neighbors: Face cascade parameters
+        eye_params, smile_params: (scale_factor, min_neighbors) for the
+            sub-cascades run on each face region
+        detect_width, min_size, max_size: Face detection resolution and size
+            bounds, see detect_scaled
+        min_face_size, budget_ms: Sub-detection limits, see SubDetectionScheduler
+
+    Returns:
+        List of (face, eyes, smiles) where every box is in frame coordinates
+    """
+    faces = detect_faces(gray, scale_factor, min_neighbors, detect_width, min_size, max_size)
+    scheduler = SubDetectionScheduler(eye_params, smile_params, min_face_size, budget_ms)
+    return [(face,) + parts for face, parts in zip(faces, scheduler.run(gray, faces))]
+
+
+def _detect_in_band(model, gray, face, band, params):
+    """Run a sub-cascade on a horizontal band (fractions of face height) of a face."""
+    x, y, w, h = face
+    x0 = max(0, x)
+    y0 = max(0, y + int(h * band[0]))
+    y1 = y + int(round(h * band[1]))
+    roi_gray = gray[y0:y1, x0:x+w]
+    if not roi_gray.size:
+        return []
+    return [(x0 + bx, y0 + by, bw, bh) for (bx, by, bw, bh) in detect_scaled(model, roi_gray, *params)]
+
+
+def detect_face_parts(gray, face, eye_params=(1.1, 22), smile_params=(1.8, 20)):
+    """
+    Detect eyes in the upper part and smiles in the lower part of one face.
+
+    Returns:
+        (eyes, smiles) lists of boxes in frame coordinates
+    """
+    return (
+        _detect_in_band('eye', gray, face, EYE_BAND, eye_params),
+        _detect_in_band('smile', gray, face, SMILE_BAND, smile_params),
+    )
+
+
+class SubDetectionScheduler:
+    """
+    Decide which faces get eye/smile sub-detection on a frame.
+
+    The sub-cascades cost grows with the number of faces, so faces smaller than
+    min_face_size are skipped and work stops once the per-frame time budget is
+    spent. When faces carry tracking IDs, the faces that waited longest go
+    first so every face is served in turn in crowded scenes.
+    """
+
+    def __init__(self, eye_params=(1.1, 22), smile_params=(1.8, 20),
+                 min_face_size=MIN_SUBDETECT_FACE, budget_ms=None):
+        """
+        Args:
+            eye_params, smile_params: (scale_factor, min_neighbors) for the sub-cascades
+            min_face_size: Faces narrower than this (pixels) are skipped
+            budget_ms: Per-frame sub-detection time budget; None is unlimited
+        """
+        self.eye_params = eye_params
+        self.smile_params = smile_params
+        self.min_face_size = min_face_size
+        self.budget_ms = budget_ms
+        self.frame_index = 0
+        self.skipped_small = 0
+        self.skipped_budget = 0
+        self._last_served = {}
+
+    def run(self, gray, faces, ids=None):
+        """
+        Run sub-detection on the faces of one frame.
+
+        Args:
+            gray: Shared grayscale frame
+            faces: Face boxes in frame coordinates
+            ids: Optional tracking IDs aligned with faces
+
+        Returns:
+            List of (eyes, smiles) aligned with faces; skipped faces get ([], [])
+        """
+        self.frame_index += 1
+        results = [([], [])] * len(faces)
+        order = sorted(
+            range(len(faces)),
+            key=lambda i: (self._last_served.get(ids[i], 0) if ids is not None else 0, -faces[i][2]),
+        )
+
+        start = time.perf_counter()
+        for position, i in enumerate(order):
+            if faces[i][2] < self.min_face_size:
+                self.skipped_small += 1
+                continue
+            if self.budget_ms is not None and (time.perf_counter() - start) * 1000 >= self.budget_ms:
+                self.skipped_budget += len(order) - position
+                break
+            results[i] = detect_face_parts(gray, faces[i], self.eye_params, self.smile_params)
+            if ids is not None:
+                self._last_served[ids[i]] = self.frame_index
+
+        if ids is not None and len(self._last_served) > 4 * len(faces) + 16:
+            live = set(ids)
+            self._last_served = {k: v for k, v in self._last_served.items() if k in live}
+        return results
+
+
+def _label(name, ids, index):
+    return name if ids is None else f"{name} #{ids[index]}"
+
+
+def draw_faces(frame, faces, ids=None):
+    for i, (x, y, w, h) in enumerate(faces):
+        cv2.rectangle(frame, (x, y), (x+w, y+h), FACE_BOX_COLOR, 3)
+        cv2.putText(frame, _label('Face', ids, i), (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, FACE_BOX_COLOR, 2)
+    return frame
+
+
+def draw_face_features(frame, results, ids=None):
+    for i, ((x, y, w, h), eyes, smiles) in enumerate(results):
+        cv2.rectangle(frame, (x, y), (x+w, y+h), FES_FACE_COLOR, 2)
+        cv2.putText(frame, _label("Face", ids, i), (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, FES_FACE_COLOR, 2)
+        for (ex, ey, ew, eh) in eyes:
+            cv2.rectangle(frame, (ex, ey), (ex+ew, ey+eh), EYE_COLOR, 2)
+        for (sx, sy, sw, sh) in smiles:
+            cv2.rectangle(frame, (sx, sy), (sx+sw, sy+sh), SMILE_COLOR, 2)
+    return frame
+
+
+def draw_plates(frame, plates, ids=None):
+    for i, (x, y, w, h) in enumerate(plates):
+        cv2.rectangle(frame, (x, y), (x + w, y + h), PLATE_COLOR, 3)
+        cv2.putText(frame, _label("Number Plate", ids, i), (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, PLATE_COLOR, 2)
+    return frame
+
+
+# mode name -> (cascade models, detect function, draw function)
+DETECTION_MODES = {
+    'face': (['face'], detect_faces, draw_faces),
+    'face_eye_smile': (['face', 'eye', 'smile'], detect_face_features, draw_face_features),
+    'plate': (['plate'], detect_plates, draw_plates),
+}
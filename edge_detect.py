@@ -1,18 +1,283 @@
-import cv2
+"""
+Edge Detection - Canny edges for a single image or a batch of images
+
+Usage:
+    python edge_detect.py <image_path>
+    python edge_detect.py --output-dir edges/ photos/ "scans/*.png" --list files.txt
+    python edge_detect.py --output-dir edges/ --tile 1024 --auto survey/
+
+With --output-dir the script runs headless: images stream through a bounded
+read -> grayscale -> Canny -> write pipeline on a thread pool (OpenCV releases
+the GIL while decoding, filtering and encoding), outputs that are newer than
+their input and were made with the same settings are skipped, and only a fixed
+number of images is in memory at once. Outputs keep the input's path below the
+common root of all inputs (directories, glob roots, the list's prefix) and its
+extension (a/1.jpg -> a/1.jpg.png), so distinct inputs never share an output.
+A file that fails is reported and counted, and the batch goes on.
+--tile splits each image into tiles processed in parallel (see tiled_canny.py,
+which also handles memory-mapped images too large to load), and --auto picks
+the thresholds from each image's median intensity. Batch workers and the
+OpenCV threads each one uses share one CPU budget (see thread_budget.py).
+"""
+
+import argparse
+import glob
+import json
+import os
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+from thread_budget import ThreadBudget
+from tiled_canny import TiledCanny, auto_thresholds
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+# Settings of the last completed batch, stored in the output directory
+SETTINGS_FILE = ".edge_settings.json"
+
+
+def glob_root(pattern):
+    """Leading directories of a glob pattern that contain no wildcards."""
+    parts = []
+    for part in pattern.replace(os.sep, "/").split("/")[:-1]:
+        if any(ch in part for ch in "*?["):
+            break
+        parts.append(part)
+    return "/".join(parts) or ("/" if pattern.startswith("/") else ".")
+
+
+def _list_paths(list_file):
+    with open(list_file) as f:
+        for line in f:
+            if line.strip():
+                yield line.strip()
+
+
+def input_root(patterns, list_file=None):
+    """
+    Deepest directory containing every input: the common path of the given
+    directories, glob roots, plain files' directories and listed files' directories.
+    """
+    roots = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            roots.append(pattern)
+        elif any(ch in pattern for ch in "*?["):
+            roots.append(glob_root(pattern))
+        else:
+            roots.append(os.path.dirname(pattern) or ".")
+    roots = [os.path.abspath(root) for root in roots]
+    if list_file:
+        # One streaming pass, so the list is never held in memory
+        for path in _list_paths(list_file):
+            roots = [os.path.commonpath(roots + [os.path.dirname(os.path.abspath(path))])]
+    return os.path.commonpath(roots) if roots else os.path.abspath(".")
+
+
+def iter_inputs(patterns, list_file=None):
+    """
+    Lazily yield (input_path, relative_output_name) pairs.
+
+    Names are each input's path relative to input_root() and keep the input's
+    extension. Distinct input files therefore always get distinct names, and
+    nothing is remembered about earlier inputs.
+
+    Args:
+        patterns: Image paths, directories (walked recursively) or glob patterns
+        list_file: Optional newline-delimited file of image paths
+    """
+    root = input_root(patterns, list_file)
+
+    def named(path):
+        return path, os.path.relpath(os.path.abspath(path), root)
+
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for directory, dirs, files in os.walk(pattern):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield named(os.path.join(directory, name))
+        elif any(ch in pattern for ch in "*?["):
+            for path in glob.iglob(pattern, recursive=True):
+                if path.lower().endswith(IMAGE_EXTENSIONS):
+                    yield named(path)
+        else:
+            yield named(pattern)
+
+    if list_file:
+        for path in _list_paths(list_file):
+            yield named(path)
+
+
+def is_up_to_date(input_path, output_path):
+    """Return True if output exists and is at least as new as the input."""
+    try:
+        return os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+    except OSError:
+        return False
+
+
+def edges(img, low=100, high=200, tile=None, auto=False, tile_workers=None):
+    """
+    Canny edge map of a BGR image.
+
+    Args:
+        low, high: Canny thresholds (ignored with auto)
+        tile: Run the tiled engine with this tile size; the result is identical
+        auto: Pick thresholds from the median intensity
+        tile_workers: Threads of the tiled engine (default: CPU count)
+    """
+    if auto:
+        low, high = auto_thresholds(img)
+    if tile:
+        return TiledCanny(tile, workers=tile_workers).run(img, np.empty(img.shape[:2], np.uint8), low, high)
+    return cv2.Canny(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), low, high)
+
+
+def edge_file(input_path, output_path, low=100, high=200, tile=None, auto=False, tile_workers=None):
+    """Read one image, run Canny and write the edge map. Returns True on success."""
+    img = cv2.imread(input_path)
+    if img is None:
+        return False
+    edge = edges(img, low, high, tile, auto, tile_workers)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    return cv2.imwrite(output_path, edge)
+
+
+def _load_settings(output_dir):
+    try:
+        with open(os.path.join(output_dir, SETTINGS_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def run_batch(inputs, output_dir, low=100, high=200, workers=None, force=False, tile=None, auto=False,
+              threads=None, pin=False):
+    """
+    Stream images through the edge pipeline and write edge maps.
+
+    Args:
+        inputs: Iterable of (input_path, relative_output_name)
+        output_dir: Directory for the edge maps (written as PNG)
+        low, high: Canny thresholds
+        workers: Thread count (default: tuned for this host, else CPU count)
+        force: Rewrite outputs even if they are up to date; implied when the
+            settings differ from the last completed batch in output_dir
+        tile, auto: Tiled engine and automatic thresholds, as for edges()
+        threads: OpenCV threads (and tiled-engine threads) per worker
+            (default: tuned, else what the workers leave of the CPUs)
+        pin: Pin the process to the budget's CPUs
+
+    Returns:
+        Dict with processed, skipped and failed counts and images per second
+    """
+    budget = ThreadBudget.tuned('canny', workers, threads, pin).apply()
+    workers = budget.workers
+    max_in_flight = 2 * workers
+    counts = {"processed": 0, "skipped": 0, "failed": 0}
+    settings = {"low": low, "high": high, "auto": auto, "tile": tile}
+    settings_path = os.path.join(output_dir, SETTINGS_FILE)
+    if _load_settings(output_dir) != settings:
+        # Existing outputs were made with other settings; until this batch
+        # completes, no settings file means nothing counts as up to date
+        force = True
+        if os.path.exists(settings_path):
+            os.remove(settings_path)
+    start = time.perf_counter()
+    last_report = start
+    pending = {}  # In-flight future -> input path
+
+    def collect(done):
+        for future in done:
+            input_path = pending.pop(future)
+            try:
+                ok = future.result()
+                error = "could not read or write the image"
+            except Exception as e:
+                ok, error = False, e
+            if ok:
+                counts["processed"] += 1
+            else:
+                counts["failed"] += 1
+                print(f"Error: Could not process {input_path}: {error}")
+
+    with ThreadPoolExecutor(workers) as pool:
+        for input_path, name in inputs:
+            output_path = os.path.join(output_dir, name + ".png")
+            if not force and is_up_to_date(input_path, output_path):
+                counts["skipped"] += 1
+                continue
+
+            if len(pending) >= max_in_flight:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            future = pool.submit(edge_file, input_path, output_path, low, high, tile, auto, budget.threads)
+            pending[future] = input_path
+
+            now = time.perf_counter()
+            if now - last_report >= 2.0:
+                print(f"  {counts['processed']} images, {counts['processed'] / (now - start):.1f} images/s")
+                last_report = now
+        collect(wait(pending).done)
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(settings_path, "w", encoding="utf-8") as f:
+        json.dump(settings, f)
+    elapsed = time.perf_counter() - start
+    counts["images_per_second"] = counts["processed"] / elapsed if elapsed > 0 else 0.0
+    return counts
+
+
+def show_single(image_path, low=100, high=200, tile=None, auto=False):
+    img = cv2.imread(image_path)
+
+    if img is None:
+        print(f"Error: Could not load image from {image_path}")
+        print("Usage: python edge_detect.py <image_path>")
+        sys.exit(1)
+
+    edge = edges(img, low, high, tile, auto)
+
+    cv2.imshow("original", img)
+    cv2.imshow("edge", edge)
+    cv2.waitKey(0)
+    cv2.destroyAllWindows()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Canny edge detection for one image or a batch of images.")
+    parser.add_argument("inputs", nargs="*",
+                        help="Image paths, directories or glob patterns")
+    parser.add_argument("--list", dest="list_file", help="Newline-delimited file of image paths")
+    parser.add_argument("--output-dir", help="Write edge maps here instead of showing a window")
+    parser.add_argument("--low", type=int, default=100, help="Canny lower threshold")
+    parser.add_argument("--high", type=int, default=200, help="Canny upper threshold")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel workers (default: tuned, else CPU count)")
+    parser.add_argument("--threads", type=int, default=None, help="OpenCV threads per worker")
+    parser.add_argument("--pin", action="store_true", help="Pin the process to the budget's CPUs")
+    parser.add_argument("--force", action="store_true", help="Rewrite outputs that are already up to date")
+    parser.add_argument("--tile", type=int, default=None, help="Process each image in tiles of this size")
+    parser.add_argument("--auto", action="store_true", help="Pick thresholds from each image's median intensity")
+    args = parser.parse_args()
 
-image_path = sys.argv[1] if len(sys.argv) > 1 else "sample_image.png"
-img = cv2.imread(image_path)
+    if args.output_dir is None:
+        show_single(args.inputs[0] if args.inputs else "sample_image.png", args.low, args.high,
+                    args.tile, args.auto)
+        return
 
-if img is None:
-    print(f"Error: Could not load image from {image_path}")
-    print("Usage: python edge_detect.py <image_path>")
-    sys.exit(1)
+    try:
+        counts = run_batch(iter_inputs(args.inputs, args.list_file), args.output_dir,
+                           args.low, args.high, args.workers, args.force, args.tile, args.auto,
+                           args.threads, args.pin)
+    except ValueError as e:
+        sys.exit(f"Error: {e}")
+    print(f"Done: {counts['processed']} written, {counts['skipped']} up to date, "
+          f"{counts['failed']} failed, {counts['images_per_second']:.1f} images/s")
 
-gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-edge = cv2.Canny(gray, 100, 200)
 
-cv2.imshow("original", img)
-cv2.imshow("edge", edge)
-cv2.waitKey(0)
-cv2.destroyAllWindows()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
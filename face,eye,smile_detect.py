@@ -1,36 +1,58 @@
-import cv2 
-
-face_cascade = cv2.CascadeClassifier('models/haarcascade_frontalface_default.xml')
-eye_cascade = cv2.CascadeClassifier('models/haarcascade_eye.xml')
-smile_cascade = cv2.CascadeClassifier('models/haarcascade_smile.xml')
+import sys
 
-cap = cv2.VideoCapture(0)
-
-while True:
-    ret, frame = cap.read()
+import cv2 
 
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    face_detect = face_cascade.detectMultiScale(gray, scaleFactor=2.0, minNeighbors=5)
-    
-    for (x, y, w, h) in face_detect:
+from autotune import LatencyController
+from detectors import SubDetectionScheduler
+from pipeline import Annotator, CaptureSource, Pipeline, WindowSink, detector_stage
+from recording import RecordingSink
+from thread_budget import configure
+
+# Frames wider than this are downscaled for face detection
+DETECT_WIDTH = 640
+# Run the face cascade every N frames and track faces in between
+DETECT_INTERVAL = 5
+# Time budget (ms) for eye/smile detection per frame; None is unlimited
+SUBDETECT_BUDGET_MS = 20
+# Reuse the last detections while less than `threshold` of the frame changes and
+# search only the changed regions otherwise; full detection at least every
+# `refresh_frames` detector calls. None runs the detector unconditionally
+MOTION = dict(threshold=0.005, refresh_frames=30)
+# Auto-tune detection width, scaleFactor and interval to hold this frame rate;
+# None keeps the settings above
+TARGET_FPS = None
+
+
+def draw(frame, results, ids):
+    for (x, y, w, h), eye_detect, smile_detect in results:
         cv2.rectangle(frame, (x, y), (x+w, y+h), (255, 0, 0), 3) 
         cv2.putText(frame, "Face", (x+50, y-30), cv2.FONT_HERSHEY_SIMPLEX, 3.0, (0, 100, 0), 4)   
-        Region_of_Interest_gray = gray[y:y+h, x:x+w]
-        Region_of_Interest_color = frame[y:y+h, x:x+w]
 
-        eye_detect = eye_cascade.detectMultiScale(Region_of_Interest_gray, scaleFactor=1.1, minNeighbors=25)
         for (x, y, w, h) in eye_detect:
-            cv2.rectangle(Region_of_Interest_color, (x, y), (x+w, y+h), (0, 255, 0), 3)
+            cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 3)
             cv2.putText(frame, "eye", (x-100, y+100), cv2.FONT_HERSHEY_SIMPLEX, 2.0, (100, 0, 0), 3)
 
-        smile_detect = smile_cascade.detectMultiScale(Region_of_Interest_color, scaleFactor=1.1, minNeighbors=25)
         for (x, y, w, h) in smile_detect:
-             cv2.rectangle(Region_of_Interest_color, (x, y), (x+w, y+h), (0, 0, 255), 3)
+             cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 0, 255), 3)
              cv2.putText(frame, "smile", (x+30, y-30), cv2.FONT_HERSHEY_SIMPLEX, 2.0, (0, 0, 100), 3)
 
-    cv2.imshow("Detected", frame)
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
 
-cap.release()
-cv2.destroyAllWindows()
\ No newline at end of file
+scheduler = SubDetectionScheduler(eye_params=(1.1, 25), smile_params=(1.1, 25), budget_ms=SUBDETECT_BUDGET_MS)
+# OpenCV/BLAS threads from this host's tuned budget (python thread_budget.py tune)
+configure('detect')
+source = CaptureSource(sys.argv[1] if len(sys.argv) > 1 else 0, realtime=True)
+sinks = [WindowSink("Detected")]
+if len(sys.argv) > 2:
+    # Optional second argument: record the annotated output (encoded in the background)
+    sinks.append(RecordingSink(sys.argv[2], fps=source.fps()))
+
+detector = detector_stage('face_eye_smile', DETECT_INTERVAL, draw, scheduler, motion=MOTION,
+                          scale_factor=2.0, min_neighbors=5, detect_width=DETECT_WIDTH)
+stages = [detector]
+if TARGET_FPS:
+    stages.append(LatencyController([detector], TARGET_FPS))
+stages.append(Annotator())
+
+pipeline = Pipeline(source, stages, sinks)
+pipeline.run()
+pipeline.close()
@@ -0,0 +1,284 @@
+"""
+Frame Capture - Threaded capture stage with a small ring buffer
+
+Purpose: Move camera/video I/O off the processing thread. A background thread
+reads frames into a bounded buffer so detection never waits on the driver and
+stale frames never pile up behind a slow consumer. Sources can be a device
+index, a video file, a directory of images or a glob pattern, so every loop can
+be exercised on a machine without a camera. Raw recordings written by
+frame_store.py are sources too and replay frame-exact, and record_to= writes
+one on the reader thread: every frame the source delivers, before the buffer
+policy drops any, with its capture timestamp.
+"""
+
+import glob
+import os
+import threading
+import time
+from collections import deque
+
+import cv2
+
+from frame_store import FrameReplay, FrameStoreWriter, is_frame_store
+
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+
+def parse_source(value):
+    """
+    Turn a command-line source argument into a capture source.
+
+    Args:
+        value: Device index as int or digit string, or a path/glob
+
+    Returns:
+        int for device indices, otherwise the string unchanged
+    """
+    if isinstance(value, int):
+        return value
+    if value.isdigit():
+        return int(value)
+    return value
+
+
+def _list_images(source):
+    """Return a sorted image list if source is a directory or glob, else None."""
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)]
+    elif any(ch in source for ch in "*?["):
+        paths = glob.glob(source)
+    else:
+        return None
+    return sorted(p for p in paths if p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+class _ImageSequence:
+    """Minimal VideoCapture-like reader over a list of image files."""
+
+    def __init__(self, paths, fps=30.0):
+        self.paths = paths
+        self.fps = fps
+        self.index = 0
+
+    def isOpened(self):
+        return len(self.paths) > 0
+
+    def read(self):
+        while self.index < len(self.paths):
+            frame = cv2.imread(self.paths[self.index])
+            self.index += 1
+            if frame is not None:
+                return True, frame
+        return False, None
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(len(self.paths))
+        return 0.0
+
+    def release(self):
+        self.index = len(self.paths)
+
+
+def open_source(source):
+    """
+    Open a device index, video file, image directory, image glob or frame store.
+
+    Returns:
+        An object with the cv2.VideoCapture read/get/isOpened/release API
+    """
+    source = parse_source(source)
+    if is_frame_store(source):
+        return FrameReplay(source)
+    if isinstance(source, str):
+        images = _list_images(source)
+        if images is not None:
+            return _ImageSequence(images)
+    return cv2.VideoCapture(source)
+
+
+class FrameCapture:
+    """
+    Background-thread frame reader with a bounded ring buffer.
+
+    Drop-in replacement for cv2.VideoCapture in the frame loops: read() returns
+    (ret, frame) and ret is False once the source is exhausted or failed.
+    Frames are timestamped (time.time()) when the reader receives them; the
+    timestamp of the frame last returned by read() is in self.timestamp.
+
+    Policies:
+        drop_oldest: the reader never waits; when the buffer is full the oldest
+            frame is discarded, and read() returns the newest frame (older
+            buffered frames are discarded too). Use for live cameras.
+        block: the reader waits for free space and read() returns frames in
+            order, so nothing is lost. Use for files that must be processed
+            completely.
+    """
+
+    def __init__(self, source=0, buffer_size=2, policy=DROP_OLDEST, realtime=False, frame_limit=None,
+                 record_to=None, capacity_mb=2048, max_frames=100_000, overwrite=False):
+        """
+        Args:
+            source: Device index, video path, image directory, glob or frame store
+            buffer_size: Maximum number of frames held in the ring buffer
+            policy: DROP_OLDEST or BLOCK
+            realtime: Pace file/image sources at their nominal fps so they
+                behave like a live camera; frame stores replay at
+                their recorded timing
+            frame_limit: Stop after reading this many frames from the source
+            record_to: Frame store directory receiving every frame read from
+                the source, for exact replay later (see frame_store.py)
+            capacity_mb, max_frames: Preallocated size of the recording; frames
+                beyond it are counted as record_dropped in stats()
+            overwrite: Replace an existing frame store at record_to
+
+        Raises:
+            FileExistsError: If record_to already holds a store and overwrite is False
+        """
+        if policy not in (DROP_OLDEST, BLOCK):
+            raise ValueError(f"Unknown capture policy: {policy}")
+        if buffer_size < 1:
+            raise ValueError("buffer_size must be at least 1")
+
+        self.source = parse_source(source)
+        self.policy = policy
+        self.buffer_size = buffer_size
+        self.realtime = realtime and not isinstance(self.source, int)
+
+        self.frames_captured = 0
+        self.frames_delivered = 0
+        self.frames_dropped = 0
+        self.frame_limit = frame_limit
+        self.timestamp = None
+
+        self._cap = open_source(self.source)
+        self.recorder = None
+        if record_to and self._cap.isOpened():
+            try:
+                self.recorder = FrameStoreWriter(record_to, capacity_mb, max_frames, overwrite=overwrite)
+            except FileExistsError:
+                self._cap.release()
+                raise
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._finished = not self._cap.isOpened()
+        self._thread = None
+        if not self._finished:
+            self._thread = threading.Thread(target=self._reader, name="FrameCapture", daemon=True)
+            self._thread.start()
+
+    def _reader(self):
+        fps = self._cap.get(cv2.CAP_PROP_FPS) or 30.0
+        interval = 1.0 / fps if self.realtime else 0.0
+        if isinstance(self._cap, FrameReplay):
+            # Recordings pace themselves by their timestamps, not a nominal fps
+            self._cap.realtime, interval = self.realtime, 0.0
+        next_time = time.perf_counter()
+        read = 0
+
+        while not self._stopped and (self.frame_limit is None or read < self.frame_limit):
+            ret, frame = self._cap.read()
+            if not ret:
+                break
+            read += 1
+            if interval:
+                next_time += interval
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            timestamp = time.time()
+            if self.recorder is not None:
+                # Before the buffer policy, so the recording has every frame the source delivered
+                self.recorder.append(frame, timestamp)
+
+            with self._cond:
+                if self.policy == BLOCK:
+                    while len(self._buffer) >= self.buffer_size and not self._stopped:
+                        self._cond.wait()
+                elif len(self._buffer) >= self.buffer_size:
+                    self._buffer.popleft()
+                    self.frames_dropped += 1
+                if self._stopped:
+                    break
+                self._buffer.append((frame, timestamp))
+                self.frames_captured += 1
+                self._cond.notify_all()
+
+        with self._cond:
+            self._finished = True
+            self._cond.notify_all()
+
+    def isOpened(self):
+        """Return True while frames are still available or expected."""
+        with self._cond:
+            return bool(self._buffer) or not self._finished
+
+    def read(self, timeout=None):
+        """
+        Return the next frame according to the buffer policy.
+
+        Args:
+            timeout: Seconds to wait for a frame; None waits indefinitely
+
+        Returns:
+            (ret, frame) like cv2.VideoCapture.read()
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._buffer or self._finished, timeout):
+                return False, None
+            if not self._buffer:
+                return False, None
+
+            if self.policy == DROP_OLDEST:
+                frame, self.timestamp = self._buffer.pop()
+                self.frames_dropped += len(self._buffer)
+                self._buffer.clear()
+            else:
+                frame, self.timestamp = self._buffer.popleft()
+            self.frames_delivered += 1
+            self._cond.notify_all()
+            return True, frame
+
+    def get(self, prop):
+        """Forward a property query to the underlying capture."""
+        return self._cap.get(prop)
+
+    def stats(self):
+        """Return capture counters as a dict, plus recorded/record_dropped while recording."""
+        with self._cond:
+            stats = {
+                "captured": self.frames_captured,
+                "delivered": self.frames_delivered,
+                "dropped": self.frames_dropped,
+                "buffered": len(self._buffer),
+            }
+        if self.recorder is not None:
+            stats["recorded"] = self.recorder.count
+            stats["record_dropped"] = self.recorder.dropped
+        return stats
+
+    def release(self):
+        """Stop the reader thread and release the underlying capture."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self._cap.release()
+        if self.recorder is not None:
+            self.recorder.close()
+        with self._cond:
+            self._buffer.clear()
+            self._finished = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
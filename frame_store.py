@@ -0,0 +1,388 @@
+"""
+Frame Store - Raw memory-mapped frame recordings and deterministic replay
+
+Purpose: Reproduce performance problems without the camera. FrameStoreWriter
+appends raw frames (no encoding, nothing lost) to a preallocated,
+memory-mapped data file and keeps an index of offsets, timestamps and shapes.
+FrameCapture(record_to=...) and CaptureSource record on the capture's reader
+thread, before the buffer drops anything, with the capture timestamps.
+Replays hand out views into the mapping, so serving a frame copies nothing:
+
+    FrameReplay   cv2.VideoCapture-style reader; frame_capture.open_source
+                  opens a store directory with it, so CaptureSource,
+                  FrameCapture and every script accept a recording as source
+    ReplaySource  pipeline source that also restores the recorded timestamps
+                  and frame indices, at the original timing or as fast as possible
+
+Layout of a store directory:
+
+    frames.bin   raw frame bytes, 64-byte aligned
+    index.bin    INDEX_DTYPE records, preallocated for max_frames
+    meta.json    frame count, capacity and format version
+
+Usage:
+    python frame_store.py record 0 captures/lobby --seconds 60
+    python frame_store.py info captures/lobby
+    python face_detection.py captures/lobby
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DATA_FILE = "frames.bin"
+INDEX_FILE = "index.bin"
+META_FILE = "meta.json"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+INDEX_DTYPE = np.dtype([
+    ('offset', np.uint64),
+    ('timestamp', np.float64),
+    ('height', np.uint32),
+    ('width', np.uint32),
+    ('channels', np.uint8),
+])
+
+
+def is_frame_store(path):
+    """Return True if path is a directory written by FrameStoreWriter."""
+    return isinstance(path, str) and os.path.isfile(os.path.join(path, META_FILE)) \
+        and os.path.isfile(os.path.join(path, DATA_FILE))
+
+
+class FrameStoreWriter:
+    """Append raw uint8 frames to a preallocated memory-mapped store."""
+
+    def __init__(self, path, capacity_mb=2048, max_frames=100_000, meta_interval=100, overwrite=False):
+        """
+        Args:
+            path: Store directory (created if missing)
+            capacity_mb: Space preallocated for frame data
+            max_frames: Index entries preallocated
+            meta_interval: Frames between meta.json updates, so a crashed
+                recording stays readable up to the last update
+            overwrite: Replace an existing store at path
+
+        Raises:
+            FileExistsError: If path already holds a store and overwrite is False
+        """
+        if not overwrite and is_frame_store(path):
+            raise FileExistsError(f"{path} already holds a frame store; pass overwrite to replace it")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.capacity = capacity_mb * 1024 * 1024
+        self.max_frames = max_frames
+        self.meta_interval = meta_interval
+        self.count = 0
+        self.dropped = 0
+        self._offset = 0
+        self._full_logged = False
+
+        with open(os.path.join(path, DATA_FILE), 'wb') as f:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), 0, self.capacity)
+            else:
+                f.truncate(self.capacity)
+        self._data = np.memmap(os.path.join(path, DATA_FILE), np.uint8, 'r+', shape=(self.capacity,))
+        self._index = np.memmap(os.path.join(path, INDEX_FILE), INDEX_DTYPE, 'w+', shape=(max_frames,))
+        self._write_meta()
+
+    def append(self, frame, timestamp):
+        """
+        Copy one frame into the store.
+
+        Returns:
+            False if the store is full and the frame was dropped
+        """
+        size = frame.nbytes
+        if self.count >= self.max_frames or self._offset + size > self.capacity:
+            self.dropped += 1
+            if not self._full_logged:
+                logger.warning("Frame store %s is full after %d frames", self.path, self.count)
+                self._full_logged = True
+            return False
+        self._data[self._offset:self._offset + size] = np.ascontiguousarray(frame, np.uint8).reshape(-1)
+        height, width = frame.shape[:2]
+        self._index[self.count] = (self._offset, timestamp, height, width, 1 if frame.ndim == 2 else frame.shape[2])
+        self.count += 1
+        self._offset += -(-size // ALIGNMENT) * ALIGNMENT
+        if self.count % self.meta_interval == 0:
+            self._write_meta()
+        return True
+
+    def _write_meta(self):
+        tmp_path = os.path.join(self.path, META_FILE + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': FORMAT_VERSION, 'frames': self.count, 'data_bytes': self._offset,
+                       'capacity': self.capacity, 'max_frames': self.max_frames}, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, META_FILE))
+
+    def stats(self):
+        return {'frames': self.count, 'dropped': self.dropped, 'bytes': self._offset, 'capacity': self.capacity}
+
+    def close(self):
+        """Flush, record the final count and give back the unused preallocated space."""
+        self._data.flush()
+        self._index.flush()
+        self._write_meta()
+        del self._data, self._index
+        with open(os.path.join(self.path, DATA_FILE), 'r+b') as f:
+            f.truncate(max(self._offset, 1))
+        logger.info("Frame store %s closed: %s", self.path, self.stats())
+
+
+class FrameStore:
+    """
+    Read-only view of a store directory.
+
+    Frames are views into a copy-on-write mapping: nothing is copied when a
+    frame is served, and stages that draw on it never modify the recording.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported frame store version in {path}: {self.meta.get('version')}")
+        self.path = path
+        count = self.meta['frames']
+        self.index = np.memmap(os.path.join(path, INDEX_FILE), INDEX_DTYPE, 'r', shape=(self.meta['max_frames'],))
+        self.index = self.index[:count]
+        data_path = os.path.join(path, DATA_FILE)
+        self._data = np.memmap(data_path, np.uint8, 'c') if count else np.empty(0, np.uint8)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def timestamps(self):
+        return self.index['timestamp']
+
+    def frame(self, i):
+        """Return frame i as a (height, width[, channels]) view into the mapping."""
+        offset, _, height, width, channels = self.index[i]
+        shape = (int(height), int(width)) if channels == 1 else (int(height), int(width), int(channels))
+        return self._data[int(offset):int(offset) + int(np.prod(shape))].reshape(shape)
+
+    def fps(self):
+        """Mean recorded frame rate, or None for fewer than two frames."""
+        if len(self) < 2:
+            return None
+        span = float(self.timestamps[-1] - self.timestamps[0])
+        return (len(self) - 1) / span if span > 0 else None
+
+
+class _Pacer:
+    """Sleep so frames are served at their recorded timing (scaled by speed)."""
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self._origin = None
+
+    def reset(self):
+        self._origin = None
+
+    def wait(self, timestamp):
+        now = time.perf_counter()
+        if self._origin is None:
+            self._origin = (now, timestamp)
+            return
+        delay = self._origin[0] + (timestamp - self._origin[1]) / self.speed - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class FrameReplay:
+    """
+    cv2.VideoCapture-compatible replay of a frame store.
+
+    Example:
+        cap = FrameReplay('captures/lobby', realtime=True)   # instead of cv2.VideoCapture(0)
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+    """
+
+    def __init__(self, path, realtime=False, speed=1.0, loop=False):
+        """
+        Args:
+            path: Store directory
+            realtime: Serve frames at the recorded timing instead of as fast as possible
+            speed: Timing multiplier with realtime (2.0 replays twice as fast)
+            loop: Start over at the end instead of reporting end of stream
+        """
+        self.store = FrameStore(path)
+        self.realtime = realtime
+        self.loop = loop
+        self.position = 0
+        self._pacer = _Pacer(speed)
+        self._released = False
+
+    def isOpened(self):
+        return not self._released and len(self.store) > 0
+
+    def read(self):
+        if self._released or not len(self.store):
+            return False, None
+        if self.position >= len(self.store):
+            if not self.loop:
+                return False, None
+            self.position = 0
+            self._pacer.reset()
+        if self.realtime:
+            self._pacer.wait(float(self.store.timestamps[self.position]))
+        frame = self.store.frame(self.position)
+        self.position += 1
+        return True, frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.store.fps() or 0.0
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(len(self.store))
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        if len(self.store) and prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT):
+            return float(self.store.index[0]['width' if prop == cv2.CAP_PROP_FRAME_WIDTH else 'height'])
+        return 0.0
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.position = max(0, min(len(self.store), int(value)))
+            self._pacer.reset()
+            return True
+        return False
+
+    def release(self):
+        self._released = True
+
+
+class ReplaySource:
+    """
+    Pipeline source replaying a frame store with its recorded indices and timestamps.
+
+    Runs are deterministic: every frame is delivered, in order, with the
+    timestamps the camera produced, so rate limits and fps estimates behave
+    as they did live.
+    """
+
+    name = "capture"
+
+    def __init__(self, path, realtime=False, speed=1.0):
+        """
+        Args:
+            path: Store directory
+            realtime: Serve frames at the recorded timing; False replays as fast as possible
+            speed: Timing multiplier with realtime
+        """
+        self.store = FrameStore(path)
+        self.realtime = realtime
+        self.position = 0
+        self._pacer = _Pacer(speed)
+
+    def isOpened(self):
+        return self.position < len(self.store)
+
+    def fps(self):
+        return self.store.fps()
+
+    def stats(self):
+        return {'captured': self.position, 'delivered': self.position, 'dropped': 0,
+                'buffered': len(self.store) - self.position}
+
+    def read(self):
+        """Return the next FrameContext, or None at the end of the recording."""
+        from pipeline import FrameContext
+
+        if self.position >= len(self.store):
+            return None
+        timestamp = float(self.store.timestamps[self.position])
+        if self.realtime:
+            self._pacer.wait(timestamp)
+        ctx = FrameContext(self.store.frame(self.position), self.position, timestamp)
+        self.position += 1
+        return ctx
+
+    def close(self):
+        self.position = len(self.store)
+
+
+def record(source, path, seconds=None, frames=None, capacity_mb=2048, max_frames=100_000, overwrite=False):
+    """
+    Record raw frames from a capture source until the time or frame limit or the source ends.
+
+    Returns:
+        Writer stats
+
+    Raises:
+        ValueError: If the source cannot be opened
+        FileExistsError: If path already holds a store and overwrite is False
+    """
+    from frame_capture import BLOCK, DROP_OLDEST, FrameCapture, parse_source
+
+    # The capture's reader thread records every frame, whatever the buffer drops
+    policy = DROP_OLDEST if isinstance(parse_source(source), int) else BLOCK
+    capture = FrameCapture(source, policy=policy, frame_limit=frames, record_to=path,
+                           capacity_mb=capacity_mb, max_frames=max_frames, overwrite=overwrite)
+    writer = capture.recorder
+    if writer is None:
+        raise ValueError(f"Cannot open source: {source}")
+    start = time.perf_counter()
+    try:
+        while seconds is None or time.perf_counter() - start < seconds:
+            ret, _ = capture.read(timeout=0.5)
+            if (not ret and not capture.isOpened()) or writer.dropped:
+                break
+    finally:
+        capture.release()
+    return writer.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record raw frames for exact replay, or describe a recording.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rec = commands.add_parser('record', help="Record raw frames from a camera or video")
+    rec.add_argument('source', help="Device index, video file, image directory or glob")
+    rec.add_argument('path', help="Store directory")
+    rec.add_argument('--seconds', type=float, default=None)
+    rec.add_argument('--frames', type=int, default=None)
+    rec.add_argument('--capacity-mb', type=int, default=2048, help="Preallocated frame data size")
+    rec.add_argument('--max-frames', type=int, default=100_000, help="Preallocated index entries")
+    rec.add_argument('--overwrite', action='store_true', help="Replace an existing store at path")
+
+    info = commands.add_parser('info', help="Describe a recording")
+    info.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        try:
+            stats = record(args.source, args.path, args.seconds, args.frames, args.capacity_mb, args.max_frames,
+                           args.overwrite)
+        except (ValueError, FileExistsError) as e:
+            sys.exit(f"Error: {e}")
+        print(f"Recorded {stats['frames']} frames ({stats['bytes'] / 1e6:.1f} MB), {stats['dropped']} dropped")
+    else:
+        store = FrameStore(args.path)
+        if not len(store):
+            print("Empty recording")
+            return
+        shapes = {tuple(int(v) for v in row) for row in store.index[['height', 'width', 'channels']].tolist()}
+        fps = store.fps()
+        print(f"{len(store)} frames, {float(store.timestamps[-1] - store.timestamps[0]):.2f} s, "
+              f"{f'{fps:.1f} fps' if fps else 'fps unknown'}, shapes (h, w, c): {sorted(shapes)}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    main()
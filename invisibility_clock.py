@@ -1,42 +1,24 @@
-import cv2 
-import numpy as np
-import time
+import sys
+
+from cloak import CLOAK_COLORS
+from pipeline import CaptureSource, CloakStage, Pipeline, WindowSink
+from recording import RecordingSink
+from thread_budget import configure
 
 COLORS = {
-    '1': {
-        'name': 'Red',
-        'lower1': np.array([0, 120, 70]),
-        'upper1': np.array([10, 255, 255]),
-        'lower2': np.array([170, 120, 70]),
-        'upper2': np.array([180, 255, 255]),
-        'has_two_ranges': True
-    },
-    '2': {
-        'name': 'Blue',
-        'lower1': np.array([100, 150, 50]),
-        'upper1': np.array([140, 255, 255]),
-        'has_two_ranges': False
-    },
-    '3': {
-        'name': 'Green',
-        'lower1': np.array([40, 50, 50]),
-        'upper1': np.array([80, 255, 255]),
-        'has_two_ranges': False
-    },
-    '4': {
-        'name': 'Yellow',
-        'lower1': np.array([20, 100, 100]),
-        'upper1': np.array([30, 255, 255]),
-        'has_two_ranges': False
-    },
-    '5': {
-        'name': 'Black',
-        'lower1': np.array([0, 0, 0]),
-        'upper1': np.array([180, 255, 50]),
-        'has_two_ranges': False
-    }
+    str(number): dict(name=name, **settings)
+    for number, (name, settings) in enumerate(CLOAK_COLORS.items(), start=1)
 }
 
+# How quickly the background follows lighting and camera changes (0-1]
+BACKGROUND_RATE = 0.05
+# Cloak mask preset from cloak.MASK_QUALITY: 'full' is a binary mask at frame
+# resolution; 'high', 'balanced' and 'fast' build it at reduced resolution and
+# blend a soft matte (cheaper, and without hard seams)
+MASK_QUALITY = 'full'
+# Split the recording into files of this many seconds; None keeps one file
+SEGMENT_SECONDS = None
+
 print("\n" + "="*50)
 print("    INVISIBILITY CLOAK - COLOR SELECTION")
 print("="*50)
@@ -52,54 +34,30 @@ if color_choice not in COLORS:
 
 selected_color = COLORS[color_choice]
 print(f"\n✓ Selected: {selected_color['name']} Cloak")
-print("\nStarting camera... Please step away from the frame for background capture.\n")
-
-cap = cv2.VideoCapture(0)
-fourcc = cv2.VideoWriter_fourcc(*'XVID')
-save_file = cv2.VideoWriter("invisibility_clock.avi", fourcc, 20.0, (640, 480))
-
-time.sleep(2)
-background = 0
-for i in range(20):
-    ret, background = cap.read()
-background = np.flip(background, axis=1)
-
-kernel = np.ones((3, 3), np.uint8)
-
-while cap.isOpened():
-    ret, frame = cap.read()
-    if not ret:
-        break
-
-    frame = np.flip(frame, axis=1)
-    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-
-    mask_1 = cv2.inRange(hsv, selected_color['lower1'], selected_color['upper1'])
-    
-    if selected_color['has_two_ranges']:
-        mask_2 = cv2.inRange(hsv, selected_color['lower2'], selected_color['upper2'])
-        mask = mask_1 + mask_2
-    else:
-        mask = mask_1
-    
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=2)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_DILATE, kernel, iterations=1)
-
-    mask_inv = cv2.bitwise_not(mask)
-
-    result_1 = cv2.bitwise_and(background, background, mask=mask)
-    result_2 = cv2.bitwise_and(frame, frame, mask=mask_inv)
-    final_output = cv2.addWeighted(result_1, 1, result_2, 1, 0)
-
-    cv2.imshow(f"Invisibility Cloak - {selected_color['name']}", final_output)
-    save_file.write(final_output)
-
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
-
-cap.release()
-save_file.release()
-cv2.destroyAllWindows()
+print("\nStarting camera... The background is learned from everything your cloak does not cover.\n")
+
+# OpenCV/BLAS threads from this host's tuned budget (python thread_budget.py tune)
+configure('cloak')
+source = CaptureSource(sys.argv[1] if len(sys.argv) > 1 else 0, realtime=True)
+# Size comes from the frames and fps from the source; encoding runs in the background
+recorder = RecordingSink("invisibility_clock.avi", fps=source.fps(), segment_seconds=SEGMENT_SECONDS)
+
+cloak = CloakStage(selected_color, adapt_rate=BACKGROUND_RATE, quality=MASK_QUALITY)
+pipeline = Pipeline(
+    source,
+    [cloak],
+    [WindowSink(f"Invisibility Cloak - {selected_color['name']}"), recorder],
+)
+if source.isOpened():
+    pipeline.run()
+
+pipeline.close()
+stats = recorder.stats()
+print(f"Saved {stats['written']} frames to {', '.join(stats['files']) or 'nothing'} "
+      f"({stats['dropped']} dropped, max queue depth {stats['max_queue_depth']})")
+cloak_stats = cloak.stats()
+print(f"Cloak ({cloak_stats['quality']} mask), ms/frame: "
+      + ", ".join(f"{step} {ms:.2f}" for step, ms in cloak_stats['step_ms'].items()))
 
 
 
@@ -0,0 +1,292 @@
+"""
+Metrics - Per-stage counters and histograms with a Prometheus text endpoint
+
+Purpose: Live visibility into running pipelines (capture fps, per-stage time,
+dropped frames, detections per frame). Pipelines only pay for collection when
+a PipelineMetrics observer is attached; the registry can be rendered in the
+Prometheus text format and served on a local HTTP port for scraping.
+
+Example:
+    pipeline = Pipeline(source, stages, sinks, metrics=PipelineMetrics('face'))
+    metrics.serve(port=9108)      # curl localhost:9108/metrics
+"""
+
+import bisect
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile by linear interpolation inside the bucket (like histogram_quantile)."""
+        if not self.count:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """Thread-safe set of labelled counters, gauges and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {}  # name -> [type, help, buckets, {labels: value}]
+
+    def _declare(self, kind, name, help_text, buckets=None):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                self._families[name] = [kind, help_text, buckets, {}]
+            elif family[0] != kind:
+                raise ValueError(f"Metric {name} is already registered as a {family[0]}")
+
+    def counter(self, name, help_text):
+        self._declare('counter', name, help_text)
+
+    def gauge(self, name, help_text):
+        self._declare('gauge', name, help_text)
+
+    def histogram(self, name, help_text, buckets=SECONDS_BUCKETS):
+        self._declare('histogram', name, help_text, tuple(buckets))
+
+    def _series(self, name, labels):
+        family = self._families.get(name)
+        if family is None:
+            raise KeyError(f"Unknown metric: {name}")
+        return family, tuple(sorted(labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            family, key = self._series(name, labels)
+            family[3][key] = family[3].get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            family, key = self._series(name, labels)
+            family[3][key] = value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            family, key = self._series(name, labels)
+            histogram = family[3].get(key)
+            if histogram is None:
+                histogram = family[3][key] = _Histogram(family[2])
+            histogram.observe(value)
+
+    def snapshot(self):
+        """
+        Return current values.
+
+        Returns:
+            {name: {labels_tuple: value}}; histograms are summarised as dicts
+            with count, sum, mean, p50 and p95
+        """
+        with self._lock:
+            result = {}
+            for name, (kind, _, _, series) in self._families.items():
+                if kind == 'histogram':
+                    result[name] = {
+                        labels: {
+                            'count': h.count, 'sum': h.sum,
+                            'mean': h.sum / h.count if h.count else math.nan,
+                            'p50': h.quantile(0.5), 'p95': h.quantile(0.95),
+                        }
+                        for labels, h in series.items()
+                    }
+                else:
+                    result[name] = dict(series)
+            return result
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        def fmt_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in pairs)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets, series) in self._families.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in series.items():
+                    if kind != 'histogram':
+                        lines.append(f"{name}{fmt_labels(labels)} {value}")
+                        continue
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets + (math.inf,), value.counts):
+                        cumulative += bucket_count
+                        le = "+Inf" if bound == math.inf else repr(bound)
+                        lines.append(f"{name}_bucket{fmt_labels(labels, [('le', le)])} {cumulative}")
+                    lines.append(f"{name}_sum{fmt_labels(labels)} {value.sum}")
+                    lines.append(f"{name}_count{fmt_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class PipelineMetrics:
+    """
+    Pipeline observer recording per-frame metrics into a registry.
+
+    Metrics (all labelled with mode, stage timings also with stage):
+        vision_frames_total, vision_stage_seconds, vision_frame_seconds,
+        vision_detections_per_frame, vision_dropped_frames_total,
+        vision_capture_fps, vision_delivered_fps
+
+    Capture fps counts the frames the source read (its 'captured' stat), so it
+    stays at the camera rate while a slow pipeline drops frames; delivered fps
+    counts the frames the pipeline processed.
+    """
+
+    def __init__(self, mode, registry=REGISTRY, fps_smoothing=0.3, fps_window=0.5):
+        """
+        Args:
+            mode: Label value for every series
+            registry: MetricsRegistry to record into
+            fps_smoothing: Weight of the newest window in the smoothed fps gauges
+            fps_window: Seconds over which frame counts are turned into a rate
+        """
+        self.mode = mode
+        self.registry = registry
+        self.fps_smoothing = fps_smoothing
+        self.fps_window = fps_window
+        self._observed = 0
+        self._window = None
+        self._fps = {}
+        self._dropped = None
+        registry.counter("vision_frames_total", "Frames processed")
+        registry.histogram("vision_stage_seconds", "Time spent per frame in each pipeline stage")
+        registry.histogram("vision_frame_seconds", "End-to-end processing time per frame")
+        registry.histogram("vision_detections_per_frame", "Detections per frame", COUNT_BUCKETS)
+        registry.counter("vision_dropped_frames_total", "Frames dropped by the capture buffer")
+        registry.gauge("vision_capture_fps", "Smoothed rate of frames read from the camera or file")
+        registry.gauge("vision_delivered_fps", "Smoothed rate of frames delivered to the pipeline")
+
+    def observe(self, ctx, pipeline):
+        """Record one processed frame (called by Pipeline.step)."""
+        registry, mode = self.registry, self.mode
+        registry.inc("vision_frames_total", mode=mode)
+        for stage, elapsed in ctx.timings.items():
+            registry.observe("vision_stage_seconds", elapsed, mode=mode, stage=stage)
+        registry.observe("vision_frame_seconds", sum(ctx.timings.values()), mode=mode)
+        if ctx.detections:
+            registry.observe("vision_detections_per_frame",
+                             sum(len(d.results) for d in ctx.detections.values()), mode=mode)
+
+        stats = getattr(pipeline.source, 'stats', None)
+        stats = stats() if stats is not None else {}
+        if 'dropped' in stats:
+            dropped = stats['dropped']
+            if self._dropped is not None and dropped > self._dropped:
+                registry.inc("vision_dropped_frames_total", dropped - self._dropped, mode=mode)
+            self._dropped = dropped
+
+        # Sources without a capture counter read only what they deliver
+        self._observed += 1
+        captured = stats.get('captured', self._observed)
+        now = time.perf_counter()
+        if self._window is None:
+            self._window = (now, captured, self._observed)
+        elif now - self._window[0] >= self.fps_window:
+            start, start_captured, start_observed = self._window
+            elapsed = now - start
+            for name, frames in (("vision_capture_fps", captured - start_captured),
+                                 ("vision_delivered_fps", self._observed - start_observed)):
+                fps, previous = frames / elapsed, self._fps.get(name)
+                self._fps[name] = fps if previous is None else previous + self.fps_smoothing * (fps - previous)
+                registry.set(name, self._fps[name], mode=mode)
+            self._window = (now, captured, self._observed)
+
+    def summary(self):
+        """Return this mode's current values for display: capture/delivered fps, dropped, stage times, detections."""
+        snapshot = self.registry.snapshot()
+        mine = (('mode', self.mode),)
+        stages = {
+            dict(labels)['stage']: value
+            for labels, value in snapshot["vision_stage_seconds"].items()
+            if ('mode', self.mode) in labels
+        }
+        return {
+            'frames': snapshot["vision_frames_total"].get(mine, 0),
+            'capture_fps': snapshot["vision_capture_fps"].get(mine, math.nan),
+            'delivered_fps': snapshot["vision_delivered_fps"].get(mine, math.nan),
+            'dropped': snapshot["vision_dropped_frames_total"].get(mine, 0),
+            'stages': stages,
+            'detections': snapshot["vision_detections_per_frame"].get(mine),
+        }
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would flood stderr
+
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def serve(registry=REGISTRY, port=9108, host='127.0.0.1'):
+    """
+    Serve registry.render() at http://host:port/metrics on a daemon thread.
+
+    Idempotent per (host, port), so Streamlit reruns reuse the running server.
+
+    Returns:
+        The ThreadingHTTPServer
+    """
+    with _servers_lock:
+        server = _servers.get((host, port))
+        if server is None:
+            handler = type("MetricsHandler", (_MetricsHandler,), {'registry': registry})
+            server = ThreadingHTTPServer((host, port), handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name=f"metrics-{port}", daemon=True).start()
+            _servers[(host, port)] = server
+            logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+        return server
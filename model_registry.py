@@ -0,0 +1,110 @@
+"""
+Model Registry - Load-once Haar Cascade classifiers
+
+Purpose: Parse each cascade XML under models/ a single time per process and
+hand the same classifier to every caller. The Streamlit app (all sessions) and
+the standalone scripts share this cache, and models are only loaded the first
+time they are requested so the Home page never parses them.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+
+CASCADE_FILES = {
+    "face": "haarcascade_frontalface_default.xml",
+    "eye": "haarcascade_eye.xml",
+    "smile": "haarcascade_smile.xml",
+    "plate": "haarcascade_russian_plate_number.xml",
+}
+
+_cascades = {}
+_detect_locks = {}
+_load_times = {}
+_registry_lock = threading.Lock()
+
+
+def get_cascade(name):
+    """
+    Return the shared classifier for a model, loading it on first use.
+
+    Args:
+        name: Model key from CASCADE_FILES (e.g. 'face', 'plate')
+
+    Returns:
+        A validated cv2.CascadeClassifier
+
+    Raises:
+        KeyError: If the model name is unknown
+        FileNotFoundError: If the XML file is missing
+        ValueError: If OpenCV cannot parse the XML
+    """
+    cascade = _cascades.get(name)
+    if cascade is not None:
+        return cascade
+
+    with _registry_lock:
+        cascade = _cascades.get(name)
+        if cascade is not None:
+            return cascade
+
+        if name not in CASCADE_FILES:
+            raise KeyError(f"Unknown cascade model: {name}")
+        model_path = os.path.join(MODELS_DIR, CASCADE_FILES[name])
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model file not found: {model_path}")
+
+        start = time.perf_counter()
+        cascade = cv2.CascadeClassifier(model_path)
+        elapsed = time.perf_counter() - start
+        if cascade.empty():
+            raise ValueError(f"Could not load cascade model: {model_path}")
+
+        _load_times[name] = elapsed
+        _detect_locks[name] = threading.Lock()
+        _cascades[name] = cascade
+        logger.info("Loaded cascade '%s' in %.1f ms", name, elapsed * 1000)
+    return cascade
+
+
+def detect(name, image, **params):
+    """
+    Run detectMultiScale with the shared classifier for a model.
+
+    A classifier keeps per-call scratch state, so calls on the same model are
+    serialized; different models can still run concurrently.
+
+    Args:
+        name: Model key from CASCADE_FILES
+        image: Grayscale image to search
+        **params: Keyword arguments forwarded to detectMultiScale
+
+    Returns:
+        Array of (x, y, w, h) boxes
+    """
+    cascade = get_cascade(name)
+    with _detect_locks[name]:
+        return cascade.detectMultiScale(image, **params)
+
+
+def preload(names=None):
+    """Load the given models (all of them by default) ahead of first use."""
+    for name in names or CASCADE_FILES:
+        get_cascade(name)
+
+
+def is_loaded(name):
+    """Return True if a model has already been loaded in this process."""
+    return name in _cascades
+
+
+def load_times():
+    """Return a dict of model name -> load time in seconds for loaded models."""
+    return dict(_load_times)
@@ -0,0 +1,174 @@
+"""
+Motion Gate - Skip detection on static frames, search only what changed
+
+Purpose: Fixed cameras (plates, entrances) spend most of their time looking at
+an unchanged scene, and every cascade pass recomputes the same answer.
+MotionGate wraps a detector: each frame is downscaled, blurred and compared
+with the frame of the last detection. Below the change threshold the previous
+boxes are returned without running the detector. With motion, the detector can
+run on the changed regions only, keeping the boxes elsewhere. Regions are
+detected at the same scale as the full pass, so a region search finds the
+same object sizes as a full detection and costs a fraction of it. A full
+detection is forced after a configurable number of frames so slow drift and missed
+objects are eventually corrected.
+
+Example:
+    gate = MotionGate(functools.partial(detect_plates, detect_width=640), threshold=0.005, refresh_frames=30)
+    boxes = gate(gray)
+    print(gate.stats())
+"""
+
+import cv2
+import numpy as np
+
+
+def _overlaps(a, b):
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+def _union(a, b):
+    x0, y0 = min(a[0], b[0]), min(a[1], b[1])
+    x1, y1 = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def merge_boxes(boxes):
+    """Merge overlapping (x, y, w, h) boxes until none overlap."""
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                if _overlaps(boxes[i], boxes[j]):
+                    boxes[i] = _union(boxes[i], boxes.pop(j))
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+
+class MotionGate:
+    """Detector wrapper that reuses the last boxes while the scene is static."""
+
+    def __init__(self, detect, threshold=0.005, refresh_frames=30, regions=True, gate_width=160,
+                 pixel_threshold=20, margin=0.5, min_region=64, max_region_fraction=0.5, detect_width=None):
+        """
+        Args:
+            detect: Callable taking a grayscale frame, returning (x, y, w, h) boxes
+            threshold: Fraction of changed pixels (0-1) below which a frame counts as static
+            refresh_frames: Run a full detection at least every this many calls; None never forces
+            regions: On motion, detect only inside the changed regions instead of the whole frame
+            gate_width: Width of the downscaled comparison frame
+            pixel_threshold: Gray-level difference that marks a pixel as changed
+            margin: Changed regions grow by this fraction of their size on each side
+            min_region: Minimum region side in full-resolution pixels (room for the cascade window)
+            max_region_fraction: Fall back to a full detection when regions cover more of the frame
+            detect_width: Width the detector's full pass runs at, passed on scaled to each
+                region's width; defaults to the detect_width keyword of a functools.partial
+                detector, None detects regions at full resolution
+        """
+        if not 0 <= threshold < 1:
+            raise ValueError("threshold must be in [0, 1)")
+        if refresh_frames is not None and refresh_frames < 1:
+            raise ValueError("refresh_frames must be at least 1")
+        self.detect = detect
+        self.threshold = threshold
+        self.refresh_frames = refresh_frames
+        self.regions = regions
+        self.gate_width = gate_width
+        self.pixel_threshold = pixel_threshold
+        self.margin = margin
+        self.min_region = min_region
+        self.max_region_fraction = max_region_fraction
+        if detect_width is None:
+            detect_width = getattr(detect, 'keywords', {}).get('detect_width')
+        self.detect_width = detect_width
+
+        self.boxes = []
+        self.changed = 0.0
+        self.counts = {'full': 0, 'regions': 0, 'skipped': 0}
+        self._reference = None
+        self._since_full = 0
+
+    def reset(self):
+        """Forget the reference frame; the next call runs a full detection."""
+        self._reference = None
+        self.boxes = []
+
+    def _small(self, gray):
+        height, width = gray.shape[:2]
+        if width > self.gate_width:
+            size = (self.gate_width, max(1, round(height * self.gate_width / width)))
+            gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def __call__(self, gray):
+        small = self._small(gray)
+        reference, self._reference = self._reference, small
+        if (reference is None or reference.shape != small.shape
+                or (self.refresh_frames is not None and self._since_full + 1 >= self.refresh_frames)):
+            return self._full(gray)
+
+        mask = cv2.absdiff(small, reference) > self.pixel_threshold
+        self.changed = np.count_nonzero(mask) / mask.size
+        if self.changed < self.threshold:
+            # Keep comparing against the last detected frame so slow drift adds up
+            self._reference = reference
+            self._since_full += 1
+            self.counts['skipped'] += 1
+            return self.boxes
+        if not self.regions:
+            return self._full(gray)
+
+        regions = self._changed_regions(mask, gray.shape)
+        height, width = gray.shape[:2]
+        ratio = self.detect_width / width if self.detect_width and self.detect_width < width else 1.0
+        # Compare the work at detection scale, where both the full pass and the regions run
+        area = sum(max(1, round(w * ratio)) * max(1, round(h * ratio)) for _, _, w, h in regions)
+        if area > self.max_region_fraction * round(width * ratio) * round(height * ratio):
+            return self._full(gray)
+
+        boxes = [box for box in self.boxes if not any(_overlaps(box, region) for region in regions)]
+        for rx, ry, rw, rh in regions:
+            crop = gray[ry:ry + rh, rx:rx + rw]
+            found = self.detect(crop) if ratio == 1.0 else self.detect(crop, detect_width=max(1, round(rw * ratio)))
+            boxes += [(x + rx, y + ry, w, h) for x, y, w, h in found]
+        self.boxes = boxes
+        self._since_full += 1
+        self.counts['regions'] += 1
+        return self.boxes
+
+    def _full(self, gray):
+        self.boxes = [tuple(box) for box in self.detect(gray)]
+        self._since_full = 0
+        self.counts['full'] += 1
+        return self.boxes
+
+    def _changed_regions(self, mask, shape):
+        """Full-resolution regions around the changed pixels, including boxes they touch."""
+        height, width = shape[:2]
+        scale = width / mask.shape[1]
+        mask = cv2.dilate(mask.astype(np.uint8), np.ones((3, 3), np.uint8), iterations=2)
+        count, _, components, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        regions = []
+        for x, y, w, h, _ in components[1:count]:
+            x, y, w, h = x * scale, y * scale, w * scale, h * scale
+            grow_x = max(w * self.margin, (self.min_region - w) / 2)
+            grow_y = max(h * self.margin, (self.min_region - h) / 2)
+            regions.append((int(x - grow_x), int(y - grow_y), int(w + 2 * grow_x), int(h + 2 * grow_y)))
+        # An object that moved must be searched for around its old position too
+        regions = merge_boxes(regions + [box for box in self.boxes if any(_overlaps(box, r) for r in regions)])
+        clamped = []
+        for x, y, w, h in regions:
+            x0, y0 = max(0, x), max(0, y)
+            x1, y1 = min(width, x + w), min(height, y + h)
+            if x1 > x0 and y1 > y0:
+                clamped.append((x0, y0, x1 - x0, y1 - y0))
+        return clamped
+
+    def stats(self):
+        """Return full detections, region detections, skipped frames and the last change fraction."""
+        calls = sum(self.counts.values())
+        return dict(self.counts, skip_rate=self.counts['skipped'] / calls if calls else 0.0, changed=self.changed)
@@ -1,24 +1,54 @@
+import sys
+
 import cv2
 
-plate_cascade = cv2.CascadeClassifier("models/haarcascade_russian_plate_number.xml")
-cap = cv2.VideoCapture(0)
+from autotune import LatencyController
+from pipeline import Annotator, CaptureSource, Pipeline, WindowSink, detector_stage
+from plate_ocr import PlateRecognitionStage, default_recognizer
+from recording import RecordingSink
+from thread_budget import configure
 
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
+# Frames wider than this are downscaled for detection
+DETECT_WIDTH = 640
+# Run the cascade every N frames and track plates in between
+DETECT_INTERVAL = 5
+# Reuse the last detections while less than `threshold` of the frame changes and
+# search only the changed regions otherwise; full detection at least every
+# `refresh_frames` detector calls. None runs the detector unconditionally
+MOTION = dict(threshold=0.005, refresh_frames=30)
+# Auto-tune detection width, scaleFactor and interval to hold this frame rate;
+# None keeps the settings above
+TARGET_FPS = None
 
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    plates = plate_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=10)
 
+def draw(frame, plates, ids):
     for (x, y, w, h) in plates:
         cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 3)
         cv2.putText(frame, "Number Plate", (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
 
-    cv2.imshow("Number Plate Detection", frame)
 
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
+# OpenCV/BLAS threads from this host's tuned budget (python thread_budget.py tune)
+configure('detect')
+source = CaptureSource(sys.argv[1] if len(sys.argv) > 1 else 0, realtime=True)
+sinks = [WindowSink("Number Plate Detection")]
+if len(sys.argv) > 2:
+    # Optional second argument: record the annotated output (encoded in the background)
+    sinks.append(RecordingSink(sys.argv[2], fps=source.fps()))
+
+detector = detector_stage('plate', DETECT_INTERVAL, draw, motion=MOTION,
+                          scale_factor=1.1, min_neighbors=10, detect_width=DETECT_WIDTH)
+stages = [detector]
+if TARGET_FPS:
+    stages.append(LatencyController([detector], TARGET_FPS))
+# Read plate text when pytesseract is installed; each distinct plate is recognized once
+recognizer = default_recognizer()
+ocr = PlateRecognitionStage(recognizer) if recognizer else None
+if ocr:
+    stages.append(ocr)
+stages.append(Annotator())
 
-cap.release()
-cv2.destroyAllWindows()
+pipeline = Pipeline(source, stages, sinks)
+pipeline.run()
+pipeline.close()
+if ocr:
+    print("Plate OCR:", ocr.stats())
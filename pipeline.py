@@ -0,0 +1,541 @@
+"""
+Pipeline - Composable frame-processing stages shared by the app and scripts
+
+Purpose: One frame loop (source -> preprocess -> detectors -> annotator ->
+sinks) instead of a copy per script. Every frame travels as a FrameContext
+that computes shared intermediates such as the grayscale image and the
+mirrored frame lazily and only once, so running several detectors together
+(e.g. face plus plate) costs a single color conversion.
+
+Example:
+    pipeline = Pipeline(
+        CaptureSource(0),
+        [detector_stage('face'), detector_stage('plate'), Annotator()],
+        [WindowSink("Detected")],
+    )
+    pipeline.run()
+    pipeline.close()
+"""
+
+import logging
+import threading
+import time
+from collections import namedtuple
+from functools import partial
+
+import cv2
+
+import detectors
+from cloak import CLOAK_COLORS, MASK_QUALITY, BackgroundModel, CloakCompositor
+from frame_capture import FrameCapture
+from motion_gate import MotionGate
+from tracking import TrackingDetector, split_tracks
+
+logger = logging.getLogger(__name__)
+
+# results are in the detector's own format, draw(frame, results, ids) renders them;
+# nested results are (face, eyes, smiles) tuples instead of plain boxes; labels
+# (e.g. plate text) are per-result strings passed to draw as labels=
+Detections = namedtuple("Detections", "results ids draw nested labels", defaults=(False, None))
+
+
+class FrameContext:
+    """One frame plus the intermediates and results computed for it."""
+
+    def __init__(self, frame, index, timestamp):
+        self.frame = frame
+        self.index = index
+        self.timestamp = timestamp
+        self.output = frame
+        self.detections = {}
+        self.timings = {}
+        self._gray = None
+        self._flipped = None
+
+    @property
+    def gray(self):
+        """Grayscale version of frame, converted on first use."""
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def flipped(self):
+        """Horizontally mirrored frame, computed on first use."""
+        if self._flipped is None:
+            self._flipped = cv2.flip(self.frame, 1)
+        return self._flipped
+
+
+class CaptureSource:
+    """Source stage reading frames through the threaded FrameCapture."""
+
+    name = "capture"
+
+    def __init__(self, source=0, **capture_options):
+        """
+        Args:
+            source: Device index, video file, image directory, glob or frame store
+            **capture_options: Passed to FrameCapture (policy, realtime,
+                record_to, capacity_mb, max_frames, overwrite, ...)
+        """
+        self.capture = FrameCapture(source, **capture_options)
+        self.index = 0
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def stats(self):
+        return self.capture.stats()
+
+    def fps(self):
+        """Nominal fps reported by the source, or None when unknown."""
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        return fps if fps and fps > 0 else None
+
+    def read(self):
+        """Return the next FrameContext, or None when the source is done."""
+        ret, frame = self.capture.read()
+        if not ret:
+            return None
+        ctx = FrameContext(frame, self.index, self.capture.timestamp)
+        self.index += 1
+        return ctx
+
+    def close(self):
+        self.capture.release()
+
+
+class Mirror:
+    """Preprocess stage: replace the frame by its mirror image for all later stages."""
+
+    name = "mirror"
+
+    def process(self, ctx):
+        ctx.frame = ctx.output = ctx.flipped
+        ctx._gray = None
+
+
+class DetectorStage:
+    """Run a box detector (optionally every N frames with tracking) on the shared grayscale frame."""
+
+    def __init__(self, name, detect, draw, detect_interval=1):
+        """
+        Args:
+            name: Key for the results in ctx.detections
+            detect: Callable(gray) -> list of (x, y, w, h)
+            draw: Callable(frame, boxes, ids) used by the Annotator
+            detect_interval: Run detect every N frames and track in between
+        """
+        self.name = name
+        self.draw = draw
+        self.tracker = TrackingDetector(detect, detect_interval)
+
+    def process(self, ctx):
+        ids, boxes = split_tracks(self.tracker.update(ctx.gray))
+        ctx.detections[self.name] = Detections(boxes, ids, self.draw)
+
+
+class FaceFeaturesStage(DetectorStage):
+    """Faces (tracked) plus eyes and smiles scheduled per face."""
+
+    def __init__(self, name, detect, draw, detect_interval=1, scheduler=None):
+        super().__init__(name, detect, draw, detect_interval)
+        self.scheduler = scheduler or detectors.SubDetectionScheduler()
+
+    def process(self, ctx):
+        gray = ctx.gray
+        ids, faces = split_tracks(self.tracker.update(gray))
+        results = [(face,) + parts for face, parts in zip(faces, self.scheduler.run(gray, faces, ids))]
+        ctx.detections[self.name] = Detections(results, ids, self.draw, nested=True)
+
+
+class MultiDetectorStage:
+    """Several box detectors sharing one detection pass per frame, each class tracked separately."""
+
+    name = "multi"
+
+    def __init__(self, detect, draws, detect_interval=1):
+        """
+        Args:
+            detect: Callable(gray) -> {class: list of (x, y, w, h)}, e.g. detectors.detect_multi
+            draws: Dict of class -> draw(frame, boxes, ids); results go to ctx.detections[class]
+            detect_interval: Run detect every N frames and track in between
+        """
+        self.detect = detect
+        self.draws = dict(draws)
+        self.trackers = {name: TrackingDetector(partial(self._detect_class, name), detect_interval)
+                         for name in self.draws}
+        self._results = None
+
+    def _detect_class(self, name, gray):
+        # One combined detection serves every tracker that needs it on this frame
+        if self._results is None:
+            self._results = self.detect(gray)
+        return self._results[name]
+
+    def process(self, ctx):
+        gray = ctx.gray
+        self._results = None
+        for name, tracker in self.trackers.items():
+            ids, boxes = split_tracks(tracker.update(gray))
+            ctx.detections[name] = Detections(boxes, ids, self.draws[name])
+
+
+class CloakStage:
+    """Invisibility cloak on the mirrored frame with an adaptive background."""
+
+    name = "cloak"
+
+    def __init__(self, color_settings, adapt_rate=0.05, method='average', quality='full'):
+        """
+        Args:
+            color_settings: Entry from CLOAK_COLORS (or a color name)
+            adapt_rate, method: BackgroundModel parameters
+            quality: Mask preset from cloak.MASK_QUALITY
+        """
+        if isinstance(color_settings, str):
+            color_settings = CLOAK_COLORS[color_settings]
+        if quality not in MASK_QUALITY:
+            raise ValueError(f"Unknown mask quality: {quality}")
+        self.color_settings = color_settings
+        self.adapt_rate = adapt_rate
+        self.method = method
+        self.quality = quality
+        self.compositor = None
+
+    def process(self, ctx):
+        frame = ctx.flipped
+        if self.compositor is None or self.compositor.shape[:2] != frame.shape[:2]:
+            model = BackgroundModel(frame.shape, rate=self.adapt_rate, method=self.method)
+            self.compositor = CloakCompositor(frame.shape, self.color_settings, flip=False,
+                                              background_model=model, quality=self.quality)
+        ctx.output = self.compositor.process(frame)
+
+    def stats(self):
+        """Mean milliseconds per compositing step (see CloakCompositor.stats)."""
+        return self.compositor.stats() if self.compositor else {'quality': self.quality, 'frames': 0, 'step_ms': {}}
+
+
+class EdgeStage:
+    """Canny edge map of the shared grayscale frame as the output."""
+
+    name = "canny"
+
+    def __init__(self, low=100, high=200):
+        self.low = low
+        self.high = high
+
+    def process(self, ctx):
+        ctx.output = cv2.Canny(ctx.gray, self.low, self.high)
+
+
+class Annotator:
+    """Draw every detection result onto the output frame."""
+
+    name = "annotate"
+
+    def process(self, ctx):
+        for result in ctx.detections.values():
+            if result.labels is None:
+                result.draw(ctx.output, result.results, result.ids)
+            else:
+                result.draw(ctx.output, result.results, result.ids, labels=result.labels)
+
+
+class WindowSink:
+    """Show frames in an OpenCV window; pressing 'q' stops the pipeline."""
+
+    name = "display"
+
+    def __init__(self, title):
+        self.title = title
+
+    def write(self, ctx):
+        cv2.imshow(self.title, ctx.output)
+        return not (cv2.waitKey(1) & 0xFF == ord('q'))
+
+    def close(self):
+        cv2.destroyAllWindows()
+
+
+class DisplaySink:
+    """
+    Rate-limited display path decoupled from processing.
+
+    write() only keeps a downsized copy of a frame when the next display tick
+    is due and returns immediately; a background thread JPEG-encodes the most
+    recent kept frame once (straight from BGR, no color conversion) and hands
+    the bytes to publish. Frames arriving while the encoder is busy replace
+    the pending one, so slow viewers never throttle processing.
+    """
+
+    name = "display"
+
+    def __init__(self, publish, width=960, fps=15.0, quality=80, thread_setup=None):
+        """
+        Args:
+            publish: Callable(jpeg_bytes) that delivers one encoded frame
+            width: Downsize wider frames to this width (None keeps full size)
+            fps: Maximum display rate (None or 0 displays every frame)
+            quality: JPEG quality 1-100
+            thread_setup: Optional callable(thread) run before the display
+                thread starts, e.g. Streamlit's add_script_run_ctx
+        """
+        self.publish = publish
+        self.width = width
+        self.interval = 1.0 / fps if fps else 0.0
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+        self.skipped = 0
+        self.dropped = 0
+        self.displayed = 0
+        self.bytes_sent = 0
+        self.encode_time = 0.0
+        self._next_due = 0.0
+        self._pending = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._display_loop, name="display", daemon=True)
+        if thread_setup is not None:
+            thread_setup(self._thread)
+        self._thread.start()
+
+    def write(self, ctx):
+        now = time.perf_counter()
+        if now < self._next_due:
+            self.skipped += 1
+            return True
+        self._next_due = now + self.interval
+
+        frame = ctx.output
+        height, width = frame.shape[:2]
+        if self.width and width > self.width:
+            # The resize doubles as the copy that frees ctx.output for reuse
+            frame = cv2.resize(frame, (self.width, round(height * self.width / width)),
+                               interpolation=cv2.INTER_AREA)
+        else:
+            frame = frame.copy()
+
+        with self._condition:
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = frame
+            self._condition.notify()
+        return not self._closed
+
+    def _display_loop(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                frame, self._pending = self._pending, None
+
+            start = time.perf_counter()
+            ok, jpeg = cv2.imencode('.jpg', frame, self.encode_params)
+            self.encode_time += time.perf_counter() - start
+            if not ok:
+                continue
+            data = jpeg.tobytes()
+            try:
+                self.publish(data)
+            except Exception:
+                logger.exception("Display publish failed; stopping display")
+                self._closed = True
+                return
+            self.displayed += 1
+            self.bytes_sent += len(data)
+
+    def stats(self):
+        """Return displayed/skipped/dropped counts, mean encode time and bytes per displayed frame."""
+        return {
+            'displayed': self.displayed,
+            'skipped': self.skipped,
+            'dropped': self.dropped,
+            'mean_encode_ms': 1000 * self.encode_time / self.displayed if self.displayed else 0.0,
+            'bytes_per_frame': self.bytes_sent / self.displayed if self.displayed else 0.0,
+        }
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=2)
+
+
+class CallbackSink:
+    """Call fn(ctx) for every frame; a False return value stops the pipeline."""
+
+    def __init__(self, fn, name="callback"):
+        self.fn = fn
+        self.name = name
+
+    def write(self, ctx):
+        return self.fn(ctx) is not False
+
+
+def detection_records(ctx):
+    """
+    Flatten ctx.detections into JSON-friendly dicts.
+
+    Returns:
+        List of {'class', 'id', 'box'} dicts (plus 'label' for labelled results);
+        face/eye/smile results add one record per eye and smile with the
+        face's id as 'parent'
+    """
+    records = []
+    for name, result in ctx.detections.items():
+        ids = result.ids or [None] * len(result.results)
+        for index, (track_id, item) in enumerate(zip(ids, result.results)):
+            if result.nested:
+                face, eyes, smiles = item
+                records.append({'class': 'face', 'id': track_id, 'box': [int(v) for v in face]})
+                records += [{'class': 'eye', 'id': None, 'parent': track_id, 'box': [int(v) for v in box]}
+                            for box in eyes]
+                records += [{'class': 'smile', 'id': None, 'parent': track_id, 'box': [int(v) for v in box]}
+                            for box in smiles]
+            else:
+                records.append({'class': name, 'id': track_id, 'box': [int(v) for v in item]})
+                if result.labels is not None:
+                    records[-1]['label'] = result.labels[index]
+    return records
+
+
+def detector_stage(mode, detect_interval=1, draw=None, scheduler=None, motion=None, **settings):
+    """
+    Build the stage for a detection mode with the app's default parameters.
+
+    Args:
+        mode: 'face', 'face_eye_smile' or 'plate'
+        detect_interval: Run the cascade every N frames and track in between
+        draw: Optional custom draw(frame, results, ids); defaults to detectors'
+        scheduler: SubDetectionScheduler for 'face_eye_smile'
+        motion: Optional MotionGate arguments (threshold, refresh_frames,
+            regions, ...); the detector then skips static frames and searches
+            only changed regions. The gate is available as stage.tracker.detect
+        **settings: Detection parameters (scale_factor, min_neighbors,
+            detect_width, min_size, max_size)
+    """
+    if mode == 'face_eye_smile':
+        settings.setdefault('scale_factor', 1.3)
+        settings.setdefault('min_neighbors', 5)
+    if mode in ('face', 'face_eye_smile'):
+        detect = partial(detectors.detect_faces, **settings)
+    elif mode == 'plate':
+        detect = partial(detectors.detect_plates, **settings)
+    else:
+        raise ValueError(f"Unknown detection mode: {mode}")
+    if motion is not None:
+        detect = MotionGate(detect, **motion)
+
+    if mode == 'face':
+        return DetectorStage(mode, detect, draw or detectors.draw_faces, detect_interval)
+    if mode == 'plate':
+        return DetectorStage(mode, detect, draw or detectors.draw_plates, detect_interval)
+    return FaceFeaturesStage(mode, detect, draw or detectors.draw_face_features, detect_interval, scheduler)
+
+
+def multi_detector_stage(modes, detect_interval=1, draws=None, **settings):
+    """
+    Build one stage that runs the cascades of several box modes over a shared image pyramid.
+
+    Args:
+        modes: Box modes ('face', 'plate')
+        detect_interval: Run the cascades every N frames and track in between
+        draws: Optional dict of mode -> draw(frame, boxes, ids)
+        **settings: detectors.detect_multi parameters (scale_factor,
+            min_neighbors as a value or per-mode dict, detect_width, min_size, max_size)
+    """
+    default_draws = {'face': detectors.draw_faces, 'plate': detectors.draw_plates}
+    for mode in modes:
+        if mode not in default_draws:
+            raise ValueError(f"Mode cannot share a pyramid: {mode}")
+    settings.setdefault('min_neighbors', {'face': 4, 'plate': 10})
+    draws = {mode: (draws or {}).get(mode, default_draws[mode]) for mode in modes}
+    return MultiDetectorStage(partial(detectors.detect_multi, models=list(modes), **settings), draws, detect_interval)
+
+
+class Pipeline:
+    """Run a source through stages and into sinks, timing every stage."""
+
+    def __init__(self, source, stages, sinks=(), metrics=None):
+        """
+        Args:
+            source: Object with read() -> FrameContext or None, and close()
+            stages: Objects with process(ctx), run in order
+            sinks: Objects with write(ctx) -> bool (False stops the pipeline)
+            metrics: Optional observer with observe(ctx, pipeline), e.g.
+                metrics.PipelineMetrics; None adds no per-frame cost
+        """
+        self.source = source
+        self.stages = list(stages)
+        self.sinks = list(sinks)
+        self.metrics = metrics
+        self.frames = 0
+        self.stage_time = {}
+
+    def _timed(self, ctx, name, fn):
+        start = time.perf_counter()
+        result = fn(ctx)
+        elapsed = time.perf_counter() - start
+        ctx.timings[name] = ctx.timings.get(name, 0.0) + elapsed
+        self.stage_time[name] = self.stage_time.get(name, 0.0) + elapsed
+        return result
+
+    def step(self):
+        """
+        Process one frame.
+
+        Returns:
+            The FrameContext, None when the source is exhausted, or False when
+            a sink asked to stop
+        """
+        start = time.perf_counter()
+        ctx = self.source.read()
+        if ctx is None:
+            return None
+        capture_time = time.perf_counter() - start
+        ctx.timings[self.source.name] = capture_time
+        self.stage_time[self.source.name] = self.stage_time.get(self.source.name, 0.0) + capture_time
+
+        for stage in self.stages:
+            self._timed(ctx, getattr(stage, 'name', type(stage).__name__), stage.process)
+        keep_going = True
+        for sink in self.sinks:
+            keep_going &= self._timed(ctx, sink.name, sink.write)
+        self.frames += 1
+        if self.metrics is not None:
+            self.metrics.observe(ctx, self)
+        return ctx if keep_going else False
+
+    def run(self, should_stop=None):
+        """
+        Process frames until the source ends, a sink stops, or should_stop() is true.
+
+        Returns:
+            False if the source ran out of frames, True otherwise
+        """
+        while should_stop is None or not should_stop():
+            ctx = self.step()
+            if ctx is None:
+                return False
+            if ctx is False:
+                break
+        return True
+
+    def stats(self):
+        """Return frames processed and mean milliseconds per frame for each stage."""
+        return {
+            'frames': self.frames,
+            'stage_ms': {name: 1000 * total / self.frames for name, total in self.stage_time.items()}
+            if self.frames else {},
+        }
+
+    def close(self):
+        """Release the source and close sinks that hold resources."""
+        self.source.close()
+        for sink in self.sinks:
+            if hasattr(sink, 'close'):
+                sink.close()
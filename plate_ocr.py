@@ -0,0 +1,211 @@
+"""
+Plate OCR - Deduplicated number plate recognition
+
+Purpose: The same plate is detected on dozens of consecutive frames, and OCR is
+far too slow to run on every detection. Each plate crop is normalized (fixed
+size, equalized contrast) and reduced to a 64-bit perceptual hash (dHash);
+only crops whose hash is not within a few bits of a cached one reach the
+recognizer. Results live in a bounded LRU cache keyed by hash.
+
+Recognizers are plain callables crop -> text. StubRecognizer is deterministic
+and needs nothing installed (for tests); TesseractRecognizer uses the optional
+pytesseract package.
+
+Example:
+    stage = PlateRecognitionStage(default_recognizer() or StubRecognizer())
+    Pipeline(source, [detector_stage('plate'), stage, Annotator()], sinks)
+"""
+
+import logging
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from detectors import PLATE_COLOR
+
+logger = logging.getLogger(__name__)
+
+CROP_SIZE = (160, 40)  # Normalized plate crop (width, height)
+HASH_SIZE = (9, 8)     # dHash input: 8 rows of 8 horizontal gradients = 64 bits
+
+
+def normalize_crop(gray, box, size=CROP_SIZE):
+    """
+    Cut a plate out of a grayscale frame at a fixed size with equalized contrast.
+
+    Returns:
+        uint8 image of shape (size[1], size[0]), or None if the box is empty
+    """
+    x, y, w, h = box
+    x0, y0 = max(0, x), max(0, y)
+    crop = gray[y0:y + h, x0:x + w]
+    if crop.size == 0:
+        return None
+    crop = cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+    return cv2.equalizeHist(crop)
+
+
+def perceptual_hash(crop):
+    """64-bit difference hash: sign of horizontal gradients on a 9x8 thumbnail."""
+    thumb = cv2.resize(crop, HASH_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class LRUCache:
+    """Bounded hash -> value cache with hit/miss statistics and near-duplicate lookup."""
+
+    def __init__(self, maxsize=256, max_distance=6):
+        """
+        Args:
+            maxsize: Entries kept; the least recently used is evicted
+            max_distance: Hashes within this many differing bits count as the same plate
+        """
+        self.maxsize = maxsize
+        self.max_distance = max_distance
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the value for key or a near-identical key, or None on a miss."""
+        value = self._entries.get(key)
+        if value is None and self.max_distance:
+            for other, other_value in self._entries.items():
+                if hamming(key, other) <= self.max_distance:
+                    key, value = other, other_value
+                    break
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class StubRecognizer:
+    """Deterministic stand-in recognizer: the text is derived from the crop's hash."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, crop):
+        self.calls += 1
+        return f"PLATE-{perceptual_hash(crop) & 0xFFFF:04X}"
+
+
+class TesseractRecognizer:
+    """OCR through pytesseract (optional dependency: pip install pytesseract, plus the tesseract binary)."""
+
+    def __init__(self, config="--psm 7 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"):
+        try:
+            import pytesseract
+        except ImportError as e:
+            raise ImportError("TesseractRecognizer needs pytesseract: pip install pytesseract") from e
+        self._pytesseract = pytesseract
+        self.config = config
+        self.calls = 0
+
+    def __call__(self, crop):
+        self.calls += 1
+        # Tesseract prefers dark text on white with some margin
+        _, binary = cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        binary = cv2.copyMakeBorder(binary, 10, 10, 10, 10, cv2.BORDER_CONSTANT, value=255)
+        text = self._pytesseract.image_to_string(binary, config=self.config)
+        return "".join(ch for ch in text if ch.isalnum()).upper()
+
+
+def default_recognizer():
+    """Return a TesseractRecognizer if pytesseract and tesseract are available, else None."""
+    try:
+        recognizer = TesseractRecognizer()
+        recognizer._pytesseract.get_tesseract_version()
+    except Exception as e:
+        logger.info("Plate OCR disabled: %s", e)
+        return None
+    return recognizer
+
+
+def draw_plate_text(draw):
+    """Wrap a plate draw function so recognized text is written under each box."""
+    def draw_with_text(frame, plates, ids=None, labels=None):
+        draw(frame, plates, ids)
+        for (x, y, w, h), text in zip(plates, labels or ()):
+            if text:
+                cv2.putText(frame, text, (x, y + h + 28), cv2.FONT_HERSHEY_SIMPLEX, 0.9, PLATE_COLOR, 2)
+        return frame
+    return draw_with_text
+
+
+class PlateRecognitionStage:
+    """
+    Pipeline stage that reads plate text for detections, recognizing each distinct plate once.
+
+    Texts are attached to the plate detections as labels (shown by the
+    Annotator and included in detection records).
+    """
+
+    name = "ocr"
+
+    def __init__(self, recognizer, cache_size=256, max_distance=6, detections='plate'):
+        """
+        Args:
+            recognizer: Callable(normalized uint8 crop) -> text
+            cache_size: LRU entries
+            max_distance: Hash bit distance treated as the same plate
+            detections: Key of the plate results in ctx.detections
+        """
+        self.recognizer = recognizer
+        self.cache = LRUCache(cache_size, max_distance)
+        self.detections = detections
+        self.recognized = 0
+
+    def read(self, gray, box):
+        """Return the text for one plate box, from the cache when possible."""
+        crop = normalize_crop(gray, box)
+        if crop is None:
+            return None
+        key = perceptual_hash(crop)
+        text = self.cache.get(key)
+        if text is None:
+            text = self.recognizer(crop)
+            self.recognized += 1
+            self.cache.put(key, text)
+        return text
+
+    def process(self, ctx):
+        result = ctx.detections.get(self.detections)
+        if result is None or not result.results:
+            return
+        labels = [self.read(ctx.gray, box) for box in result.results]
+        ctx.detections[self.detections] = result._replace(labels=labels, draw=draw_plate_text(result.draw))
+
+    def stats(self):
+        return dict(self.cache.stats(), recognized=self.recognized)
@@ -0,0 +1,158 @@
+"""
+Recording - Background video encoding for any pipeline
+
+Purpose: Keep video encoding off the frame loop. RecordingSink copies each
+output frame into a bounded queue and a writer thread encodes it, so a slow
+codec costs queue depth (and, when the queue is full, dropped frames) instead
+of frame rate. The video size comes from the frames themselves and the fps
+from the source, and long recordings can be split into fixed-length segments.
+
+Example:
+    source = CaptureSource('clip.mp4')
+    sink = RecordingSink('out.avi', fps=source.fps(), segment_seconds=600)
+    Pipeline(source, stages, [sink]).run()
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FPS = 20.0
+_STOP = object()
+
+
+class RecordingSink:
+    """Pipeline sink that encodes frames on a background thread."""
+
+    name = "record"
+
+    def __init__(self, path, fps=None, fourcc='XVID', queue_size=64, segment_seconds=None, probe_frames=15):
+        """
+        Args:
+            path: Output file; with segments, '-0001' etc. is added before the extension
+            fps: Recording fps, normally the source's; None or 0 estimates it
+                from the timestamps of the first probe_frames frames
+            fourcc: Four-character codec code
+            queue_size: Frames that may wait for the encoder before new ones are dropped
+            segment_seconds: Start a new file every this many seconds of video
+            probe_frames: Frames used to estimate fps when it is unknown
+        """
+        if segment_seconds is not None and segment_seconds <= 0:
+            raise ValueError("segment_seconds must be positive")
+        self.path = path
+        self.fps = fps if fps and fps > 0 else None
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.segment_seconds = segment_seconds
+        self.probe_frames = probe_frames
+        self.size = None
+        self.is_color = True
+        self.written = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.files = []
+        self._queue = queue.Queue(queue_size)
+        self._writer = None
+        self._segment_frames = 0
+        self._thread = threading.Thread(target=self._encode_loop, name="recorder", daemon=True)
+        self._thread.start()
+
+    def write(self, ctx):
+        frame = ctx.output
+        if self.size is None:
+            self.size = (frame.shape[1], frame.shape[0])
+            self.is_color = frame.ndim == 3
+        try:
+            # Copy: ctx.output is often a buffer the next frame overwrites
+            self._queue.put_nowait((frame.copy(), ctx.timestamp))
+        except queue.Full:
+            self.dropped += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def _segment_path(self):
+        if self.segment_seconds is None:
+            return self.path
+        base, ext = os.path.splitext(self.path)
+        return f"{base}-{len(self.files) + 1:04d}{ext or '.avi'}"
+
+    def _open_segment(self):
+        if self._writer is not None:
+            self._writer.release()
+        path = self._segment_path()
+        self._writer = cv2.VideoWriter(path, self.fourcc, self.fps, self.size, self.is_color)
+        if not self._writer.isOpened():
+            raise OSError(f"Cannot open video writer for {path}")
+        self.files.append(path)
+        self._segment_frames = 0
+        logger.info("Recording %s (%dx%d @ %.1f fps)", path, self.size[0], self.size[1], self.fps)
+
+    def _encode(self, frame):
+        if self._writer is None or (
+            self.segment_seconds is not None and self._segment_frames >= round(self.fps * self.segment_seconds)
+        ):
+            self._open_segment()
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size)
+        self._writer.write(frame)
+        self._segment_frames += 1
+        self.written += 1
+
+    def _encode_loop(self):
+        probe = []
+        stopped = False
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _STOP:
+                    stopped = True
+                    break
+                if self.fps is None:
+                    probe.append(item)
+                    if len(probe) < self.probe_frames:
+                        continue
+                    self._estimate_fps(probe)
+                    for frame, _ in probe:
+                        self._encode(frame)
+                    probe = []
+                    continue
+                self._encode(item[0])
+            if probe:
+                self._estimate_fps(probe)
+                for frame, _ in probe:
+                    self._encode(frame)
+        except Exception:
+            logger.exception("Recording to %s failed", self.path)
+            # Keep draining so write() never blocks on a dead encoder
+            while not stopped:
+                stopped = self._queue.get() is _STOP
+        finally:
+            if self._writer is not None:
+                self._writer.release()
+
+    def _estimate_fps(self, probe):
+        span = probe[-1][1] - probe[0][1]
+        # Whole numbers: codecs such as MPEG-4 reject fine-grained timebases
+        self.fps = float(min(120, max(1, round((len(probe) - 1) / span)))) if span > 0 else DEFAULT_FPS
+
+    def stats(self):
+        """Return queue depth (current and max), frames written and dropped, and files written."""
+        return {
+            'queue_depth': self._queue.qsize(),
+            'max_queue_depth': self.max_depth,
+            'written': self.written,
+            'dropped': self.dropped,
+            'files': list(self.files),
+        }
+
+    def close(self, timeout=None):
+        """Finish encoding the queued frames and close the file."""
+        start = time.perf_counter()
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        logger.info("Recorder closed after %.1f s drain: %s", time.perf_counter() - start, self.stats())
@@ -0,0 +1,502 @@
+"""
+Stream Server - Capture and process each source once, fan out to many viewers
+
+Purpose: Instead of every viewer opening its own camera and repeating the
+detection work, one pipeline per source runs on a worker thread and an asyncio
+server fans its results out to any number of clients:
+
+    GET /                   index of the streams
+    GET /stream/<n>.mjpg    annotated frames as MJPEG (multipart/x-mixed-replace)
+    GET /ws/<n>             detection JSON per frame over WebSocket
+    GET /stats              server, stream and per-client counters as JSON
+
+Each client only ever holds the newest frame; a slow client skips frames
+(counted as dropped) while fast clients and the processing thread carry on.
+Frames are JPEG-encoded and JSON-serialised once per frame, and only while
+somebody is watching. Standard library only (asyncio + a minimal RFC 6455
+WebSocket writer).
+
+Usage:
+    python stream_server.py --mode face --port 8080 0
+    python stream_server.py --mode plate clip.mp4 --simulate-clients 50
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import struct
+import threading
+import time
+
+import cv2
+
+import pipeline
+from cloak import CLOAK_COLORS
+from frame_capture import parse_source
+from thread_budget import configure
+
+logger = logging.getLogger(__name__)
+
+SERVER_MODES = ('face', 'face_eye_smile', 'plate', 'cloak')
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+BOUNDARY = "frame"
+
+
+class _Client:
+    """Latest-frame mailbox for one connected viewer."""
+
+    def __init__(self, kind, address):
+        self.kind = kind
+        self.address = address
+        self.connected = time.time()
+        self.sent = 0
+        self.dropped = 0
+        self._latest = None
+        self._event = asyncio.Event()
+        self.closed = False
+
+    def offer(self, item):
+        if self._latest is not None:
+            self.dropped += 1
+        self._latest = item
+        self._event.set()
+
+    def close(self):
+        self.closed = True
+        self._event.set()
+
+    async def next(self):
+        """Wait for the newest item; None once the stream has ended."""
+        await self._event.wait()
+        self._event.clear()
+        item, self._latest = self._latest, None
+        return item
+
+    def stats(self):
+        return {'kind': self.kind, 'address': self.address, 'sent': self.sent, 'dropped': self.dropped,
+                'seconds': time.time() - self.connected}
+
+
+class _Hub:
+    """One source, one pipeline thread, any number of clients."""
+
+    def __init__(self, stream_id, source, mode, loop, width=960, quality=80, color='Red', detect_width=640,
+                 detect_interval=5, loop_file=False):
+        self.stream_id = stream_id
+        self.source = source
+        self.mode = mode
+        self.loop = loop
+        self.width = width
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+        self.color = color
+        self.detect_width = detect_width
+        self.detect_interval = detect_interval
+        self.loop_file = loop_file
+        self.mjpeg_clients = set()
+        self.ws_clients = set()
+        self.frames = 0
+        self.encoded = 0
+        self.finished = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"hub-{stream_id}", daemon=True)
+
+    def _stages(self):
+        if self.mode == 'cloak':
+            return [pipeline.CloakStage(self.color)]
+        return [pipeline.detector_stage(self.mode, self.detect_interval, detect_width=self.detect_width),
+                pipeline.Annotator()]
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        is_device = isinstance(parse_source(self.source), int)
+        try:
+            while not self._stop.is_set():
+                runner = pipeline.Pipeline(pipeline.CaptureSource(self.source, realtime=not is_device),
+                                           self._stages(), [pipeline.CallbackSink(self._publish, name="fanout")])
+                try:
+                    runner.run(should_stop=self._stop.is_set)
+                finally:
+                    runner.close()
+                if is_device or not self.loop_file:
+                    break
+        except Exception:
+            logger.exception("Stream %d (%s) failed", self.stream_id, self.source)
+        finally:
+            self.loop.call_soon_threadsafe(self._finish)
+
+    def _publish(self, ctx):
+        """Pipeline sink (worker thread): encode once for all clients, hand over to the loop."""
+        self.frames += 1
+        jpeg = message = None
+        if self.mjpeg_clients:
+            frame = ctx.output
+            height, width = frame.shape[:2]
+            if self.width and width > self.width:
+                frame = cv2.resize(frame, (self.width, round(height * self.width / width)),
+                                   interpolation=cv2.INTER_AREA)
+            ok, encoded = cv2.imencode('.jpg', frame, self.encode_params)
+            if ok:
+                jpeg = encoded.tobytes()
+                self.encoded += 1
+        if self.ws_clients:
+            message = json.dumps({
+                'stream': self.stream_id,
+                'frame': ctx.index,
+                'timestamp': ctx.timestamp,
+                'mode': self.mode,
+                'detections': pipeline.detection_records(ctx),
+            })
+        if jpeg is not None or message is not None:
+            self.loop.call_soon_threadsafe(self._fan_out, jpeg, message)
+
+    def _fan_out(self, jpeg, message):
+        if jpeg is not None:
+            for client in self.mjpeg_clients:
+                client.offer(jpeg)
+        if message is not None:
+            for client in self.ws_clients:
+                client.offer(message)
+
+    def _finish(self):
+        self.finished = True
+        for client in self.mjpeg_clients | self.ws_clients:
+            client.close()
+
+    def stats(self):
+        return {
+            'source': str(self.source),
+            'mode': self.mode,
+            'frames': self.frames,
+            'encoded': self.encoded,
+            'finished': self.finished,
+            'clients': [c.stats() for c in self.mjpeg_clients | self.ws_clients],
+        }
+
+
+def _ws_frame(payload, opcode=0x1):
+    """Encode one unmasked server-to-client WebSocket frame."""
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 1 << 16:
+        header += bytes([126]) + struct.pack("!H", length)
+    else:
+        header += bytes([127]) + struct.pack("!Q", length)
+    return header + payload
+
+
+async def _ws_read_frame(reader):
+    """Read one (masked) client frame; returns (opcode, payload)."""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    mask = await reader.readexactly(4) if second & 0x80 else b""
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return first & 0x0F, payload
+
+
+class StreamServer:
+    """
+    Asyncio HTTP/WebSocket fan-out server over one pipeline per source.
+
+    Example:
+        server = StreamServer(['clip.mp4'], mode='face')
+        asyncio.run(server.serve_forever())
+    """
+
+    def __init__(self, sources, mode='face', host='127.0.0.1', port=8080, width=960, quality=80,
+                 color='Red', detect_width=640, detect_interval=5, loop_file=False):
+        """
+        Args:
+            sources: Device indices, video files, image directories or globs
+            mode: One of SERVER_MODES
+            host, port: Address to listen on (port 0 picks a free one)
+            width: Downsize MJPEG frames wider than this
+            quality: MJPEG JPEG quality 1-100
+            color: Cloak color name (cloak mode)
+            detect_width, detect_interval: Detection settings (detection modes)
+            loop_file: Restart file sources when they end
+        """
+        if mode not in SERVER_MODES:
+            raise ValueError(f"Unknown mode: {mode}. Choose from {', '.join(SERVER_MODES)}")
+        if color not in CLOAK_COLORS:
+            raise ValueError(f"Unknown cloak color: {color}")
+        if not sources:
+            raise ValueError("At least one source is required")
+        self.sources = list(sources)
+        self.mode = mode
+        self.host = host
+        self.port = port
+        self.hub_options = dict(width=width, quality=quality, color=color, detect_width=detect_width,
+                                detect_interval=detect_interval, loop_file=loop_file)
+        self.hubs = []
+        self._server = None
+
+    async def start(self):
+        """Start the pipelines and begin listening; returns the bound port."""
+        loop = asyncio.get_running_loop()
+        self.hubs = [_Hub(i, source, self.mode, loop, **self.hub_options) for i, source in enumerate(self.sources)]
+        for hub in self.hubs:
+            hub.start()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Serving %d stream(s) on http://%s:%d/", len(self.hubs), self.host, self.port)
+        return self.port
+
+    async def stop(self):
+        for hub in self.hubs:
+            hub.stop()
+            hub._finish()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await asyncio.sleep(0.1)  # Let client handlers see the close and finish
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    def stats(self):
+        return {'mode': self.mode, 'streams': [hub.stats() for hub in self.hubs]}
+
+    def _hub(self, path, prefix, suffix=""):
+        name = path[len(prefix):]
+        if suffix:
+            if not name.endswith(suffix):
+                return None
+            name = name[:-len(suffix)]
+        if not name.isdigit() or int(name) >= len(self.hubs):
+            return None
+        return self.hubs[int(name)]
+
+    async def _handle(self, reader, writer):
+        address = "%s:%s" % writer.get_extra_info('peername')[:2]
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            request_line, *header_lines = head.decode('latin-1').split("\r\n")
+            method, path, _ = request_line.split(" ", 2)
+            headers = {k.strip().lower(): v.strip() for k, v in
+                       (line.split(":", 1) for line in header_lines if ":" in line)}
+            path = path.split("?", 1)[0]
+
+            if method != "GET":
+                await self._respond(writer, 405, "text/plain", b"Method not allowed")
+            elif path == "/":
+                await self._respond(writer, 200, "text/html", self._index().encode())
+            elif path == "/stats":
+                await self._respond(writer, 200, "application/json", json.dumps(self.stats()).encode())
+            elif path.startswith("/stream/") and self._hub(path, "/stream/", ".mjpg"):
+                await self._serve_mjpeg(self._hub(path, "/stream/", ".mjpg"), writer, address)
+            elif path.startswith("/ws/") and self._hub(path, "/ws/"):
+                await self._serve_websocket(self._hub(path, "/ws/"), reader, writer, headers, address)
+            else:
+                await self._respond(writer, 404, "text/plain", b"Not found")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, content_type, body):
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}[status]
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    def _index(self):
+        items = "".join(
+            f"<li>{hub.source}: <a href='/stream/{hub.stream_id}.mjpg'>MJPEG</a> | ws://{self.host}:{self.port}"
+            f"/ws/{hub.stream_id}</li>" for hub in self.hubs
+        )
+        return f"<html><body><h1>AI Vision Hub streams ({self.mode})</h1><ul>{items}</ul></body></html>"
+
+    async def _serve_mjpeg(self, hub, writer, address):
+        client = _Client('mjpeg', address)
+        hub.mjpeg_clients.add(client)
+        if hub.finished:
+            client.close()
+        try:
+            writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary={BOUNDARY}\r\n"
+                         "Cache-Control: no-cache\r\nConnection: close\r\n\r\n".encode())
+            while not client.closed:
+                jpeg = await client.next()
+                if jpeg is None:
+                    continue
+                writer.write(f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n"
+                             .encode() + jpeg + b"\r\n")
+                # Only this client's task waits here; newer frames replace older ones meanwhile
+                await writer.drain()
+                client.sent += 1
+        finally:
+            hub.mjpeg_clients.discard(client)
+
+    async def _serve_websocket(self, hub, reader, writer, headers, address):
+        key = headers.get('sec-websocket-key')
+        if headers.get('upgrade', '').lower() != 'websocket' or not key:
+            await self._respond(writer, 400, "text/plain", b"WebSocket upgrade required")
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        writer.write("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                     f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode())
+        await writer.drain()
+
+        client = _Client('websocket', address)
+        hub.ws_clients.add(client)
+        if hub.finished:
+            client.close()
+
+        async def read_loop():
+            # Answer pings and notice the client closing; client messages are ignored
+            while True:
+                opcode, payload = await _ws_read_frame(reader)
+                if opcode == 0x8:
+                    client.close()
+                    return
+                if opcode == 0x9:
+                    writer.write(_ws_frame(payload, 0xA))
+
+        reading = asyncio.create_task(read_loop())
+        try:
+            while not client.closed and not reading.done():
+                message = await client.next()
+                if message is None:
+                    continue
+                writer.write(_ws_frame(message.encode()))
+                await writer.drain()
+                client.sent += 1
+            writer.write(_ws_frame(struct.pack("!H", 1000), 0x8))
+            await writer.drain()
+        finally:
+            reading.cancel()
+            hub.ws_clients.discard(client)
+
+
+async def simulate_clients(host, port, stream_id=0, mjpeg=10, websocket=10, slow=0.2, duration=10.0):
+    """
+    Connect simulated viewers and count what each receives.
+
+    Args:
+        mjpeg, websocket: Number of clients of each kind
+        slow: Fraction of clients that read slowly (one frame per 0.5 s)
+        duration: Seconds to stay connected
+
+    Returns:
+        List of {'kind', 'slow', 'frames'} per client
+    """
+    async def mjpeg_client(is_slow):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f"GET /stream/{stream_id}.mjpg HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+        frames = 0
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            while True:
+                part = await reader.readuntil(b"\r\n\r\n")
+                length = int(part.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+                await reader.readexactly(length + 2)
+                frames += 1
+                if is_slow:
+                    await asyncio.sleep(0.5)
+        except (asyncio.IncompleteReadError, ConnectionError, IndexError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+        return {'kind': 'mjpeg', 'slow': is_slow, 'frames': frames}
+
+    async def websocket_client(is_slow):
+        reader, writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(b"simulated-client!").decode()
+        writer.write(f"GET /ws/{stream_id} HTTP/1.1\r\nHost: {host}\r\nUpgrade: websocket\r\n"
+                     f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+                     .encode())
+        frames = 0
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            while True:
+                opcode, payload = await _ws_read_frame(reader)
+                if opcode == 0x8:
+                    break
+                json.loads(payload)
+                frames += 1
+                if is_slow:
+                    await asyncio.sleep(0.5)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+        return {'kind': 'websocket', 'slow': is_slow, 'frames': frames}
+
+    tasks = []
+    for kind, count, factory in (('mjpeg', mjpeg, mjpeg_client), ('websocket', websocket, websocket_client)):
+        n_slow = round(count * slow)
+        tasks += [asyncio.create_task(factory(i < n_slow)) for i in range(count)]
+    done, pending = await asyncio.wait(tasks, timeout=duration)
+    for task in pending:
+        task.cancel()
+    return await asyncio.gather(*tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve processed streams to many viewers (MJPEG + WebSocket).")
+    parser.add_argument('sources', nargs='+', help="Device indices, video files, image directories or globs")
+    parser.add_argument('--mode', choices=SERVER_MODES, default='face')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--width', type=int, default=960, help="Downsize MJPEG frames wider than this")
+    parser.add_argument('--quality', type=int, default=80, help="MJPEG JPEG quality")
+    parser.add_argument('--color', choices=list(CLOAK_COLORS), default='Red', help="Cloak color for --mode cloak")
+    parser.add_argument('--detect-width', type=int, default=640)
+    parser.add_argument('--detect-interval', type=int, default=5)
+    parser.add_argument('--loop', action='store_true', help="Restart file sources when they end")
+    parser.add_argument('--simulate-clients', type=int, default=0, metavar='N',
+                        help="Connect N simulated MJPEG and N WebSocket clients to stream 0, print results, exit")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds for --simulate-clients")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # One processing thread per source shares the CPUs with OpenCV's own threads
+    configure('cloak' if args.mode == 'cloak' else 'detect', workers=len(args.sources))
+
+    server = StreamServer(args.sources, mode=args.mode, host=args.host, port=args.port, width=args.width,
+                          quality=args.quality, color=args.color, detect_width=args.detect_width,
+                          detect_interval=args.detect_interval, loop_file=args.loop)
+
+    async def simulate():
+        port = await server.start()
+        try:
+            results = await simulate_clients(args.host, port, mjpeg=args.simulate_clients,
+                                             websocket=args.simulate_clients, duration=args.duration)
+        finally:
+            stats = server.stats()
+            await server.stop()
+        for kind in ('mjpeg', 'websocket'):
+            for is_slow in (False, True):
+                frames = [r['frames'] for r in results if r['kind'] == kind and r['slow'] == is_slow]
+                if frames:
+                    print(f"{kind:>9} {'slow' if is_slow else 'fast'}: {len(frames)} clients, "
+                          f"frames min {min(frames)} / max {max(frames)}")
+        for stream in stats['streams']:
+            print(f"{stream['source']}: processed {stream['frames']} frames, encoded {stream['encoded']} JPEGs")
+
+    try:
+        asyncio.run(simulate() if args.simulate_clients else server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import cv2
+import numpy as np
+import pytest
+
+import color_lut
+from cloak import CLOAK_COLORS
+from color_lut import ColorLUT
+
+
+@pytest.fixture(scope="module", autouse=True)
+def table_cache(tmp_path_factory):
+    """Build the tables into a temporary cache instead of the user's."""
+    saved = color_lut.CACHE_DIR, dict(color_lut._tables)
+    color_lut.CACHE_DIR = str(tmp_path_factory.mktemp("lut_cache"))
+    color_lut._tables.clear()
+    yield
+    color_lut.CACHE_DIR = saved[0]
+    color_lut._tables.clear()
+    color_lut._tables.update(saved[1])
+
+
+@pytest.fixture(scope="module")
+def frame():
+    return np.random.default_rng(0).integers(0, 256, (240, 320, 3), dtype=np.uint8)
+
+
+def _hsv_mask(frame, color_settings):
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, color_settings['lower1'], color_settings['upper1'])
+    if color_settings['has_two_ranges']:
+        mask = cv2.bitwise_or(mask, cv2.inRange(hsv, color_settings['lower2'], color_settings['upper2']))
+    return mask
+
+
+@pytest.mark.parametrize("name", list(CLOAK_COLORS))
+def test_mask_matches_hsv_in_range(frame, name):
+    expected = _hsv_mask(frame, CLOAK_COLORS[name])
+
+    mask = ColorLUT(frame.shape).mask(frame, CLOAK_COLORS[name])
+
+    assert np.count_nonzero(expected) > 0
+    np.testing.assert_array_equal(mask, expected)
+
+
+def test_red_covers_both_hue_ranges(frame):
+    hue = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)[..., 0]
+    mask = ColorLUT(frame.shape).mask(frame, CLOAK_COLORS['Red'])
+
+    # The wrap-around range (hue 170-180) must come through the table too
+    assert np.count_nonzero(mask[hue <= 10]) > 0
+    assert np.count_nonzero(mask[hue >= 170]) > 0
+
+
+def test_labels_match_each_color_mask(frame):
+    labels = ColorLUT(frame.shape).labels(frame).copy()
+
+    for bit, color_settings in enumerate(CLOAK_COLORS.values()):
+        expected = _hsv_mask(frame, color_settings) > 0
+        np.testing.assert_array_equal((labels >> bit) & 1 == 1, expected)
@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+
+from pipeline import Detections, FrameContext
+from plate_ocr import LRUCache, PlateRecognitionStage, StubRecognizer
+
+
+def _scene(plates, rng, noise=0):
+    """Grayscale frame with each (x, y, texture) plate pasted in; optional sensor noise."""
+    gray = np.full((240, 320), 90, np.uint8)
+    for x, y, texture in plates:
+        gray[y:y + texture.shape[0], x:x + texture.shape[1]] = texture
+    if noise:
+        gray = cv2.add(gray, rng.integers(0, noise, gray.shape, dtype=np.uint8))
+    return gray
+
+
+def _plate(rng):
+    coarse = rng.integers(0, 256, (4, 12), dtype=np.uint8)
+    return cv2.resize(coarse, (120, 30), interpolation=cv2.INTER_NEAREST)
+
+
+def test_cache_matches_near_duplicate_hashes():
+    cache = LRUCache(maxsize=4, max_distance=6)
+    key = 0x0123456789ABCDEF
+    cache.put(key, "AB123")
+
+    assert cache.get(key) == "AB123"
+    assert cache.get(key ^ 0b101001) == "AB123"        # 3 bits differ
+    assert cache.get(key ^ 0b1111111111) is None        # 10 bits differ
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 1
+
+
+def test_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, max_distance=0)
+    cache.put(1, "a")
+    cache.put(2, "b")
+    cache.get(1)
+    cache.put(4, "c")
+
+    assert cache.get(2) is None
+    assert cache.get(1) == "a"
+    assert len(cache) == 2
+    assert cache.stats()['evictions'] == 1
+
+
+def test_stage_recognizes_each_plate_once():
+    rng = np.random.default_rng(0)
+    first, second = _plate(rng), _plate(rng)
+    recognizer = StubRecognizer()
+    stage = PlateRecognitionStage(recognizer)
+
+    labels = []
+    for index in range(10):
+        # Both plates stay put while the frame gets fresh sensor noise
+        gray = _scene([(20, 40, first), (160, 150, second)], rng, noise=6)
+        ctx = FrameContext(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), index, index / 30)
+        ctx.detections['plate'] = Detections([(20, 40, 120, 30), (160, 150, 120, 30)], [1, 2], None)
+        stage.process(ctx)
+        labels.append(ctx.detections['plate'].labels)
+
+    assert recognizer.calls == 2
+    assert all(frame_labels == labels[0] for frame_labels in labels)
+    assert labels[0][0] != labels[0][1]
+    assert stage.stats()['hits'] == 18
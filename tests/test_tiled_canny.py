@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+import pytest
+
+from tiled_canny import TiledCanny
+
+# Thresholds scale with the Sobel aperture's gradient magnitudes
+THRESHOLDS = {3: (50, 150), 5: (400, 1200), 7: (4000, 12000)}
+
+
+def _image(height=203, width=157, seed=0):
+    """Smooth random texture with sharp-edged shapes, sized so tiles do not divide it."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    image = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    cv2.rectangle(image, (20, 30), (90, 120), (255, 255, 255), -1)
+    cv2.circle(image, (110, 150), 35, (0, 0, 0), -1)
+    noise = rng.integers(0, 24, image.shape, dtype=np.uint8)
+    return cv2.add(image, noise)
+
+
+@pytest.mark.parametrize("tile", [16, 37, 128])
+@pytest.mark.parametrize("aperture", [3, 5, 7])
+@pytest.mark.parametrize("l2", [False, True])
+def test_matches_cv2_canny(tile, aperture, l2):
+    image = _image(seed=tile + aperture)
+    low, high = THRESHOLDS[aperture]
+    expected = cv2.Canny(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), low, high,
+                         apertureSize=aperture, L2gradient=l2)
+
+    out = np.empty(image.shape[:2], np.uint8)
+    TiledCanny(tile, workers=2, aperture_size=aperture, l2_gradient=l2).run(image, out, low, high)
+
+    assert np.count_nonzero(expected) > 100
+    np.testing.assert_array_equal(out, expected)
+
+
+def test_matches_cv2_canny_on_gray_input():
+    gray = cv2.cvtColor(_image(), cv2.COLOR_BGR2GRAY)
+    out = np.empty_like(gray)
+    TiledCanny(32, workers=2).run(gray, out, 50, 150)
+    np.testing.assert_array_equal(out, cv2.Canny(gray, 50, 150))
@@ -0,0 +1,357 @@
+"""
+Thread Budget - One CPU budget for OpenCV, BLAS/NumPy and worker pools
+
+Purpose: OpenCV parallelizes detectMultiScale, cvtColor, morphologyEx and
+friends internally, and BLAS libraries keep their own thread pools. Running N
+workers on top, each with a pool sized for the whole machine, oversubscribes
+the cores and throughput drops. A ThreadBudget splits the available CPUs into
+workers x threads and applies it:
+
+    cv2.setNumThreads(threads)           OpenCV's internal pool
+    OMP/OPENBLAS/MKL_NUM_THREADS ...     child processes and libraries loaded
+                                         later; threadpoolctl (if installed)
+                                         also limits pools already loaded
+    os.sched_setaffinity                 optional pinning, a CPU slice per worker
+
+Without measurements the split is workers x (cpus // workers). `tune` measures
+throughput for every split of a representative workload on this host and
+saves the results; ThreadBudget.tuned and configure use them from then on.
+
+Usage:
+    python thread_budget.py tune                 # measure detect, cloak and canny splits
+    python thread_budget.py tune --workloads canny --seconds 5
+    python thread_budget.py show
+
+    budget = ThreadBudget.tuned('canny', workers=None)   # best measured split
+    budget.apply()
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import cv2
+
+from color_lut import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+BLAS_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+)
+TUNED_FILE = os.path.join(CACHE_DIR, "thread_budget.json")
+WORKLOADS = ('detect', 'cloak', 'canny')
+# Frames per task while tuning; small enough to stop close to the time limit
+TUNE_BATCH = 4
+TUNE_SIZE = (1280, 720)
+
+
+def available_cpus():
+    """Return the sorted CPU ids this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def limit_blas_threads(threads):
+    """
+    Limit BLAS/OpenMP thread pools.
+
+    The environment variables reach child processes and libraries loaded
+    later; pools already loaded in this process are only limited through
+    threadpoolctl.
+
+    Returns:
+        True if loaded pools were limited too
+    """
+    for var in BLAS_ENV_VARS:
+        os.environ[var] = str(threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return False
+    threadpool_limits(threads)
+    return True
+
+
+def pin_cpus(cpus):
+    """Restrict the calling process to cpus. Returns False where affinity is unsupported."""
+    if not hasattr(os, 'sched_setaffinity'):
+        return False
+    try:
+        os.sched_setaffinity(0, cpus)
+    except OSError as e:
+        logger.warning("Could not pin to CPUs %s: %s", list(cpus), e)
+        return False
+    return True
+
+
+def load_tuned(path=TUNED_FILE):
+    """Return the saved tuning results by workload, or {} when there are none."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class ThreadBudget:
+    """
+    A split of the CPU budget into workers, each with a number of library threads.
+
+    Example:
+        budget = ThreadBudget(workers=4)       # 8 CPUs -> 4 workers x 2 threads
+        with ProcessPoolExecutor(budget.workers, initializer=budget.apply) as pool:
+            ...
+    """
+
+    def __init__(self, workers=1, threads=None, cpus=None, pin=False):
+        """
+        Args:
+            workers: Workers (processes or threads) sharing the budget; None
+                gives every CPU its own worker (or cpus // threads workers)
+            threads: OpenCV/BLAS threads per worker (default: cpus // workers)
+            cpus: CPU ids in the budget (default: this process's affinity set)
+            pin: Pin each worker to its own slice of cpus in apply()
+        """
+        self.cpus = sorted(cpus) if cpus else available_cpus()
+        count = len(self.cpus)
+        self.workers = workers or max(1, count // (threads or 1))
+        self.threads = threads or max(1, count // self.workers)
+        self.pin = pin
+        if self.workers * self.threads > count:
+            logger.warning("Thread budget oversubscribed: %d workers x %d threads on %d CPUs",
+                           self.workers, self.threads, count)
+
+    @classmethod
+    def tuned(cls, workload, workers=None, threads=None, pin=False, path=TUNED_FILE):
+        """
+        Budget from the saved measurements for workload, or the default split.
+
+        Args:
+            workload: Key of WORKLOADS the entry point resembles
+            workers: Fixed worker count; None takes the measured best
+            threads: Fixed thread count; None takes the measured best for the
+                worker count
+        """
+        entry = load_tuned(path).get(workload)
+        if entry and entry.get('cpus') == len(available_cpus()) and threads is None:
+            results = [r for r in entry['results'] if workers is None or r['workers'] == workers]
+            if results:
+                best = max(results, key=lambda r: r['per_second'])
+                return cls(best['workers'], best['threads'], pin=pin)
+        return cls(workers, threads, pin=pin)
+
+    def worker_cpus(self, index):
+        """CPU slice for worker index (slices wrap around when workers outnumber CPUs)."""
+        per_worker = max(1, len(self.cpus) // self.workers)
+        start = (index * per_worker) % len(self.cpus)
+        return self.cpus[start:start + per_worker]
+
+    def apply(self, index=None):
+        """
+        Apply the per-worker thread limits to the calling process.
+
+        Args:
+            index: Worker index for pinning; None pins to the whole budget
+
+        Returns:
+            self
+        """
+        cv2.setNumThreads(self.threads)
+        limit_blas_threads(self.threads)
+        if self.pin:
+            pin_cpus(self.cpus if index is None else self.worker_cpus(index))
+        logger.info("Thread budget: %d worker(s) x %d thread(s) on %d CPU(s)%s",
+                    self.workers, self.threads, len(self.cpus), ", pinned" if self.pin else "")
+        return self
+
+    def env(self):
+        """Environment variables carrying the per-worker limit to subprocesses."""
+        return {var: str(self.threads) for var in BLAS_ENV_VARS}
+
+    def as_dict(self):
+        return {'workers': self.workers, 'threads': self.threads, 'cpus': len(self.cpus), 'pin': self.pin}
+
+
+class ThreadLimitedStage:
+    """Pipeline stage wrapper running one stage with its own OpenCV thread count."""
+
+    def __init__(self, stage, threads):
+        self.stage = stage
+        self.threads = threads
+        self.name = getattr(stage, 'name', type(stage).__name__)
+
+    def process(self, ctx):
+        previous = cv2.getNumThreads()
+        cv2.setNumThreads(self.threads)
+        try:
+            return self.stage.process(ctx)
+        finally:
+            cv2.setNumThreads(previous)
+
+    def __getattr__(self, name):
+        return getattr(self.stage, name)
+
+
+def limit_stages(stages, stage_threads):
+    """
+    Give named stages their own OpenCV thread counts.
+
+    Build controllers such as autotune.LatencyController from the unwrapped
+    stages: they reassign stage attributes, which the wrapper only reads.
+
+    Args:
+        stages: Pipeline stages
+        stage_threads: Stage name -> threads; other stages keep the process setting
+    """
+    return [ThreadLimitedStage(stage, stage_threads[stage.name]) if getattr(stage, 'name', None) in stage_threads
+            else stage for stage in stages]
+
+
+def configure(workload, workers=1, threads=None, pin=False):
+    """Apply the tuned (or default) budget for a single-process entry point and return it."""
+    return ThreadBudget.tuned(workload, workers, threads, pin).apply()
+
+
+_tuning = {}
+
+
+def _init_tuning_worker(workload, threads):
+    import numpy as np
+
+    import benchmark
+
+    cv2.setNumThreads(threads)
+    limit_blas_threads(threads)
+    width, height = TUNE_SIZE
+    frame = np.ascontiguousarray(benchmark.synthetic_scene(width, height, 1)[:, :width])
+    _tuning['frame'] = frame
+    if workload == 'detect':
+        import model_registry
+
+        model_registry.preload(['face'])
+        _tuning['gray'] = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    elif workload == 'cloak':
+        from cloak import CLOAK_COLORS, CloakCompositor
+
+        _tuning['compositor'] = CloakCompositor(frame.shape, CLOAK_COLORS['Red'], flip=False)
+
+
+def _tuning_task(workload, count):
+    """Process count frames of workload in this worker and return count."""
+    import detectors
+
+    for _ in range(count):
+        if workload == 'detect':
+            detectors.detect_faces(_tuning['gray'], detect_width=640)
+        elif workload == 'cloak':
+            _tuning['compositor'].process(_tuning['frame'])
+        else:
+            cv2.Canny(cv2.cvtColor(_tuning['frame'], cv2.COLOR_BGR2GRAY), 100, 200)
+    return count
+
+
+def measure(workload, workers, threads, seconds=2.0):
+    """
+    Frames per second of workload with workers x threads.
+
+    Detection and cloak run in worker processes like detection_engine.py;
+    Canny runs on a thread pool like the edge_detect.py batch mode.
+    """
+    if workload not in WORKLOADS:
+        raise ValueError(f"Unknown workload: {workload}. Choose from {', '.join(WORKLOADS)}")
+    executor = ThreadPoolExecutor if workload == 'canny' else ProcessPoolExecutor
+    previous = cv2.getNumThreads()
+    try:
+        with executor(workers, initializer=_init_tuning_worker, initargs=(workload, threads)) as pool:
+            # Warm-up: start the workers, load models and build the frames
+            list(pool.map(_tuning_task, [workload] * workers, [1] * workers))
+            start = time.perf_counter()
+            done = 0
+            pending = {pool.submit(_tuning_task, workload, TUNE_BATCH) for _ in range(2 * workers)}
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                done += sum(future.result() for future in finished)
+                if time.perf_counter() - start < seconds:
+                    pending |= {pool.submit(_tuning_task, workload, TUNE_BATCH) for _ in finished}
+            elapsed = time.perf_counter() - start
+    finally:
+        cv2.setNumThreads(previous)
+    return done / elapsed
+
+
+def splits(cpus):
+    """Candidate (workers, threads) pairs: powers of two and cpus itself, workers * threads <= cpus."""
+    counts = sorted({1 << i for i in range(cpus.bit_length()) if 1 << i <= cpus} | {cpus})
+    return [(workers, threads) for workers in counts for threads in counts if workers * threads <= cpus]
+
+
+def tune(workloads=WORKLOADS, seconds=2.0, path=TUNED_FILE, progress=None):
+    """
+    Measure every split of each workload on this host and save the results.
+
+    Args:
+        workloads: Keys of WORKLOADS
+        seconds: Measurement time per split
+        path: JSON file read by ThreadBudget.tuned
+        progress: Optional callback(workload, result) per measured split
+
+    Returns:
+        The saved results by workload
+    """
+    cpus = len(available_cpus())
+    tuned = load_tuned(path)
+    for workload in workloads:
+        results = []
+        for workers, threads in splits(cpus):
+            result = {'workers': workers, 'threads': threads,
+                      'per_second': measure(workload, workers, threads, seconds)}
+            results.append(result)
+            if progress is not None:
+                progress(workload, result)
+        best = max(results, key=lambda r: r['per_second'])
+        tuned[workload] = {'cpus': cpus, 'best': best, 'results': results}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(tuned, f, indent=2)
+    return tuned
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find and inspect the thread split for this host.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    tune_parser = commands.add_parser('tune', help="Measure every workers x threads split and save the best")
+    tune_parser.add_argument('--workloads', nargs='+', choices=WORKLOADS, default=list(WORKLOADS))
+    tune_parser.add_argument('--seconds', type=float, default=2.0, help="Measurement time per split")
+    commands.add_parser('show', help="Print the saved and default splits")
+    args = parser.parse_args()
+
+    if args.command == 'tune':
+        tune(args.workloads, args.seconds, progress=lambda workload, r: print(
+            f"{workload}: {r['workers']} worker(s) x {r['threads']} thread(s): {r['per_second']:.1f} frames/s"))
+        print(f"Saved to {TUNED_FILE}")
+
+    cpus = len(available_cpus())
+    tuned = load_tuned()
+    print(f"{cpus} CPU(s) available")
+    for workload in WORKLOADS:
+        entry = tuned.get(workload)
+        if entry and entry['cpus'] == cpus:
+            best = entry['best']
+            print(f"{workload}: {best['workers']} x {best['threads']} ({best['per_second']:.1f} frames/s, tuned)")
+        else:
+            default = ThreadBudget(None)
+            print(f"{workload}: {default.workers} x {default.threads} (default, not tuned)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    main()
@@ -0,0 +1,198 @@
+"""
+Tracking - Run a detector every N frames and track boxes in between
+
+Purpose: A Haar cascade pass costs far more than following boxes that are
+already known. TrackingDetector runs the real detector every N frames (or
+sooner when tracking confidence drops) and moves the boxes on the frames in
+between with pyramidal Lucas-Kanade optical flow on features inside each box.
+Boxes keep stable IDs across frames.
+"""
+
+import itertools
+
+import cv2
+import numpy as np
+
+LK_PARAMS = dict(winSize=(15, 15), maxLevel=2,
+                 criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+
+def iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes."""
+    ix = max(0, min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union > 0 else 0.0
+
+
+def split_tracks(tracks):
+    """Split update() output into parallel (ids, boxes) lists."""
+    return [track_id for track_id, _ in tracks], [box for _, box in tracks]
+
+
+class _Track:
+    __slots__ = ("track_id", "box", "points", "seed_count", "confidence")
+
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = tuple(float(v) for v in box)
+        self.points = np.empty((0, 1, 2), np.float32)
+        self.seed_count = 0
+        self.confidence = 1.0
+
+    def int_box(self):
+        return tuple(int(round(v)) for v in self.box)
+
+
+class TrackingDetector:
+    """
+    Hybrid detect/track wrapper around a box detector.
+
+    Example:
+        tracker = TrackingDetector(functools.partial(detect_faces, detect_width=640), detect_interval=5)
+        for track_id, (x, y, w, h) in tracker.update(gray):
+            ...
+    """
+
+    def __init__(self, detect, detect_interval=5, min_confidence=0.5,
+                 match_iou=0.3, max_points=30):
+        """
+        Args:
+            detect: Callable taking a grayscale frame, returning (x, y, w, h) boxes
+            detect_interval: Run the detector every N frames; 1 detects on
+                every frame and disables tracking
+            min_confidence: Re-detect early when any track's share of
+                surviving feature points falls below this
+            match_iou: Minimum IoU for a detection to keep an existing ID
+            max_points: Feature points seeded per box
+        """
+        if detect_interval < 1:
+            raise ValueError("detect_interval must be at least 1")
+        self.detect = detect
+        self.detect_interval = detect_interval
+        self.min_confidence = min_confidence
+        self.match_iou = match_iou
+        self.max_points = max_points
+
+        self.tracks = []
+        self.detected = False
+        self._ids = itertools.count(1)
+        self._prev_gray = None
+        self._since_detect = None
+
+    def reset(self):
+        """Forget all tracks; the next update() runs the detector."""
+        self.tracks = []
+        self._prev_gray = None
+        self._since_detect = None
+
+    def _needs_detection(self):
+        if self._since_detect is None or self._since_detect + 1 >= self.detect_interval:
+            return True
+        return any(track.confidence < self.min_confidence for track in self.tracks)
+
+    def update(self, gray):
+        """
+        Process one grayscale frame.
+
+        Returns:
+            List of (track_id, (x, y, w, h)) for every current box
+        """
+        if self._prev_gray is not None and self._prev_gray.shape != gray.shape:
+            self.reset()
+
+        if self._needs_detection():
+            self._run_detection(gray)
+        else:
+            self._track(gray)
+            self._since_detect += 1
+            self.detected = False
+
+        if self._prev_gray is None:
+            self._prev_gray = gray.copy()
+        else:
+            np.copyto(self._prev_gray, gray)
+        return [(track.track_id, track.int_box()) for track in self.tracks]
+
+    def _run_detection(self, gray):
+        boxes = [tuple(box) for box in self.detect(gray)]
+
+        # Greedy IoU matching so a detection keeps the ID of the track it overlaps
+        pairs = sorted(
+            ((iou(track.box, box), t, d) for t, track in enumerate(self.tracks) for d, box in enumerate(boxes)),
+            reverse=True,
+        )
+        matched_tracks, matched_boxes, tracks = set(), set(), []
+        for overlap, t, d in pairs:
+            if overlap < self.match_iou:
+                break
+            if t in matched_tracks or d in matched_boxes:
+                continue
+            matched_tracks.add(t)
+            matched_boxes.add(d)
+            track = self.tracks[t]
+            track.box = tuple(float(v) for v in boxes[d])
+            tracks.append(track)
+        for d, box in enumerate(boxes):
+            if d not in matched_boxes:
+                tracks.append(_Track(next(self._ids), box))
+
+        for track in tracks:
+            self._seed(track, gray)
+        self.tracks = tracks
+        self._since_detect = 0
+        self.detected = True
+
+    def _seed(self, track, gray):
+        x, y, w, h = track.int_box()
+        x0, y0 = max(0, x), max(0, y)
+        roi = gray[y0:y + h, x0:x + w]
+        points = None
+        if roi.size:
+            points = cv2.goodFeaturesToTrack(roi, self.max_points, 0.01, 3)
+        if points is None:
+            track.points = np.empty((0, 1, 2), np.float32)
+        else:
+            points[:, 0, 0] += x0
+            points[:, 0, 1] += y0
+            track.points = points
+        track.seed_count = len(track.points)
+        track.confidence = 1.0 if track.seed_count else 0.0
+
+    def _track(self, gray):
+        counts = [len(track.points) for track in self.tracks]
+        if not sum(counts):
+            for track in self.tracks:
+                track.confidence = 0.0
+            return
+
+        p0 = np.concatenate([track.points for track in self.tracks])
+        p1, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, p0, None, **LK_PARAMS)
+        p0r, status_back, _ = cv2.calcOpticalFlowPyrLK(gray, self._prev_gray, p1, None, **LK_PARAMS)
+        # Forward-backward check rejects points that drifted
+        good = (status.ravel() == 1) & (status_back.ravel() == 1) & \
+            (np.abs(p0 - p0r).reshape(-1, 2).max(axis=1) < 1.0)
+
+        start = 0
+        for track, count in zip(self.tracks, counts):
+            end = start + count
+            keep = good[start:end]
+            old, new = p0[start:end][keep], p1[start:end][keep]
+            start = end
+
+            track.confidence = len(new) / track.seed_count if track.seed_count else 0.0
+            track.points = new
+            if len(new) < 2:
+                continue
+
+            shift = np.median((new - old).reshape(-1, 2), axis=0)
+            old_spread = np.linalg.norm(old.reshape(-1, 2) - old.reshape(-1, 2).mean(axis=0), axis=1)
+            new_spread = np.linalg.norm(new.reshape(-1, 2) - new.reshape(-1, 2).mean(axis=0), axis=1)
+            valid = old_spread > 1e-3
+            scale = float(np.median(new_spread[valid] / old_spread[valid])) if valid.any() else 1.0
+
+            x, y, w, h = track.box
+            cx, cy = x + w / 2 + shift[0], y + h / 2 + shift[1]
+            w, h = w * scale, h * scale
+            track.box = (cx - w / 2, cy - h / 2, w, h)